@@ -0,0 +1,157 @@
+"""Admission control of the prompt pipeline and rate limiting of the upstream APIs.
+
+Requests that cannot start within their lane's max wait are rejected with 503 and a Retry-After
+header instead of piling up, and upstream calls are paced below the API quotas instead of being
+retried after 429 responses.
+"""
+import math
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable
+
+from settings import settings
+from telemetry import ADMISSIONS
+
+_admission_controller = None
+
+# lanes in the order of their priority, queued interactive requests always start before queued batch items
+LANES = ("interactive", "batch")
+
+
+class Overloaded(Exception):
+    """The worker or an upstream quota is saturated, the request may be retried after `retry_after` seconds."""
+
+    def __init__(self, message: str, retry_after: float = 1.0) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    """Rate limiter refilling `rate` tokens per second up to `capacity`, a rate of 0 disables it.
+
+    Callers reserve their tokens up front and sleep until the reservation is covered, so waiters are
+    served in arrival order without a lock, and a reservation that would wait longer than the caller's
+    max wait is refused right away.
+    """
+
+    def __init__(
+        self, name: str, rate: float, capacity: float | None = None, clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1.0, max_wait: float = math.inf) -> None:
+        """Wait until `amount` tokens are available, raise Overloaded if that takes longer than max_wait."""
+        if self.rate <= 0:
+            return
+        self._refill()
+        wait = max(0.0, (amount - self.tokens) / self.rate)
+        if wait > max_wait:
+            raise Overloaded(f"Rate limit of {self.name} exceeded", retry_after=wait)
+        self.tokens -= amount
+        if wait:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                self.tokens += amount
+                raise
+
+
+class AdmissionController:
+    """Bounds the pipeline executions in flight and the requests waiting for one, per priority lane.
+
+    Batch items may only hold `batch_max_in_flight` of the `max_in_flight` slots, so the rest stays
+    available to interactive requests.
+    """
+
+    def __init__(self, max_in_flight: int, batch_max_in_flight: int, max_queue: int) -> None:
+        self.max_in_flight = max_in_flight
+        self.lane_limits = {"interactive": max_in_flight, "batch": min(batch_max_in_flight, max_in_flight)}
+        self.max_queue = max_queue
+        self.in_flight = {lane: 0 for lane in LANES}
+        self.waiters: dict[str, deque[asyncio.Future]] = {lane: deque() for lane in LANES}
+
+    def _can_start(self, lane: str) -> bool:
+        return sum(self.in_flight.values()) < self.max_in_flight and self.in_flight[lane] < self.lane_limits[lane]
+
+    def _queued(self, lanes: tuple[str, ...] = LANES) -> int:
+        return sum(len(self.waiters[lane]) for lane in lanes)
+
+    async def acquire(self, lane: str, max_wait: float) -> None:
+        """Take a slot of the lane, waiting at most max_wait seconds in the queue."""
+        # requests of the lane and of higher priority lanes that are already waiting go first
+        ahead = self._queued(LANES[:LANES.index(lane) + 1])
+        if not ahead and self._can_start(lane):
+            self.in_flight[lane] += 1
+            ADMISSIONS.inc(lane=lane, result="admitted")
+            return
+        if self._queued() >= self.max_queue:
+            ADMISSIONS.inc(lane=lane, result="rejected")
+            raise Overloaded(f"Too many queued requests ({self.max_queue})", retry_after=max_wait)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters[lane].append(waiter)
+        try:
+            await asyncio.wait_for(waiter, max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as err:
+            if waiter in self.waiters[lane]:
+                self.waiters[lane].remove(waiter)
+            elif waiter.done() and not waiter.cancelled():
+                # the slot was granted while timing out, hand it to the next waiter
+                self.release(lane)
+            if isinstance(err, asyncio.TimeoutError):
+                ADMISSIONS.inc(lane=lane, result="timed_out")
+                raise Overloaded(f"No capacity within {max_wait}s", retry_after=max_wait) from None
+            raise
+        ADMISSIONS.inc(lane=lane, result="queued")
+
+    def release(self, lane: str) -> None:
+        """Free a slot of the lane and start the next waiters by priority."""
+        self.in_flight[lane] -= 1
+        for next_lane in LANES:
+            waiters = self.waiters[next_lane]
+            while waiters and self._can_start(next_lane):
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    self.in_flight[next_lane] += 1
+                    waiter.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, lane: str, max_wait: float) -> AsyncIterator[None]:
+        """Hold a slot of the lane for the duration of the block."""
+        await self.acquire(lane, max_wait)
+        try:
+            yield
+        finally:
+            self.release(lane)
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """Return the in-flight and queued counts per lane."""
+        return {lane: {"in_flight": self.in_flight[lane], "queued": len(self.waiters[lane])} for lane in LANES}
+
+
+def get_admission_controller() -> AdmissionController:
+    """Get or create the singleton admission controller of this worker."""
+    global _admission_controller
+    if _admission_controller is None:
+        _admission_controller = AdmissionController(
+            max_in_flight=settings.admission_max_in_flight,
+            batch_max_in_flight=settings.admission_batch_max_in_flight,
+            max_queue=settings.admission_max_queue,
+        )
+    return _admission_controller
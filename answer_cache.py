@@ -0,0 +1,134 @@
+"""Semantic cache of LLM answers keyed by query embedding similarity and retrieved context."""
+import logging
+import numpy as np
+
+from settings import settings
+from telemetry import CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+_answer_cache = None
+
+
+class SemanticAnswerCache:
+    """Serve a previous answer when a new question is a near-duplicate of an answered one.
+
+    A cached answer is reused when the cosine similarity of the query embeddings is at least
+    `similarity_threshold` and the vector search retrieved exactly the same set of vector ids,
+    which keeps the reuse safe with our deterministic (temperature=0) completions.
+    All entries are dropped when the corpus version of the vector index changes.
+    """
+
+    def __init__(self, max_entries: int = 1024, similarity_threshold: float = 0.97) -> None:
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.corpus_version = None
+
+        # unit length query embeddings, one row per slot, allocated on the first store
+        self.vectors: np.ndarray | None = None
+        self.context_ids: list[frozenset[str]] = []
+        self.answers: list[str] = []
+        self.llm_seconds: list[float] = []
+        self.last_used = np.zeros(max_entries, dtype=np.int64)
+        self.tick = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.saved_seconds = 0.0
+
+    def _sync_corpus_version(self, corpus_version) -> None:
+        if corpus_version != self.corpus_version:
+            if self.answers:
+                self.invalidations += 1
+                logger.info("Answer cache invalidated, corpus version changed to %s", corpus_version)
+            self.clear()
+            self.corpus_version = corpus_version
+
+    def clear(self) -> None:
+        """Drop every cached answer."""
+        self.vectors = None
+        self.context_ids = []
+        self.answers = []
+        self.llm_seconds = []
+        self.last_used[:] = 0
+
+    @staticmethod
+    def _normalize(query_vector: list[float]) -> np.ndarray:
+        vector = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, query_vector: list[float], vector_ids: list[str], corpus_version=None) -> str | None:
+        """Return the cached answer of a near-duplicate question with the same retrieved context or None."""
+        self._sync_corpus_version(corpus_version)
+        if not self.answers or self.max_entries == 0:
+            self.misses += 1
+            CACHE_LOOKUPS.inc(cache="answer", result="miss")
+            return None
+
+        similarities = self.vectors[:len(self.answers)] @ self._normalize(query_vector)
+        context = frozenset(vector_ids)
+        candidates = np.flatnonzero(similarities >= self.similarity_threshold)
+        for slot in candidates[np.argsort(-similarities[candidates])]:
+            if self.context_ids[slot] == context:
+                self.tick += 1
+                self.last_used[slot] = self.tick
+                self.hits += 1
+                CACHE_LOOKUPS.inc(cache="answer", result="hit")
+                self.saved_seconds += self.llm_seconds[slot]
+                return self.answers[slot]
+
+        self.misses += 1
+        CACHE_LOOKUPS.inc(cache="answer", result="miss")
+        return None
+
+    def store(
+        self, query_vector: list[float], vector_ids: list[str], answer: str, llm_seconds: float, corpus_version=None
+    ) -> None:
+        """Cache the answer generated for the query and its retrieved context."""
+        self._sync_corpus_version(corpus_version)
+        if self.max_entries == 0:
+            return
+
+        vector = self._normalize(query_vector)
+        if self.vectors is None:
+            self.vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+
+        if len(self.answers) < self.max_entries:
+            slot = len(self.answers)
+            self.context_ids.append(frozenset(vector_ids))
+            self.answers.append(answer)
+            self.llm_seconds.append(llm_seconds)
+        else:
+            slot = int(np.argmin(self.last_used))
+            self.context_ids[slot] = frozenset(vector_ids)
+            self.answers[slot] = answer
+            self.llm_seconds[slot] = llm_seconds
+
+        self.vectors[slot] = vector
+        self.tick += 1
+        self.last_used[slot] = self.tick
+
+    def stats(self) -> dict[str, int | float]:
+        """Return the hit rate and the LLM latency saved by the cache."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.answers),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "saved_llm_seconds": round(self.saved_seconds, 3),
+        }
+
+
+def get_answer_cache() -> SemanticAnswerCache:
+    """Get or create a singleton semantic answer cache instance."""
+    global _answer_cache
+    if _answer_cache is None:
+        _answer_cache = SemanticAnswerCache(
+            max_entries=settings.answer_cache_max_entries,
+            similarity_threshold=settings.answer_cache_similarity,
+        )
+    return _answer_cache
@@ -0,0 +1 @@
+"""Offline performance benchmarks of the RAG backend, see benchmarks/load_test.py."""
@@ -0,0 +1,14 @@
+"""The Barrel app with the upstream clients replaced by the fakes, for running under gunicorn.
+
+    BARREL_BENCHMARK_ARGS="--corpus-size 200000" uv run gunicorn benchmarks.fake_app:app
+
+The load test options in BARREL_BENCHMARK_ARGS set the corpus size and the fake latencies.
+"""
+import os
+import shlex
+
+from benchmarks.load_test import install_fakes, load_questions, parse_args, main
+
+args = parse_args(shlex.split(os.getenv("BARREL_BENCHMARK_ARGS", "")))
+install_fakes(args, load_questions(args.questions))
+app = main.app
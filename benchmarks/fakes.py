@@ -0,0 +1,209 @@
+"""Deterministic local stand-ins for the Voyage, Pinecone and Azure OpenAI clients.
+
+Each fake waits for a latency drawn from a log-normal distribution fitted to a median and a 99th
+percentile, so the pipeline sees realistic upstream timing without network access or API quota.
+"""
+import math
+import random
+import asyncio
+import hashlib
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+import numpy as np
+
+from settings import settings
+from admission import TokenBucket
+from embedding_cache import EmbeddingCache
+from context_builder import BuiltPrompt, get_context_builder
+from vector_store import Facets, VectorStore, QueryResults
+from vectordb_local import LocalVectorStore
+from telemetry import LLM_TOKENS, VOYAGE_TOKENS
+
+DIMENSION = 1024
+# z-score of the 99th percentile of the standard normal distribution
+Z_P99 = 2.326
+
+
+@dataclass
+class LatencyModel:
+    """Log-normal latency in seconds with the given median and 99th percentile."""
+    median: float = 0.0
+    p99: float = 0.0
+    seed: int = 0
+
+    def __post_init__(self) -> None:
+        self.random = random.Random(self.seed)
+        self.sigma = math.log(self.p99 / self.median) / Z_P99 if 0 < self.median < self.p99 else 0.0
+
+    @classmethod
+    def parse(cls, spec: str, seed: int = 0) -> "LatencyModel":
+        """Build the model from a "median[,p99]" string of milliseconds, e.g. "80,400"."""
+        values = [float(value) / 1000 for value in spec.split(",")]
+        return cls(values[0], values[-1], seed)
+
+    def sample(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        return self.median * math.exp(self.sigma * self.random.gauss(0.0, 1.0))
+
+    async def wait(self) -> None:
+        await asyncio.sleep(self.sample())
+
+
+def text_vector(text: str) -> np.ndarray:
+    """Unit vector derived from the text only, the same text always gets the same vector."""
+    seed = int.from_bytes(hashlib.sha256(" ".join(text.casefold().split()).encode()).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(DIMENSION).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def build_corpus(
+    questions: list[tuple[str, str]],
+    size: int = 10_000,
+    chunks_per_question: int = 4,
+    seed: int = 0,
+    quantization: str = "none",
+    index: str = "flat",
+) -> LocalVectorStore:
+    """Vector store of chunks near the question vectors, padded with unrelated chunks up to `size`.
+
+    The answers of the questions are the contents of their chunks, so the retrieved contexts and
+    the prompts packed from them have realistic sizes.
+    """
+    rng = np.random.default_rng(seed)
+    records = {}
+    for number, (question, answer) in enumerate(questions):
+        anchor = text_vector(question)
+        for chunk in range(chunks_per_question):
+            # noise of norm ~0.5 keeps the cosine similarity of the chunks to their question around 0.9
+            noise = rng.standard_normal(DIMENSION).astype(np.float32) * 0.5 / math.sqrt(DIMENSION)
+            records[f"q{number}-{chunk}"] = {
+                "values": anchor + noise * (1 + chunk / 2),
+                "metadata": {
+                    "source": f"https://docs.example.com/q{number}",
+                    "title": question,
+                    "header_0": f"Section {chunk}",
+                    "content": f"{answer} (part {chunk})",
+                },
+                "namespace": f"ns{number % 4}",
+            }
+    filler = (answer for _, answer in questions * (size // max(len(questions), 1) + 1))
+    for number in range(max(size - len(records), 0)):
+        records[f"filler-{number}"] = {
+            "values": rng.standard_normal(DIMENSION).astype(np.float32),
+            "metadata": {"source": f"https://docs.example.com/filler/{number % 500}", "content": next(filler)},
+            "namespace": f"ns{number % 4}",
+        }
+    return LocalVectorStore.from_records(records, quantization, index)
+
+
+class FakeEmbedder:
+    """Stand-in of VoyageEmbedder returning text_vector() embeddings after a simulated API latency."""
+
+    model = "fake-embedding"
+
+    def __init__(self, latency: LatencyModel) -> None:
+        self.latency = latency
+        self.closed = False
+        self.cache = EmbeddingCache(max_entries=settings.embed_cache_max_entries, ttl_seconds=settings.embed_cache_ttl)
+        self.semaphore = asyncio.Semaphore(settings.embed_concurrency)
+        self.rate_limiter = TokenBucket("Voyage", settings.voyage_rps)
+
+    async def warmup(self) -> None:
+        """Nothing to warm up."""
+
+    async def close(self) -> None:
+        """Close the cache."""
+        self.closed = True
+        self.cache.close()
+
+    async def embed_query(self, prompt: str) -> list[float]:
+        """Embed a user prompt, cached like the real client."""
+        return (await self.embed_queries([prompt]))[0]
+
+    async def embed_queries(self, prompts: list[str]) -> list[list[float]]:
+        """Embed many user prompts with a single simulated request for the uncached ones."""
+        embeddings = {
+            prompt: await self.cache.get(prompt, self.model, "query") for prompt in dict.fromkeys(prompts)
+        }
+        missing = [prompt for prompt, embedding in embeddings.items() if embedding is None]
+        if missing:
+            await self.rate_limiter.acquire(max_wait=settings.rate_limit_max_wait)
+            async with self.semaphore:
+                await self.latency.wait()
+            VOYAGE_TOKENS.inc(sum(len(prompt) // 4 + 1 for prompt in missing), operation="embed")
+            for prompt in missing:
+                embeddings[prompt] = text_vector(prompt).tolist()
+                self.cache.put(prompt, self.model, "query", embeddings[prompt])
+        return [embeddings[prompt] for prompt in prompts]
+
+
+class FakeVectorStore(VectorStore):
+    """Local vector store answering after a simulated Pinecone round trip."""
+
+    def __init__(self, store: LocalVectorStore, latency: LatencyModel) -> None:
+        self.store = store
+        self.latency = latency
+        self.corpus_version = store.corpus_version
+        self.semaphore = asyncio.Semaphore(settings.vector_query_concurrency)
+        self.rate_limiter = TokenBucket("Pinecone", settings.pinecone_rps)
+
+    async def warmup(self) -> None:
+        """Encode the quantized codes and build the IVF index of the corpus."""
+        await self.store.warmup()
+
+    async def query(
+        self,
+        input_vector: list[float],
+        top_k=10,
+        namespaces: list[str] | None = None,
+        sources: list[str] | None = None,
+        nprobe: int | None = None,
+        metadata_filter: dict | None = None,
+    ) -> QueryResults:
+        await self.rate_limiter.acquire(max_wait=settings.rate_limit_max_wait)
+        async with self.semaphore:
+            await self.latency.wait()
+        return await self.store.query(input_vector, top_k, namespaces, sources, nprobe, metadata_filter)
+
+    def facets(self) -> Facets | None:
+        return self.store.facets()
+
+
+class FakeLLM:
+    """Stand-in of SuperPrompt streaming a canned answer with a simulated time to first token and token rate."""
+
+    deployment = "gpt-4.1"
+
+    def __init__(self, first_token_latency: LatencyModel, token_latency: LatencyModel, answer_tokens: int = 120):
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.answer_tokens = answer_tokens
+        self.semaphore = asyncio.Semaphore(settings.llm_concurrency)
+        self.request_limiter = TokenBucket("Azure OpenAI requests", settings.llm_rps)
+        self.context_builder = get_context_builder(self.deployment)
+
+    async def warmup(self) -> None:
+        """Load the tokenizer like the real client."""
+        await asyncio.to_thread(self.context_builder.load)
+
+    async def close(self) -> None:
+        """Nothing to close."""
+
+    def build_prompt(self, prompt: str, matches: list, max_context_tokens: int) -> BuiltPrompt:
+        return self.context_builder.build(prompt, matches, max_context_tokens)
+
+    async def process_prompt(self, super_prompt: str, prompt_tokens: int | None = None) -> str:
+        return "".join([token async for token in self.stream_prompt(super_prompt, prompt_tokens)])
+
+    async def stream_prompt(self, super_prompt: str, prompt_tokens: int | None = None) -> AsyncIterator[str]:
+        await self.request_limiter.acquire(max_wait=settings.rate_limit_max_wait)
+        async with self.semaphore:
+            await self.first_token_latency.wait()
+            for number in range(self.answer_tokens):
+                if number:
+                    await self.token_latency.wait()
+                yield f"token{number} "
+        LLM_TOKENS.inc(self.context_builder.count_tokens(super_prompt), kind="prompt")
+        LLM_TOKENS.inc(self.answer_tokens, kind="completion")
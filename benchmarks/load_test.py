@@ -0,0 +1,238 @@
+"""Offline load test of the Barrel app against the local stand-ins of benchmarks/fakes.py.
+
+The real FastAPI app is served by uvicorn on a local port, with the Voyage, Pinecone and Azure OpenAI
+clients replaced by fakes with the given latency distributions ("median[,p99]" in milliseconds).
+A closed-loop load generator sends the questions of the test suites concurrently and reports the
+throughput, the p50 / p95 / p99 latency of every pipeline stage (from the Server-Timing headers)
+and the peak memory use. Every BARREL_* setting applies, e.g. BARREL_RERANKER=none.
+
+    uv run python -m benchmarks.load_test --requests 500 --concurrency 32 --llm-first-token 400,1500
+
+The load generator shares the event loop with the server, compare runs made on the same machine.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import asyncio
+import logging
+import argparse
+import resource
+from dataclasses import dataclass, field
+
+import httpx
+import numpy as np
+import uvicorn
+import yaml
+
+# the fakes need no keys, the real clients are still constructed by the imported modules
+for _name in ("EMBEDDER_API_KEY", "VECTOR_DB_API_KEY", "LLM_API_KEY"):
+    os.environ.setdefault(_name, "offline-benchmark")
+
+import main
+import vector_store
+import vectordb_local
+import llm_client_azure
+import embedding_client_voyage
+from settings import settings
+from benchmarks.fakes import FakeEmbedder, FakeLLM, FakeVectorStore, LatencyModel, build_corpus
+
+QUESTION_FILES = "tests/azure-docs/az-networking-*.yaml"
+ENDPOINTS = {"prompt": "/user_prompt", "stream": "/user_prompt/stream", "batch": "/user_prompt/batch"}
+
+
+@dataclass
+class Sample:
+    """Outcome of a single request of the load test."""
+    status: int
+    seconds: float
+    # seconds until the first answer token of a streamed request
+    first_token: float | None = None
+    stages: dict[str, float] = field(default_factory=dict)
+
+
+def load_questions(pattern: str = QUESTION_FILES) -> list[tuple[str, str]]:
+    """(question, reference answer) pairs of the test suites."""
+    questions = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, "r", encoding="UTF-8") as file:
+            items = yaml.safe_load(file)["questions"]
+        questions.extend((item["question"].strip(), item["answer"].strip()) for item in items)
+    return questions
+
+
+def install_fakes(args: argparse.Namespace, questions: list[tuple[str, str]]) -> None:
+    """Replace the singleton upstream clients with the fakes before the app starts."""
+    settings.server_timing = 1
+    if args.no_caches:
+        settings.embed_cache_max_entries = 0
+        settings.answer_cache_max_entries = 0
+
+    corpus = build_corpus(
+        questions, size=args.corpus_size, seed=args.seed,
+        quantization=settings.vector_quantization, index=settings.vector_index,
+    )
+    # the lexical index and the vector sync use the replica, the queries go through the fake Pinecone
+    vectordb_local._vector_replica = corpus
+    vector_store._vector_store = FakeVectorStore(corpus, LatencyModel.parse(args.vector_latency, args.seed + 1))
+    embedding_client_voyage._embedder_client = FakeEmbedder(LatencyModel.parse(args.embed_latency, args.seed + 2))
+    llm_client_azure._llm_client = FakeLLM(
+        LatencyModel.parse(args.llm_first_token, args.seed + 3),
+        LatencyModel.parse(args.llm_token, args.seed + 4),
+        answer_tokens=args.answer_tokens,
+    )
+
+
+def parse_server_timing(header: str | None) -> dict[str, float]:
+    """Stage durations in seconds of a Server-Timing header."""
+    stages = {}
+    for entry in filter(None, (header or "").split(",")):
+        name, _, duration = entry.strip().partition(";dur=")
+        stages[name] = float(duration) / 1000
+    return stages
+
+
+async def send(client: httpx.AsyncClient, endpoint: str, prompts: list[str]) -> Sample:
+    started = time.perf_counter()
+    if endpoint == "batch":
+        response = await client.post(ENDPOINTS[endpoint], json={"prompts": prompts})
+        return Sample(response.status_code, time.perf_counter() - started, stages=parse_server_timing(
+            response.headers.get("server-timing")
+        ))
+
+    async with client.stream("POST", ENDPOINTS[endpoint], params={"prompt": prompts[0]}, json={}) as response:
+        first_token = None
+        async for chunk in response.aiter_text():
+            if first_token is None and "event: token" in chunk:
+                first_token = time.perf_counter() - started
+        return Sample(
+            response.status_code,
+            time.perf_counter() - started,
+            first_token,
+            parse_server_timing(response.headers.get("server-timing")),
+        )
+
+
+async def generate_load(client: httpx.AsyncClient, args: argparse.Namespace, questions: list[str]) -> list[Sample]:
+    """Send args.requests requests from args.concurrency concurrent clients, cycling through the questions."""
+    queue = asyncio.Queue()
+    for number in range(args.requests):
+        first = number * args.batch_size
+        queue.put_nowait([questions[(first + item) % len(questions)] for item in range(args.batch_size)])
+    samples = []
+
+    async def worker() -> None:
+        while not queue.empty():
+            prompts = queue.get_nowait()
+            try:
+                samples.append(await send(client, args.endpoint, prompts))
+            except httpx.HTTPError as err:
+                print(f"Request failed: {err!r}", file=sys.stderr)
+                samples.append(Sample(status=0, seconds=0.0))
+
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    return samples
+
+
+def summarize(samples: list[Sample], seconds: float) -> dict:
+    """Throughput, error count and latency percentiles in milliseconds per stage."""
+    ok = [sample for sample in samples if sample.status == 200]
+    series = {"total": [sample.seconds for sample in ok]}
+    series["first_token"] = [sample.first_token for sample in ok if sample.first_token is not None]
+    for sample in ok:
+        for stage, duration in sample.stages.items():
+            if stage != "total":
+                series.setdefault(stage, []).append(duration)
+
+    stages = {}
+    for stage, values in series.items():
+        if values:
+            p50, p95, p99 = np.percentile(np.array(values) * 1000, [50, 95, 99])
+            stages[stage] = {"count": len(values), "p50_ms": p50, "p95_ms": p95, "p99_ms": p99}
+    return {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "seconds": seconds,
+        "throughput_rps": len(samples) / seconds if seconds else 0.0,
+        "stages": stages,
+        # kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict:
+    """Start the app with the fakes on a local port, warm it up, run the load and stop it."""
+    questions = load_questions(args.questions)
+    if not questions:
+        raise ValueError(f"No questions found in {args.questions}")
+    install_fakes(args, questions)
+
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=args.port, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=300) as client:
+            while (await _get_ready(client)) != 200:
+                if serving.done():
+                    raise RuntimeError("The server stopped during startup")
+                await asyncio.sleep(0.05)
+
+            started = time.perf_counter()
+            samples = await generate_load(client, args, [question for question, _ in questions])
+            return summarize(samples, time.perf_counter() - started)
+    finally:
+        server.should_exit = True
+        await serving
+
+
+async def _get_ready(client: httpx.AsyncClient) -> int:
+    try:
+        return (await client.get("/ready")).status_code
+    except httpx.TransportError:
+        return 0
+
+
+def print_report(report: dict) -> None:
+    print(
+        f"{report['requests']} requests in {report['seconds']:.1f}s: {report['throughput_rps']:.1f} req/s,"
+        f" {report['errors']} errors, peak RSS {report['peak_rss_mb']:.0f} MB"
+    )
+    print(f"{'stage':<16}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, values in report["stages"].items():
+        percentiles = "".join(f"{values[key]:>10.1f}" for key in ("p50_ms", "p95_ms", "p99_ms"))
+        print(f"{stage:<16}{values['count']:>8}{percentiles}")
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoint", choices=sorted(ENDPOINTS), default="prompt")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=1, help="prompts per request of the batch endpoint")
+    parser.add_argument("--questions", default=QUESTION_FILES, help="glob of the test suite files")
+    parser.add_argument("--corpus-size", type=int, default=10_000, help="number of vectors of the fake index")
+    parser.add_argument("--embed-latency", default="60,250", help="median[,p99] of a Voyage request in ms")
+    parser.add_argument("--vector-latency", default="40,200", help="median[,p99] of a Pinecone query in ms")
+    parser.add_argument("--llm-first-token", default="500,2000", help="median[,p99] LLM time to first token in ms")
+    parser.add_argument("--llm-token", default="15,40", help="median[,p99] LLM time between tokens in ms")
+    parser.add_argument("--answer-tokens", type=int, default=120)
+    parser.add_argument("--no-caches", action="store_true", help="disable the embedding and answer caches")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args(argv)
+    if args.endpoint != "batch":
+        args.batch_size = 1
+    return args
+
+
+if __name__ == "__main__":
+    # one log line per request of the load generator would distort the measurements
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    arguments = parse_args()
+    benchmark_report = asyncio.run(run_benchmark(arguments))
+    print_report(benchmark_report)
+    if arguments.json:
+        with open(arguments.json, "w", encoding="UTF-8") as report_file:
+            json.dump({"args": vars(arguments), **benchmark_report}, report_file, indent=2)
@@ -0,0 +1,116 @@
+"""Recall, memory and latency of the quantized local vector search against the exact search.
+
+Queries the same corpus with every quantization and rescore factor and compares the top_k ids with
+those of the exact float32 search. The corpus is the fake corpus of the load test, or the active
+snapshot of a synced replica with --snapshot, queried with noisy copies of its own vectors.
+Only the few chunks per question of the fake corpus are similar to a query, the order of the random
+filler vectors behind them is noise, so measure recall at a top_k near the chunks per question there.
+
+    uv run python -m benchmarks.quantization --corpus-size 200000 --top-k 10 --rescore 2,4,8
+"""
+import json
+import time
+import asyncio
+import argparse
+
+import numpy as np
+
+from settings import settings
+from vectordb_local import LocalVectorStore
+from benchmarks.fakes import build_corpus, text_vector
+from benchmarks.load_test import QUESTION_FILES, load_questions
+
+
+def load_corpus(args: argparse.Namespace, quantization: str) -> tuple[LocalVectorStore, list[np.ndarray]]:
+    """Corpus with the quantization and the query vectors."""
+    rng = np.random.default_rng(args.seed)
+    if args.snapshot:
+        store = LocalVectorStore.load(args.snapshot, quantization)
+        rows = rng.choice(store.base_count, size=min(args.queries, store.base_count), replace=False)
+        queries = [np.asarray(store.vectors[row]) for row in rows]
+    else:
+        questions = load_questions(args.questions)
+        store = build_corpus(questions, size=args.corpus_size, seed=args.seed, quantization=quantization)
+        queries = [text_vector(questions[number % len(questions)][0]) for number in range(args.queries)]
+    dimension = len(queries[0])
+    # paraphrased questions do not embed to exactly the stored vectors
+    return store, [query + rng.standard_normal(dimension).astype(np.float32) * args.noise / np.sqrt(dimension)
+                   for query in queries]
+
+
+def measure(store: LocalVectorStore, queries: list[np.ndarray], top_k: int) -> tuple[list[list[str]], np.ndarray]:
+    """Result ids and latencies in seconds of the queries."""
+    results, latencies = [], []
+    for query in queries:
+        started = time.perf_counter()
+        matches = asyncio.run(store.query(query.tolist(), top_k=top_k)).matches
+        latencies.append(time.perf_counter() - started)
+        results.append([match.id for match in matches])
+    return results, np.array(latencies)
+
+
+def recall(results: list[list[str]], exact: list[list[str]]) -> float:
+    """Mean share of the exact top_k ids that are in the approximate top_k."""
+    return float(np.mean([len(set(found) & set(expected)) / max(len(expected), 1)
+                          for found, expected in zip(results, exact)]))
+
+
+def run_benchmark(args: argparse.Namespace) -> list[dict]:
+    rows = []
+    exact = None
+    for quantization in ["none"] + args.quantizations:
+        store, queries = load_corpus(args, quantization)
+        if store.quantizer is not None:
+            started = time.perf_counter()
+            asyncio.run(store.warmup())
+            encode_seconds = time.perf_counter() - started
+        else:
+            encode_seconds = 0.0
+        for rescore in ([1] if quantization == "none" else args.rescore):
+            settings.quantization_rescore = rescore
+            results, latencies = measure(store, queries, args.top_k)
+            exact = exact or results
+            p50, p95 = np.percentile(latencies * 1000, [50, 95])
+            rows.append({
+                "quantization": quantization,
+                "rescore": rescore,
+                "recall": recall(results, exact),
+                "p50_ms": p50,
+                "p95_ms": p95,
+                "scanned_mb": (store.codes_nbytes() or store.vectors.nbytes) / 2**20,
+                "encode_seconds": encode_seconds,
+            })
+    return rows
+
+
+def print_report(rows: list[dict], top_k: int) -> None:
+    print(f"{'quantization':<14}{'rescore':>8}{f'recall@{top_k}':>12}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'scanned MB':>12}{'encode s':>10}")
+    for row in rows:
+        print(f"{row['quantization']:<14}{row['rescore']:>8}{row['recall']:>12.4f}{row['p50_ms']:>10.2f}"
+              f"{row['p95_ms']:>10.2f}{row['scanned_mb']:>12.1f}{row['encode_seconds']:>10.2f}")
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quantizations", default="int8,binary", type=lambda value: value.split(","))
+    parser.add_argument("--rescore", default="2,4,8", type=lambda value: [int(factor) for factor in value.split(",")],
+                        help="shortlist sizes to rescore, as multiples of top_k")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.3, help="norm of the noise added to the query vectors")
+    parser.add_argument("--questions", default=QUESTION_FILES, help="glob of the test suite files")
+    parser.add_argument("--corpus-size", type=int, default=100_000, help="number of vectors of the fake corpus")
+    parser.add_argument("--snapshot", help="snapshot root directory to query instead of the fake corpus")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    report = run_benchmark(arguments)
+    print_report(report, arguments.top_k)
+    if arguments.json:
+        with open(arguments.json, "w", encoding="UTF-8") as report_file:
+            json.dump({"args": vars(arguments), "results": report}, report_file, indent=2)
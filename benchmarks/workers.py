@@ -0,0 +1,116 @@
+"""Memory per worker of the gunicorn server, with and without preloading the app.
+
+Starts gunicorn.conf.py with benchmarks/fake_app.py on a local port, sends a few requests to every
+worker and reports the resident (RSS), proportional (PSS, shared pages split between the processes)
+and private (USS) memory of each process from /proc. Linux only.
+
+    uv run python -m benchmarks.workers --workers 4 --corpus-size 200000
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+import httpx
+
+from benchmarks.load_test import load_questions
+
+
+def memory_of(pid: int) -> dict[str, float]:
+    """RSS, PSS and USS of a process in MB."""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r", encoding="UTF-8") as file:
+        for line in file:
+            name, _, value = line.partition(":")
+            if value.strip().endswith("kB"):
+                values[name] = int(value.split()[0]) / 1024
+    return {
+        "rss_mb": values["Rss"],
+        "pss_mb": values["Pss"],
+        "uss_mb": values["Private_Clean"] + values["Private_Dirty"],
+    }
+
+
+def children_of(pid: int) -> list[int]:
+    with open(f"/proc/{pid}/task/{pid}/children", "r", encoding="UTF-8") as file:
+        return [int(child) for child in file.read().split()]
+
+
+def measure(args: argparse.Namespace, preload: bool) -> dict:
+    """Start the server, wait for its workers, load them and measure the memory of every process."""
+    env = {
+        **os.environ,
+        "BARREL_BIND": f"127.0.0.1:{args.port}",
+        "BARREL_WORKERS": str(args.workers),
+        "BARREL_PRELOAD": str(int(preload)),
+        "BARREL_LOG_LEVEL": "WARNING",
+        "BARREL_BENCHMARK_ARGS": f"--corpus-size {args.corpus_size} --llm-first-token 0 --llm-token 0",
+    }
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "benchmarks.fake_app:app"], env=env
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{args.port}", timeout=60) as client:
+            while len(children_of(server.pid)) < args.workers or _get_ready(client) != 200:
+                if server.poll() is not None:
+                    raise RuntimeError(f"gunicorn exited with {server.returncode}")
+                time.sleep(0.1)
+            startup_seconds = time.perf_counter() - started
+            # new connections are spread over the workers by the kernel
+            questions = load_questions()
+            for number in range(args.requests):
+                with httpx.Client(base_url=f"http://127.0.0.1:{args.port}", timeout=60) as request_client:
+                    question = questions[number % len(questions)][0]
+                    request_client.post("/user_prompt", params={"prompt": question}, json={})
+            # workers that did not answer yet still finish their warmup
+            time.sleep(2)
+        workers = [memory_of(pid) for pid in children_of(server.pid)]
+        return {
+            "preload": preload,
+            "startup_seconds": startup_seconds,
+            "master": memory_of(server.pid),
+            "workers": workers,
+            "total_pss_mb": memory_of(server.pid)["pss_mb"] + sum(worker["pss_mb"] for worker in workers),
+        }
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def _get_ready(client: httpx.Client) -> int:
+    try:
+        return client.get("/ready").status_code
+    except httpx.TransportError:
+        return 0
+
+
+def print_report(reports: list[dict]) -> None:
+    print(f"{'preload':<9}{'process':<10}{'RSS MB':>10}{'PSS MB':>10}{'USS MB':>10}")
+    for report in reports:
+        for name, memory in [("master", report["master"])] + [("worker", worker) for worker in report["workers"]]:
+            print(f"{str(report['preload']):<9}{name:<10}"
+                  f"{memory['rss_mb']:>10.0f}{memory['pss_mb']:>10.0f}{memory['uss_mb']:>10.0f}")
+        print(f"{str(report['preload']):<9}{'total':<10}{'':>10}{report['total_pss_mb']:>10.0f}"
+              f"   started in {report['startup_seconds']:.1f}s")
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--corpus-size", type=int, default=100_000, help="number of vectors of the fake index")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--json", help="also write the report to this file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    benchmark_reports = [measure(arguments, preload) for preload in (False, True)]
+    print_report(benchmark_reports)
+    if arguments.json:
+        with open(arguments.json, "w", encoding="UTF-8") as report_file:
+            json.dump({"args": vars(arguments), "results": benchmark_reports}, report_file, indent=2)
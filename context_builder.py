@@ -0,0 +1,179 @@
+"""Token-budgeted assembly of the LLM prompt from the selected context chunks."""
+import logging
+import json
+from dataclasses import dataclass
+
+import tiktoken
+
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+_context_builders = {}
+
+# instructions shared by the LLM clients, formatted with the question and the packed context
+PROMPT_TEMPLATE = """
+Here is a question: {question}
+
+Please answer the question exclusively based on the documentation articles retrieved from our vector database, below encapsulated in the optional json block in the content key with a lot of metadata. If there is no relevant information in the documentation articles, please state to the user that "we don't have relevant enough information in our vector store to answer this specific question"
+
+The relevance of the articles are expressed in a numerical value in matches[].score, the higher the value the more relevant the article to our question. Please consider all the metadata when trying to answer the user's question.
+
+Make sure you don't use your own knowledge or anything to answer the question, ONLY the information in the documentation articles.
+
+Make double check that you include all the json data in the response.
+
+If there are articles to cite, then cite the relevant article(s) just saying "most relevant article(s):" verbatim in the following json format in a list (omit the keys where there was no value in the original retrieved documentation article json):
+Please omit the empty json keys where there is no value
+Please format your answer itself in markdown format (not the citation part)
+[
+    {{
+    "citation": {{
+        "www": "",
+        "source_url": "",
+        "web_url": "",
+        "content": "",
+        "source_format": "",
+        "main_category": "",
+        "sub_category": "",
+        "markdown.data": {{
+        "main_header": "",
+        "header_0": "",
+        "header_1": "",
+        "header_2": "",
+        "header_3": "",
+        }}
+        "ms.headers": {{
+        "title": "",
+        "titleSuffix": "",
+        "description": "",
+        "ms.custom": "",
+        "ms.date": "",
+        "ms.service": "",
+        "ms.topic": "",
+        "intent": "",
+        }},
+    }}
+    }}
+]
+
+Here are the documentation articles as a context to answer the question from:
+
+{context_text}
+"""
+
+# metadata values carrying no information for the LLM
+EMPTY_VALUES = (None, "", "N/A", [], {})
+# encoding of models unknown to the installed tiktoken version, e.g. gpt-4.1
+FALLBACK_ENCODING = "o200k_base"
+CHARS_PER_TOKEN = 4
+
+
+@dataclass
+class BuiltPrompt:
+    """Prompt of a single request with its token accounting."""
+    text: str
+    chunks: list
+    prompt_tokens: int
+    context_tokens: int
+    dropped_chunks: int = 0
+
+
+def render_chunk(match) -> str:
+    """Serialize a match as a compact json object without empty or repeated metadata values."""
+    metadata = match.metadata or {}
+    fields = {"score": round(match.score, 4)}
+    seen_values = set()
+    # alphabetical order with the content last, so the LLM reads the headers first
+    for key in sorted(metadata, key=lambda key: (key == "content", key)):
+        value = metadata[key]
+        if value in EMPTY_VALUES:
+            continue
+        marker = json.dumps(value, sort_keys=True, ensure_ascii=False)
+        if marker in seen_values:
+            continue
+        seen_values.add(marker)
+        fields[key] = value
+    return json.dumps(fields, ensure_ascii=False)
+
+
+class ContextBuilder:
+    """Pack the highest-scoring chunks into a token budget, counted with the tokenizer of the model."""
+
+    def __init__(self, model: str, max_prompt_tokens: int) -> None:
+        self.model = model
+        self.max_prompt_tokens = max_prompt_tokens
+        self.encoding = None
+        self.template_tokens = None
+
+    def load(self) -> None:
+        """Load the tokenizer and count the tokens of the static template, done once per worker."""
+        if self.template_tokens is not None:
+            return
+        try:
+            try:
+                self.encoding = tiktoken.encoding_for_model(self.model)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding(FALLBACK_ENCODING)
+        except (OSError, ValueError) as err:  # the encoding files are downloaded and checked on first use
+            logger.warning("Failed to load the tokenizer of %s, estimating token counts instead: %s", self.model, err)
+            self.encoding = None
+        self.template_tokens = self.count_tokens(PROMPT_TEMPLATE.format(question="", context_text=""))
+
+    def count_tokens(self, text: str) -> int:
+        """Number of tokens of a text."""
+        if self.encoding is None:
+            return len(text) // CHARS_PER_TOKEN + 1
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Cut a text to at most max_tokens tokens."""
+        if self.encoding is None:
+            return text[:max(max_tokens - 1, 0) * CHARS_PER_TOKEN]
+        return self.encoding.decode(self.encoding.encode(text, disallowed_special=())[:max_tokens])
+
+    def build(self, question: str, matches: list, max_context_tokens: int) -> BuiltPrompt:
+        """Fill the template with as many of the matches, in the given order, as fit into the budget.
+
+        Matches that do not fit are skipped in favor of smaller lower-scoring ones. If not even the
+        first match fits, its serialized form is truncated so the prompt never overflows the limit.
+        """
+        self.load()
+        budget = min(max_context_tokens, self.max_prompt_tokens - self.template_tokens - self.count_tokens(question))
+        budget = max(budget, 0)
+
+        blocks = []
+        chunks = []
+        context_tokens = 0
+        for match in matches:
+            block = render_chunk(match)
+            # +1 for the newline separating the blocks
+            tokens = self.count_tokens(block) + 1
+            if context_tokens + tokens > budget:
+                continue
+            blocks.append(block)
+            chunks.append(match)
+            context_tokens += tokens
+
+        if not chunks and matches and budget:
+            blocks.append(self.truncate(render_chunk(matches[0]), budget - 1))
+            chunks.append(matches[0])
+            context_tokens = self.count_tokens(blocks[0]) + 1
+
+        text = PROMPT_TEMPLATE.format(question=question, context_text="\n".join(blocks))
+        return BuiltPrompt(
+            text=text,
+            chunks=chunks,
+            prompt_tokens=self.count_tokens(text),
+            context_tokens=context_tokens,
+            dropped_chunks=len(matches) - len(chunks),
+        )
+
+
+def get_context_builder(model: str) -> ContextBuilder:
+    """Get or create the singleton context builder of a model."""
+    builder = _context_builders.get(model)
+    if builder is None:
+        builder = _context_builders[model] = ContextBuilder(model, settings.max_prompt_tokens)
+    return builder
+
@@ -0,0 +1,180 @@
+"""Bounded LRU/TTL cache of query embeddings with an optional on-disk tier."""
+import os
+import time
+import sqlite3
+import asyncio
+import threading
+import hashlib
+from array import array
+from collections import OrderedDict
+from typing import Callable
+
+from telemetry import CACHE_LOOKUPS
+
+# puts of this many seconds are written to the on-disk tier in one transaction
+WRITE_BEHIND_DELAY = 0.5
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Normalize a prompt so that trivially different spellings of the same question share a cache entry."""
+    return " ".join(prompt.casefold().split())
+
+
+class EmbeddingCache:
+    """In-memory LRU cache of embeddings, optionally backed by a SQLite file that survives restarts.
+
+    Entries are keyed by the normalized prompt text, the embedding model and the input type,
+    and expire `ttl_seconds` after they were created in both tiers. The on-disk tier is read in a
+    thread and written behind in batches, the event loop never waits for SQLite.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 4096,
+        ttl_seconds: float = 86400.0,
+        disk_path: str | None = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        # key -> (creation timestamp, float32 vector), ordered from least to most recently used
+        self.entries: OrderedDict[str, tuple[float, array]] = OrderedDict()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self.db = None
+        # serializes the SQLite calls of the worker threads
+        self.db_lock = threading.Lock()
+        # key -> (creation timestamp, vector bytes) not yet written to the on-disk tier
+        self.pending: dict[str, tuple[float, bytes]] = {}
+        self._write_task: asyncio.Task | None = None
+        if disk_path:
+            if os.path.dirname(disk_path):
+                os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+            self.db = sqlite3.connect(disk_path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(key TEXT PRIMARY KEY, created REAL NOT NULL, vector BLOB NOT NULL)"
+            )
+            self.db.execute("DELETE FROM embeddings WHERE created < ?", (self.clock() - self.ttl_seconds,))
+            self.db.commit()
+
+    @staticmethod
+    def make_key(prompt: str, model: str, input_type: str) -> str:
+        """Build the cache key of a prompt."""
+        return hashlib.sha256(f"{model}\x00{input_type}\x00{normalize_prompt(prompt)}".encode()).hexdigest()
+
+    async def get(self, prompt: str, model: str, input_type: str) -> list[float] | None:
+        """Return the cached embedding of the prompt or None."""
+        key = self.make_key(prompt, model, input_type)
+        now = self.clock()
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            if now - entry[0] <= self.ttl_seconds:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                CACHE_LOOKUPS.inc(cache="embedding", result="hit")
+                return entry[1].tolist()
+            del self.entries[key]
+            self.expirations += 1
+
+        if self.db is not None:
+            row = self.pending.get(key) or await asyncio.to_thread(self._read, key)
+            if row is not None and now - row[0] <= self.ttl_seconds:
+                vector = array("f")
+                vector.frombytes(row[1])
+                self._remember(key, row[0], vector)
+                self.disk_hits += 1
+                CACHE_LOOKUPS.inc(cache="embedding", result="disk_hit")
+                return vector.tolist()
+
+        self.misses += 1
+        CACHE_LOOKUPS.inc(cache="embedding", result="miss")
+        return None
+
+    def put(self, prompt: str, model: str, input_type: str, embedding: list[float]) -> None:
+        """Store the embedding of the prompt in every tier, the on-disk tier is written behind."""
+        key = self.make_key(prompt, model, input_type)
+        created = self.clock()
+        vector = array("f", embedding)
+        self._remember(key, created, vector)
+
+        if self.db is not None:
+            self.pending[key] = (created, vector.tobytes())
+            self._schedule_write()
+
+    def _schedule_write(self) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # outside of an event loop nothing waits for the write
+            self._write(self.pending)
+            self.pending = {}
+            return
+        if self._write_task is not None and self._write_task.get_loop() is loop:
+            return
+        self._write_task = loop.create_task(self._write_behind())
+
+    async def _write_behind(self) -> None:
+        try:
+            await asyncio.sleep(WRITE_BEHIND_DELAY)
+            batch, self.pending = self.pending, {}
+            await asyncio.to_thread(self._write, batch)
+        finally:
+            self._write_task = None
+        if self.pending:
+            self._schedule_write()
+
+    def _read(self, key: str) -> tuple[float, bytes] | None:
+        with self.db_lock:
+            if self.db is None:
+                return None
+            return self.db.execute("SELECT created, vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+
+    def _write(self, batch: dict[str, tuple[float, bytes]]) -> None:
+        with self.db_lock:
+            if self.db is None or not batch:
+                return
+            self.db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, created, vector) VALUES (?, ?, ?)",
+                [(key, created, vector) for key, (created, vector) in batch.items()],
+            )
+            self.db.commit()
+
+    def _remember(self, key: str, created: float, vector: array) -> None:
+        self.entries[key] = (created, vector)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict[str, int | float]:
+        """Return the hit/miss counters of the cache."""
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+    def close(self) -> None:
+        """Write the pending entries and close the on-disk tier."""
+        if self._write_task is not None:
+            self._write_task.cancel()
+            self._write_task = None
+        if self.db is not None:
+            self._write(self.pending)
+            self.pending = {}
+            with self.db_lock:
+                self.db.close()
+                self.db = None
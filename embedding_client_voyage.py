@@ -1,12 +1,142 @@
+import logging
+import asyncio
+
+import aiohttp
 import voyageai
 
 from credentials.secrets import secrets
+from settings import settings
+from admission import TokenBucket
+from telemetry import VOYAGE_TOKENS
+from embedding_cache import EmbeddingCache
+
+logger = logging.getLogger(__name__)
+
+
+EMBEDDING_MODEL = "voyage-3-large"
+# per request input limits of the Voyage embedding API for voyage-3-large
+MAX_BATCH_TEXTS = 1000
+MAX_BATCH_TOKENS = 120_000
+# conservative token estimate, so a batch never exceeds the token limit without calling the tokenizer
+CHARS_PER_TOKEN = 3
+
+_embedder_client = None
+
+
+class VoyageEmbedder:
+    """Long-lived async Voyage client backed by a keep-alive connection pool."""
+
+    model = EMBEDDING_MODEL
+
+    def __init__(self) -> None:
+        """Instantiate Voyage client, the HTTP session is opened lazily inside the event loop."""
+        self.client = voyageai.AsyncClient(
+            api_key=secrets.embedder_client_api_key,
+            max_retries=settings.upstream_max_retries,
+            timeout=settings.embed_timeout,
+        )
+        self.session = None
+        # set by close(), calls still running afterwards must not open a session nobody closes
+        self.closed = False
+        # caps the number of concurrent embedding requests of this worker
+        self.semaphore = asyncio.Semaphore(settings.embed_concurrency)
+        # requests per second of the embedding and rerank calls
+        self.rate_limiter = TokenBucket("Voyage", settings.voyage_rps)
+        self.cache = EmbeddingCache(
+            max_entries=settings.embed_cache_max_entries,
+            ttl_seconds=settings.embed_cache_ttl,
+            disk_path=settings.embed_cache_path or None,
+        )
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self.closed:
+            raise RuntimeError("The Voyage client is closed")
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=settings.embed_pool_size,
+                keepalive_timeout=settings.http_keepalive_expiry,
+            )
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    async def warmup(self) -> None:
+        """Open a pooled connection to the Voyage API so the first request skips the TLS handshake."""
+        try:
+            async with self._get_session().head(voyageai.api_base) as response:
+                logger.info("Voyage connection pool warmed up (HTTP %s)", response.status)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            logger.warning("Failed to warm up the Voyage connection pool: %s", err)
+
+    async def embed_query(self, prompt: str) -> list[float]:
+        """Embed a user prompt without blocking the event loop."""
+        cached = await self.cache.get(prompt, self.model, "query")
+        if cached is not None:
+            return cached
+
+        embeddings = await self._embed([prompt])
+        self.cache.put(prompt, self.model, "query", embeddings[0])
+        return embeddings[0]
+
+    async def embed_queries(self, prompts: list[str]) -> list[list[float]]:
+        """Embed many user prompts with as few Voyage requests as the per request limits allow."""
+        embeddings = {}
+        missing = []
+        for prompt in dict.fromkeys(prompts):
+            cached = await self.cache.get(prompt, self.model, "query")
+            if cached is not None:
+                embeddings[prompt] = cached
+            else:
+                missing.append(prompt)
+        logger.debug("Embedding cache hits: %d of %d distinct prompts", len(embeddings), len(embeddings) + len(missing))
+
+        batches = _split_batches(missing)
+        for batch, batch_embeddings in zip(batches, await asyncio.gather(*(self._embed(batch) for batch in batches))):
+            for prompt, embedding in zip(batch, batch_embeddings):
+                self.cache.put(prompt, self.model, "query", embedding)
+                embeddings[prompt] = embedding
+
+        return [embeddings[prompt] for prompt in prompts]
+
+    async def _embed(self, texts: list[str]) -> list[list[float]]:
+        # the voyage SDK opens a new aiohttp session per request unless one is supplied via this context variable
+        await self.rate_limiter.acquire(max_wait=settings.rate_limit_max_wait)
+        token = voyageai.aiosession.set(self._get_session())
+        try:
+            async with self.semaphore:
+                result = await self.client.embed(texts, model=self.model, input_type="query")
+        finally:
+            voyageai.aiosession.reset(token)
+
+        VOYAGE_TOKENS.inc(result.total_tokens, operation="embed")
+        logger.debug("Embedded %d texts with %d tokens", len(texts), result.total_tokens)
+        return result.embeddings
+
+    async def close(self) -> None:
+        """Close the pooled HTTP session and the cache."""
+        self.closed = True
+        self.cache.close()
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+def _split_batches(texts: list[str]) -> list[list[str]]:
+    """Split texts into batches within the input count and estimated token limits of a request."""
+    batches = []
+    batch_tokens = 0
+    for text in texts:
+        tokens = len(text) // CHARS_PER_TOKEN + 1
+        if not batches or len(batches[-1]) >= MAX_BATCH_TEXTS or batch_tokens + tokens > MAX_BATCH_TOKENS:
+            batches.append([])
+            batch_tokens = 0
+        batches[-1].append(text)
+        batch_tokens += tokens
+    return batches
 
 
-def get_embedder_client():
-    """Initialize Voyage client."""
-    return voyageai.Client(
-        api_key=secrets.embedder_client_api_key,
-        max_retries=2,
-        # timeout=5.0  # Timeout in seconds.
-    )
+def get_embedder_client() -> VoyageEmbedder:
+    """Get or create a singleton Voyage client instance, a new one after the app lifespan closed the last."""
+    global _embedder_client
+    if _embedder_client is None or _embedder_client.closed:
+        _embedder_client = VoyageEmbedder()
+    return _embedder_client
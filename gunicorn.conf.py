@@ -0,0 +1,36 @@
+"""Production server: uvicorn workers under gunicorn, tuned by the BARREL_* settings.
+
+    uv run gunicorn main:app
+
+With BARREL_PRELOAD=1 the app is imported and its read-only state built once in the master process,
+the workers share it copy-on-write. Every worker creates its own upstream clients in the app lifespan.
+The background vector sync runs in one worker only, elected by a lock in the snapshot directory
+(see vector_sync.VectorSync), the master never syncs.
+"""
+import os
+
+from settings import settings
+
+bind = settings.server_bind
+workers = settings.server_workers or os.cpu_count() or 1
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = bool(settings.server_preload)
+
+# above the idle timeout of the load balancers (60s for Azure Application Gateway and AWS ALB),
+# so they never reuse a connection the server is closing
+keepalive = settings.server_keepalive
+# streamed LLM answers of up to BARREL_LLM_TIMEOUT seconds finish when a worker is stopped or restarted
+graceful_timeout = settings.server_graceful_timeout
+# the worker heartbeat is sent from the event loop, a loop blocked this long is restarted
+timeout = 60
+
+accesslog = None
+errorlog = "-"
+loglevel = settings.log_level.lower()
+
+
+def when_ready(server) -> None:
+    """Build the shared state in the master, after the app is imported and before the workers are forked."""
+    if server.cfg.preload_app:
+        from main import preload_shared_state
+        preload_shared_state()
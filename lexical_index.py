@@ -0,0 +1,218 @@
+"""In-memory BM25 index of the chunk texts of the local vector replica, fused with dense results."""
+import logging
+import re
+import asyncio
+from collections import Counter
+
+import numpy as np
+
+from vector_store import QueryResults, VectorMatch
+from vectordb_local import LocalVectorStore, get_vector_replica
+from metadata_index import filter_conditions, matches as matches_filter
+
+logger = logging.getLogger(__name__)
+
+_lexical_index = None
+
+# metadata fields whose text is indexed
+TEXT_FIELDS = (
+    "title", "main_header", "header_0", "header_1", "header_2", "header_3", "description", "content", "source",
+)
+# words, numbers and compounds like "vnet-peering", "10.0.0.0/16" or "standard_d2s_v3"
+TOKEN_PATTERN = re.compile(r"[a-z0-9_]+(?:[./:-][a-z0-9_]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it its of on or that the this to what when where "
+    "which who why will with you your".split()
+)
+# constant of the reciprocal rank fusion, dampens the weight of the first ranks
+RRF_K = 60
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercased terms of a text, compounds are kept whole and also split into their parts."""
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+        if not token.isalnum():
+            terms.extend(part for part in re.split(r"[./:_-]", token) if part and part not in STOPWORDS)
+    return terms
+
+
+class BM25Index:
+    """Okapi BM25 over an inverted index stored in flat arrays.
+
+    The postings of term t are doc_ids[offsets[t]:offsets[t + 1]] with their term frequencies in tfs,
+    so a query is a few vectorized array operations per term instead of a scan of the documents.
+    """
+
+    def __init__(self, texts: list[str], k1: float = 1.2, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        postings: dict[str, list[tuple[int, int]]] = {}
+        doc_lengths = np.zeros(len(texts), dtype=np.float32)
+        for doc, text in enumerate(texts):
+            terms = Counter(tokenize(text))
+            doc_lengths[doc] = sum(terms.values())
+            for term, tf in terms.items():
+                postings.setdefault(term, []).append((doc, tf))
+
+        self.vocabulary = {term: term_id for term_id, term in enumerate(postings)}
+        self.offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum([len(docs) for docs in postings.values()])
+        flat = [posting for docs in postings.values() for posting in docs]
+        self.doc_ids = np.array([doc for doc, _ in flat], dtype=np.int32)
+        self.tfs = np.array([tf for _, tf in flat], dtype=np.float32)
+
+        self.count = len(texts)
+        average_length = float(doc_lengths.mean()) if self.count else 0.0
+        # per document part of the BM25 denominator
+        self.length_norms = self.k1 * (1 - self.b + self.b * doc_lengths / (average_length or 1.0))
+        document_frequencies = np.diff(self.offsets).astype(np.float32)
+        self.idf = np.log1p((self.count - document_frequencies + 0.5) / (document_frequencies + 0.5))
+
+    def search(self, query: str, top_k: int = 10, docs: np.ndarray | None = None) -> list[tuple[int, float]]:
+        """Return the (document, score) pairs of the top_k best scoring documents, only of `docs` when given."""
+        scores = np.zeros(self.count, dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            postings, tfs = self.doc_ids[start:end], self.tfs[start:end]
+            scores[postings] += self.idf[term_id] * tfs * (self.k1 + 1) / (tfs + self.length_norms[postings])
+
+        candidates = np.flatnonzero(scores) if docs is None else docs[scores[docs] > 0]
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(scores[candidates], -top_k)[-top_k:]]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return [(int(doc), float(scores[doc])) for doc in candidates]
+
+
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int = RRF_K) -> list[str]:
+    """Merge rankings of ids by the sum of 1 / (k + rank) over the rankings containing each id."""
+    scores = Counter()
+    for ranking in rankings:
+        for rank, vector_id in enumerate(ranking, start=1):
+            scores[vector_id] += 1.0 / (k + rank)
+    return [vector_id for vector_id, _ in sorted(scores.items(), key=lambda item: item[1], reverse=True)]
+
+
+class LexicalIndex:
+    """BM25 index of the live vectors of the replica, rebuilt in the background when the corpus changes."""
+
+    def __init__(self, replica: LocalVectorStore) -> None:
+        self.replica = replica
+        self.index: BM25Index | None = None
+        self.ids: list[str] = []
+        # replica row of every document
+        self.rows = np.zeros(0, dtype=np.int64)
+        self.corpus_version: str | None = None
+        self.rebuild_task: asyncio.Task | None = None
+
+    @property
+    def ready(self) -> bool:
+        """Whether there is an index to search, possibly of an older corpus version."""
+        return self.index is not None and self.index.count > 0
+
+    def refresh(self) -> None:
+        """Start rebuilding the index in a thread if the replica changed since the last build."""
+        if self.corpus_version == self.replica.corpus_version or not len(self.replica):
+            return
+        if self.rebuild_task is None or self.rebuild_task.done():
+            self.rebuild_task = asyncio.ensure_future(self.rebuild())
+
+    async def rebuild(self) -> None:
+        """Build the index of the current corpus version."""
+        corpus_version = self.replica.corpus_version
+        snapshot = self.replica.snapshot
+        rows = self.replica.live_rows()
+        try:
+            ids, index = await asyncio.to_thread(self._build, rows)
+        except (IndexError, MemoryError) as err:  # keep serving the previous index
+            logger.warning("Failed to build the lexical index: %s", err)
+            return
+        if self.replica.snapshot is not snapshot:
+            # the rows were renumbered by a reload while building, the next refresh builds the new generation
+            return
+        self.index, self.ids, self.rows = index, ids, rows
+        self.corpus_version = corpus_version
+        logger.info("Lexical index built over %d chunks with %d terms", len(ids), len(self.index.vocabulary))
+
+    def _build(self, rows: np.ndarray) -> tuple[list[str], BM25Index]:
+        """Ids and BM25 index of the text fields of the rows, run in a thread."""
+        ids = [self.replica.id_at(row) for row in rows]
+        texts = [
+            " ".join(str(value) for field in TEXT_FIELDS if (value := self.replica.metadata_at(row).get(field)))
+            for row in rows
+        ]
+        return ids, BM25Index(texts)
+
+    def search(self, query: str, top_k: int = 10, rows: np.ndarray | None = None) -> list[tuple[str, float]]:
+        """Return the (vector id, BM25 score) pairs of the top_k best lexical matches, only of `rows` when given."""
+        if not self.ready:
+            return []
+        docs = None
+        if rows is not None:
+            # documents of the sorted replica rows, rows added after the last build are not indexed yet
+            positions = np.minimum(np.searchsorted(self.rows, rows), len(self.rows) - 1)
+            docs = positions[self.rows[positions] == rows]
+        return [(self.ids[doc], score) for doc, score in self.index.search(query, top_k, docs)]
+
+    def fuse(
+        self,
+        prompt: str,
+        query_vector: list[float],
+        dense: QueryResults,
+        top_k: int,
+        namespaces: list[str] | None = None,
+        sources: list[str] | None = None,
+        metadata_filter: dict | None = None,
+    ) -> QueryResults:
+        """Merge the dense results with the lexical matches of the prompt by reciprocal rank fusion.
+
+        Only the rows passing the routing and the filter are searched for lexical matches, found with the
+        posting indexes of the replica. Lexical matches missing from the dense results are scored with the
+        cosine similarity of their replica vector, so the scores of all matches stay comparable with the mss threshold.
+        """
+        rows = self.replica.route(namespaces, sources, metadata_filter)
+        lexical_ids = [vector_id for vector_id, _ in self.search(prompt, top_k, rows)]
+        dense_matches = {match.id: match for match in dense.matches}
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        conditions = filter_conditions(metadata_filter, sources)
+
+        matches = []
+        for vector_id in reciprocal_rank_fusion([list(dense_matches), lexical_ids]):
+            if len(matches) == top_k:
+                break
+            match = dense_matches.get(vector_id) or self._replica_match(vector_id, query)
+            if match is None:
+                continue
+            if namespaces is not None and match.namespace not in namespaces:
+                continue
+            if not matches_filter(match.metadata, conditions):
+                continue
+            matches.append(match)
+
+        return QueryResults(matches=matches, read_units=dense.read_units, failed_namespaces=dense.failed_namespaces)
+
+    def _replica_match(self, vector_id: str, query: np.ndarray) -> VectorMatch | None:
+        row = self.replica.row_of(vector_id)
+        if row is None:
+            return None
+        return VectorMatch(
+            id=vector_id,
+            score=float(self.replica.vector_at(row) @ query),
+            metadata=self.replica.metadata_at(row),
+            namespace=self.replica.namespace_at(row),
+        )
+
+
+def get_lexical_index() -> LexicalIndex:
+    """Get or create the singleton lexical index over the local vector replica."""
+    global _lexical_index
+    if _lexical_index is None:
+        _lexical_index = LexicalIndex(get_vector_replica())
+    return _lexical_index
@@ -1,10 +1,23 @@
 """LLM module of handling user requests."""
 
+import logging
 import os
 import json
-from openai import AzureOpenAI
+import asyncio
+from typing import AsyncIterator
+
+import httpx
+from openai import AsyncAzureOpenAI, DefaultAsyncHttpxClient, OpenAIError
 
 from credentials.secrets import secrets
+from settings import settings
+from admission import TokenBucket
+from telemetry import LLM_TOKENS
+from context_builder import BuiltPrompt, get_context_builder
+
+logger = logging.getLogger(__name__)
+
+_llm_client = None
 
 
 class SuperPrompt:
@@ -17,81 +30,116 @@ class SuperPrompt:
     api_version = "2024-12-01-preview"
 
     def __init__(self) -> None:
-        """Instantiate Azure OpenAI LLM client."""
-        self.client = AzureOpenAI(
+        """Instantiate Azure OpenAI LLM client backed by a keep-alive connection pool."""
+        http_client = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=settings.llm_pool_size,
+                max_keepalive_connections=settings.llm_pool_size,
+                keepalive_expiry=settings.http_keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(settings.llm_timeout, connect=settings.connect_timeout),
+        )
+        self.client = AsyncAzureOpenAI(
             api_version=self.api_version,
             azure_endpoint=self.endpoint,
             api_key=self.subscription_key,
+            http_client=http_client,
+            max_retries=settings.upstream_max_retries,
         )
-
-    def process_prompt(self, prompt: str, context_text: str) -> list[str]:
-        """Process user question."""
-
-        super_prompt = f""" 
-Here is a question: {prompt}
-
-Please answer the question exclusively based on the documentation articles retrieved from our vector database, below encapsulated in the optional json block in the content key with a lot of metadata. If there is no relevant information in the documentation articles, please state to the user that "we don't have relevant enough information in our vector store to answer this specific question"
-
-The relevance of the articles are expressed in a numerical value in matches[].score, the higher the value the more relevant the article to our question. Please consider all the metadata when trying to answer the user's question.
-
-Make sure you don't use your own knowledge or anything to answer the question, ONLY the information in the documentation articles.
-
-Make double check that you include all the json data in the response.
-
-If there are articles to cite, then cite the relevant article(s) just saying "most relevant article(s):" verbatim in the following json format in a list (omit the keys where there was no value in the original retrieved documentation article json):
-Please omit the empty json keys where there is no value
-Please format your answer itself in markdown format (not the citation part)
-[
-    {{
-    "citation": {{
-        "www": "",
-        "source_url": "",
-        "web_url": "",
-        "content": "", 		
-        "source_format": "",
-        "main_category": "",
-        "sub_category": "",
-        "markdown.data": {{ 	
-        "main_header": "",
-        "header_0": "",
-        "header_1": "",
-        "header_2": "",
-        "header_3": "",
-        }}
-        "ms.headers": {{
-        "title": "",
-        "titleSuffix": "",
-        "description": "",
-        "ms.custom": "",
-        "ms.date": "",
-        "ms.service": "",
-        "ms.topic": "",
-        "intent": "",
-        }},
-    }}
-    }}
-]
-
-Here are the documentation articles as a context to answer the question from:
-
-{context_text}
-"""
-
-        response = self.client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": super_prompt,
-                }
-            ],
-            temperature=0.0,
-            frequency_penalty=0.0,
-            presence_penalty=0.0,
-            model=self.deployment
+        # caps the number of concurrent completions of this worker
+        self.semaphore = asyncio.Semaphore(settings.llm_concurrency)
+        self.request_limiter = TokenBucket("Azure OpenAI requests", settings.llm_rps)
+        # Azure OpenAI enforces the tokens per minute quota over 10 second windows
+        self.token_limiter = TokenBucket("Azure OpenAI tokens", settings.llm_tpm / 60, capacity=settings.llm_tpm / 6)
+        self.context_builder = get_context_builder(self.deployment)
+
+    async def warmup(self) -> None:
+        """Load the tokenizer and open a pooled connection to Azure OpenAI ahead of the first request."""
+        await asyncio.to_thread(self.context_builder.load)
+        try:
+            await self.client.models.list()
+            logger.info("Azure OpenAI connection pool warmed up")
+        except OpenAIError as err:
+            logger.warning("Failed to warm up the Azure OpenAI connection pool: %s", err)
+
+    async def close(self) -> None:
+        """Close the pooled HTTP client."""
+        await self.client.close()
+
+    def build_prompt(self, prompt: str, matches: list, max_context_tokens: int) -> BuiltPrompt:
+        """Assemble the instructions, the user question and the best fitting context chunks into a single prompt."""
+        return self.context_builder.build(prompt, matches, max_context_tokens)
+
+    async def _acquire_quota(self, super_prompt: str, prompt_tokens: int | None) -> None:
+        if prompt_tokens is None:
+            prompt_tokens = self.context_builder.count_tokens(super_prompt)
+        await self.request_limiter.acquire(max_wait=settings.rate_limit_max_wait)
+        await self.token_limiter.acquire(
+            prompt_tokens + settings.llm_completion_tokens, max_wait=settings.rate_limit_max_wait
         )
 
-        print("[RAG ANSWER]: ")
-        print(response.choices[0].message.content)
-        print("[COMPLETED USER QUERY]", "*"*90)
-
-        return response.choices[0].message.content
\ No newline at end of file
+    async def process_prompt(self, super_prompt: str, prompt_tokens: int | None = None) -> str:
+        """Process user question."""
+        await self._acquire_quota(super_prompt, prompt_tokens)
+        async with self.semaphore:
+            response = await self.client.chat.completions.create(
+                messages=[
+                    {
+                        "role": "user",
+                        "content": super_prompt,
+                    }
+                ],
+                temperature=0.0,
+                frequency_penalty=0.0,
+                presence_penalty=0.0,
+                model=self.deployment
+            )
+
+        _count_tokens(response.usage)
+        logger.debug("RAG answer: %s", response.choices[0].message.content)
+
+        return response.choices[0].message.content
+
+    async def stream_prompt(self, super_prompt: str, prompt_tokens: int | None = None) -> AsyncIterator[str]:
+        """Process user question, yielding the answer tokens as they are generated."""
+        answer_parts = []
+        await self._acquire_quota(super_prompt, prompt_tokens)
+
+        async with self.semaphore:
+            stream = await self.client.chat.completions.create(
+                messages=[
+                    {
+                        "role": "user",
+                        "content": super_prompt,
+                    }
+                ],
+                temperature=0.0,
+                frequency_penalty=0.0,
+                presence_penalty=0.0,
+                model=self.deployment,
+                stream=True,
+                # the last chunk reports the token usage of the completion
+                stream_options={"include_usage": True},
+            )
+            async for chunk in stream:
+                _count_tokens(chunk.usage)
+                # azure sends the content filter results in chunks without choices
+                if chunk.choices and chunk.choices[0].delta.content:
+                    answer_parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+
+        logger.debug("RAG answer: %s", "".join(answer_parts))
+
+
+def _count_tokens(usage) -> None:
+    if usage is not None:
+        LLM_TOKENS.inc(usage.prompt_tokens, kind="prompt")
+        LLM_TOKENS.inc(usage.completion_tokens, kind="completion")
+
+
+def get_llm_client() -> SuperPrompt:
+    """Get or create a singleton Azure OpenAI client instance."""
+    global _llm_client
+    if _llm_client is None:
+        _llm_client = SuperPrompt()
+    return _llm_client
@@ -1,15 +1,98 @@
 """Fast API RAG backend server."""
-from fastapi import FastAPI, Response, Depends, status
+import gc
+import time
+import logging
+import asyncio
+from dataclasses import asdict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from fastapi import FastAPI, Request, Response, Depends, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
-from voyageai.client import Client
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
+
+from request_models import PromptArgs, BatchPromptRequest
+from embedding_client_voyage import VoyageEmbedder, get_embedder_client
+from vector_store import VectorStore, VectorStoreNotReady, get_vector_store
+from settings import settings
+from admission import AdmissionController, Overloaded, get_admission_controller
+from llm_client_azure import SuperPrompt, get_llm_client
+from context_builder import get_context_builder
+from answer_cache import SemanticAnswerCache, get_answer_cache
+from lexical_index import get_lexical_index
+from vectordb_local import get_vector_replica
+from single_flight import SingleFlight, get_single_flight, request_key
+from rag_pipeline import retrieve, generate, stream_answer, answer_batch
+from telemetry import REQUEST_SECONDS, configure_logging, registry, server_timing, start_request, stop_logging
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create the long-lived upstream clients and warm them up in the background while serving.
+
+    Requests are accepted right away, GET /ready turns healthy once the warmup is done and the
+    vector store can serve queries, so load balancers only route to warm workers.
+    Once the clients are closed the buffered logs are written out, later records are written synchronously.
+    """
+    configure_logging()
+    embedder = get_embedder_client()
+    llm = get_llm_client()
+    vector_store = get_vector_store()
+
+    app.state.warm = False
+    background_tasks = [asyncio.create_task(_warm_up(app, embedder, llm, vector_store))]
+    if settings.vector_sync_interval > 0:
+        from vector_sync import get_vector_sync
+        background_tasks.append(asyncio.create_task(get_vector_sync().run_forever(settings.vector_sync_interval)))
+
+    yield
 
-from request_models import PromptArgs
-from embedding_client_voyage import get_embedder_client
-from vectordb_client import PineConeClient, get_pinecone_client
-from llm_client_azure import SuperPrompt
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    try:
+        await asyncio.gather(embedder.close(), llm.close(), vector_store.close())
+    finally:
+        stop_logging()
 
 
-app = FastAPI(title="Barrel", docs_url="/")
+async def _warm_up(app: FastAPI, embedder: VoyageEmbedder, llm: SuperPrompt, vector_store: VectorStore) -> None:
+    """Warm up all upstream clients concurrently, then keep the vector store fresh."""
+    started = time.perf_counter()
+    await asyncio.gather(embedder.warmup(), llm.warmup(), vector_store.warmup())
+    if settings.lexical_search:
+        get_lexical_index().refresh()
+    app.state.warm = True
+    logger.info("Warmup finished in %.2fs", time.perf_counter() - started)
+    await vector_store.refresh_forever()
+
+
+def preload_shared_state() -> None:
+    """Build the read-only state of the workers in the master process of a preloading server (gunicorn.conf.py).
+
+    The tokenizer, the local vector replica with its quantized codes, IVF index and aggregates, and the
+    lexical index are built once and shared copy-on-write by the forked workers, whose warmup then finds them ready.
+    Network clients are not created here, their connections and event loops belong to the workers.
+    """
+    started = time.perf_counter()
+    get_context_builder(SuperPrompt.deployment).load()
+    if settings.vector_backend == "local" or settings.lexical_search:
+        replica = get_vector_replica()
+        asyncio.run(replica.warmup())
+        if settings.lexical_search and len(replica):
+            lexical_index = get_lexical_index()
+            asyncio.run(lexical_index.rebuild())
+        replica.facets()
+    # objects of the master are never freed by the workers, keep the garbage collector off their pages
+    gc.collect()
+    gc.freeze()
+    logger.info("Preloaded the shared state in %.2fs", time.perf_counter() - started)
+
+
+app = FastAPI(title="Barrel", docs_url="/", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,55 +103,213 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    """Record the request duration and optionally report the pipeline stage durations in a Server-Timing header.
+
+    Streamed answers are timed until the response starts, their LLM stage only shows up in /metrics.
+    """
+    timings = start_request()
+    started = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - started
+
+    route = request.scope.get("route")
+    REQUEST_SECONDS.observe(elapsed, path=route.path if route else "unmatched", status=response.status_code)
+    if settings.server_timing:
+        response.headers["Server-Timing"] = server_timing({**timings, "total": elapsed})
+    return response
+
+
+@app.exception_handler(VectorStoreNotReady)
+async def vector_store_not_ready_handler(_request: Request, err: VectorStoreNotReady):
+    """Ask clients to retry while the worker is still starting up instead of failing the request."""
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": str(err)},
+        headers={"Retry-After": str(int(settings.retry_backoff_base) + 1)},
+    )
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(_request: Request, err: Overloaded):
+    """Shed load with a 503 and a Retry-After header instead of queueing requests without bound."""
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": str(err)},
+        headers={"Retry-After": err.retry_after_header},
+    )
+
+
+@app.get("/ready")
+async def ready(vector_store: VectorStore = Depends(get_vector_store)):
+    """Readiness probe: 200 once the upstream clients are warm and the vector store can serve queries."""
+    checks = {"warmup": getattr(app.state, "warm", False), "vector_store": vector_store.is_ready()}
+    if all(checks.values()):
+        return {"ready": True, **checks}
+    return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"ready": False, **checks})
+
+
 @app.post("/user_prompt", response_model=str)
 async def user_prompt(
     prompt: str,
     args: PromptArgs,
-    client: Client = Depends(get_embedder_client),
-    pc_client: PineConeClient = Depends(get_pinecone_client)
+    response: Response,
+    embedder: VoyageEmbedder = Depends(get_embedder_client),
+    vector_store: VectorStore = Depends(get_vector_store),
+    llm: SuperPrompt = Depends(get_llm_client),
+    answer_cache: SemanticAnswerCache = Depends(get_answer_cache),
+    single_flight: SingleFlight = Depends(get_single_flight),
+    admission: AdmissionController = Depends(get_admission_controller),
 ):
-    """Endpoint for processing user prompts."""
-    ### embedding client client START
-    print("[PROCESSING USER QUERY]", "*"*90)
-    print(f"[PROMPT]: {prompt}")
-    result = client.embed(prompt, model="voyage-3-large", input_type="query")
-    return_vector = result.embeddings[0]
-    print(f"[EMBEDDING TOKEN LEN]: {result.total_tokens}")
-    ### embedding client client END
-
-    ### pinecone client START
-    pinecone_response = pc_client.query(input_vector=return_vector, top_k=args.top_k)
-    context_text = pinecone_response.matches
-    vector_ids = [item.id for item in pinecone_response.matches]
-    print(f"[VECTOR IDS]: {vector_ids}")
-
-    if context_text is None:
-        scores = ", ".join(str(match.score) for match in pinecone_response.matches)
-        return Response(
-            status_code=status.HTTP_409_CONFLICT,
-            content=f"No vectors with similarity score above the mss threshold: {args.mss}. MSS scores: [{scores}]"
-        )
-    ### pinecone client END
+    """Endpoint for processing user prompts, identical concurrent prompts share one pipeline execution."""
+    key = request_key(prompt, args)
+    async with admission.slot("interactive", settings.admission_max_wait):
+        retrieval = await single_flight.do(("retrieve", key), lambda: retrieve(prompt, args, embedder, vector_store))
+
+        if not retrieval.context:
+            return _no_context_response(retrieval.query_results, args)
+
+        answer = await single_flight.do(("generate", key), lambda: generate(prompt, retrieval, llm, answer_cache))
+    response.headers["X-Prompt-Tokens"] = str(answer.prompt_tokens)
+    if retrieval.query_results.partial:
+        response.headers["X-Failed-Namespaces"] = ",".join(retrieval.query_results.failed_namespaces)
+
+    return answer.text
+
 
-    ### LLM client START
-    sp = SuperPrompt()
-    outputs = sp.process_prompt(prompt, context_text)
-    ### LLM client end
+@app.post("/user_prompt/stream", response_class=StreamingResponse)
+async def user_prompt_stream(
+    prompt: str,
+    args: PromptArgs,
+    embedder: VoyageEmbedder = Depends(get_embedder_client),
+    vector_store: VectorStore = Depends(get_vector_store),
+    llm: SuperPrompt = Depends(get_llm_client),
+    answer_cache: SemanticAnswerCache = Depends(get_answer_cache),
+    single_flight: SingleFlight = Depends(get_single_flight),
+    admission: AdmissionController = Depends(get_admission_controller),
+):
+    """Endpoint for processing user prompts, streaming the answer as Server-Sent Events.
+
+    Events: 'retrieval' (vector ids and scores), 'token' (answer text delta), then 'done' or 'error'.
+    Identical concurrent prompts share one pipeline execution, late joiners get the events from the start.
+    """
+    key = request_key(prompt, args)
+    await admission.acquire("interactive", settings.admission_max_wait)
+    try:
+        retrieval = await single_flight.do(("retrieve", key), lambda: retrieve(prompt, args, embedder, vector_store))
+    except BaseException:
+        admission.release("interactive")
+        raise
+
+    if not retrieval.context:
+        admission.release("interactive")
+        return _no_context_response(retrieval.query_results, args)
+
+    events = single_flight.stream(("stream", key), lambda: stream_answer(prompt, retrieval, llm, answer_cache))
+    return _AdmittedStreamingResponse(
+        events,
+        admission,
+        "interactive",
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/user_prompt/batch")
+async def user_prompt_batch(
+    request: BatchPromptRequest,
+    embedder: VoyageEmbedder = Depends(get_embedder_client),
+    vector_store: VectorStore = Depends(get_vector_store),
+    llm: SuperPrompt = Depends(get_llm_client),
+    answer_cache: SemanticAnswerCache = Depends(get_answer_cache),
+    admission: AdmissionController = Depends(get_admission_controller),
+):
+    """Endpoint for processing many user prompts at once.
+
+    Results are returned in the order of the prompts, each with the status code POST /user_prompt would return.
+    """
+    items = await answer_batch(request.prompts, request.args, embedder, vector_store, llm, answer_cache, admission)
+
+    return {"results": [asdict(item) for item in items]}
+
+
+class _AdmittedStreamingResponse(StreamingResponse):
+    """Streamed answer holding an admission slot until the response is sent, failed or abandoned.
+
+    The slot is released around the whole ASGI call rather than in the body generator, which never runs when
+    the client disconnects before the body starts.
+    """
+
+    def __init__(self, content: AsyncIterator[str], admission: AdmissionController, lane: str, **kwargs) -> None:
+        super().__init__(content, **kwargs)
+        self.admission = admission
+        self.lane = lane
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.admission.release(self.lane)
+
+
+def _no_context_response(query_results, args: PromptArgs) -> Response:
+    scores = ", ".join(str(match.score) for match in query_results.matches)
+    return Response(
+        status_code=status.HTTP_409_CONFLICT,
+        content=f"No vectors with similarity score above the mss threshold: {args.mss}. MSS scores: [{scores}]"
+    )
+
+
+@app.get("/cache_stats")
+async def get_cache_stats(
+    embedder: VoyageEmbedder = Depends(get_embedder_client),
+    answer_cache: SemanticAnswerCache = Depends(get_answer_cache),
+    single_flight: SingleFlight = Depends(get_single_flight),
+    admission: AdmissionController = Depends(get_admission_controller),
+):
+    """Endpoint for retrieving the hit/miss counters of the caches and of the request coalescing."""
+    return {
+        "embeddings": embedder.cache.stats(),
+        "answers": answer_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "admission": admission.stats(),
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Endpoint for scraping the latency histograms and usage counters of this worker in the Prometheus format."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/vector_sync")
+async def get_vector_sync_status():
+    """Endpoint for retrieving the state and read unit usage of the local vector replica sync."""
+    if settings.vector_sync_interval <= 0:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Vector sync is disabled")
+
+    from vector_sync import get_vector_sync
+    return get_vector_sync().status()
 
-    return outputs
 
 @app.get("/indexes")
-async def get_indexes(pc_client: PineConeClient = Depends(get_pinecone_client)):
-    """Endpoint for retrieving sources from the cached vector data."""
-    sources = pc_client.return_sources()
-    
-    if sources is None:
+async def get_indexes(request: Request, vector_store: VectorStore = Depends(get_vector_store)):
+    """Endpoint for retrieving the vector counts per source, namespace and category of the cached vector data.
+
+    The response carries an ETag, clients revalidating with If-None-Match get 304 until the vectors change.
+    """
+    facets = vector_store.facets()
+
+    if facets is None:
         return Response(
             status_code=status.HTTP_404_NOT_FOUND,
             content="No cached vectors found"
         )
-    
-    # Transform sources into a more JSON-friendly format
-    sources_dict = {source: count for source, count in sources}
-    
-    return {"sources": sources_dict}
+
+    body, etag = facets.render()
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    client_etags = {tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")}
+    if etag in client_etags or "*" in client_etags:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,121 @@
+"""Metadata filters of the retrieval stage and the posting indexes evaluating them on the local replica.
+
+A filter maps metadata fields to the values they may have, e.g. {"source": [...], "ms.service": "azure-monitor"}.
+The conditions of all fields must hold, a list valued field matches when any of its items is allowed.
+Pinecone evaluates the filter itself; the local store looks up the rows of every condition in a
+posting index of the field and only scores the rows of their intersection.
+"""
+import json
+from collections.abc import Iterable, Sequence
+
+import numpy as np
+
+Scalar = str | int | float | bool
+# (field, allowed values) pairs, all of them must hold
+Conditions = list[tuple[str, list[Scalar]]]
+
+
+def filter_conditions(metadata_filter: dict | None = None, sources: list[str] | None = None) -> Conditions:
+    """Conditions of a request filter and of its `sources` routing, which is a filter on the source field."""
+    conditions = [
+        (field, list(values) if isinstance(values, (list, tuple)) else [values])
+        for field, values in (metadata_filter or {}).items()
+    ]
+    if sources:
+        conditions.append(("source", list(sources)))
+    return conditions
+
+
+def pinecone_filter(conditions: Conditions) -> dict | None:
+    """The conditions in the Pinecone metadata filter language.
+
+    `$in` only takes strings and numbers, single values and booleans are compared with `$eq`.
+    """
+    clauses = []
+    for field, values in conditions:
+        values = list({_key(value): value for value in values}.values())
+        if len(values) == 1:
+            clauses.append({field: {"$eq": values[0]}})
+        elif any(isinstance(value, bool) for value in values):
+            clauses.append({"$or": [{field: {"$eq": value}} for value in values]})
+        else:
+            clauses.append({field: {"$in": values}})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def matches(metadata: dict, conditions: Conditions) -> bool:
+    """Whether the metadata of a vector satisfies all conditions."""
+    for field, values in conditions:
+        allowed = {_key(value) for value in values}
+        if not any(key in allowed for key in _keys(metadata.get(field))):
+            return False
+    return True
+
+
+class PostingIndex:
+    """Rows of every value of a field, as one array of rows sorted by value code with start offsets.
+
+    Built over the dictionary codes of a snapshot column without decoding it, or by encoding the values.
+    """
+
+    def __init__(self, codes: np.ndarray, dictionary: Sequence) -> None:
+        codes = np.asarray(codes)
+        # rows without the field (code -1) sort first, the rows of a code stay in ascending order
+        self.rows = np.argsort(codes, kind="stable").astype(np.int64)
+        self.offsets = np.zeros(len(dictionary) + 2, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(np.bincount(codes + 1, minlength=len(dictionary) + 1))
+        # list valued entries are posted under each of their items
+        self.codes_of: dict = {}
+        for code, value in enumerate(dictionary):
+            for key in _keys(value):
+                self.codes_of.setdefault(key, []).append(code)
+
+    @classmethod
+    def from_codes(cls, codes: np.ndarray, dictionary: Sequence) -> "PostingIndex":
+        """Index a dictionary encoded column, code -1 marks rows without the field."""
+        return cls(codes, dictionary)
+
+    @classmethod
+    def from_values(cls, values: Iterable) -> "PostingIndex":
+        """Index the values of a field of every row, None where missing."""
+        codes_by_key: dict = {}
+        dictionary = []
+        codes = []
+        for value in values:
+            if value is None:
+                codes.append(-1)
+                continue
+            key = json.dumps(value, sort_keys=True) if isinstance(value, (list, dict)) else _key(value)
+            code = codes_by_key.get(key)
+            if code is None:
+                code = codes_by_key[key] = len(dictionary)
+                dictionary.append(value)
+            codes.append(code)
+        return cls(np.array(codes, dtype=np.int32), dictionary)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def lookup(self, values: list[Scalar]) -> np.ndarray:
+        """Sorted rows having one of the values."""
+        codes = sorted({code for value in values for code in self.codes_of.get(_key(value), ())})
+        postings = [self.rows[self.offsets[code + 1]:self.offsets[code + 2]] for code in codes]
+        if not postings:
+            return np.zeros(0, dtype=np.int64)
+        return postings[0] if len(postings) == 1 else np.unique(np.concatenate(postings))
+
+
+def _key(value) -> Scalar:
+    # 1 and True are equal dict keys, Pinecone does not match them either
+    return ("bool", value) if isinstance(value, bool) else value
+
+
+def _keys(value) -> list:
+    """Keys a stored metadata value is matched by, the items of a list."""
+    if value is None or isinstance(value, dict):
+        return []
+    if isinstance(value, list):
+        return [_key(item) for item in value if item is not None and not isinstance(item, (list, dict))]
+    return [_key(value)]
@@ -0,0 +1,210 @@
+"""Retrieval augmented generation stages shared by the prompt endpoints."""
+import logging
+import json
+import time
+import asyncio
+from dataclasses import dataclass
+from typing import Any, AsyncIterator
+
+from request_models import PromptArgs
+from embedding_client_voyage import VoyageEmbedder
+from vector_store import VectorStore, VectorStoreNotReady
+from llm_client_azure import SuperPrompt
+from answer_cache import SemanticAnswerCache
+from context_builder import BuiltPrompt
+from relevance import select_context
+from lexical_index import get_lexical_index
+from reranker import get_reranker
+from settings import settings
+from admission import AdmissionController, Overloaded
+from telemetry import span
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Retrieval:
+    """Outcome of the retrieval stage of a single prompt."""
+    query_vector: list[float]
+    query_results: Any
+    # matches selected as the LLM context, empty when nothing is relevant enough
+    context: list
+    corpus_version: str | None = None
+    max_context_tokens: int = 6000
+
+    @property
+    def vector_ids(self) -> list[str]:
+        """Ids of the vectors selected as context."""
+        return [match.id for match in self.context]
+
+
+async def retrieve(prompt: str, args: PromptArgs, embedder: VoyageEmbedder, vector_store: VectorStore) -> Retrieval:
+    """Embed the user prompt and query the vector database with it."""
+    logger.debug("Prompt: %s", prompt)
+    with span("embed"):
+        query_vector = await embedder.embed_query(prompt)
+    return await search(prompt, query_vector, args, vector_store)
+
+
+async def search(prompt: str, query_vector: list[float], args: PromptArgs, vector_store: VectorStore) -> Retrieval:
+    """Query the vector database with an embedded prompt, fuse in the lexical matches, rerank, select the context."""
+    reranker = get_reranker() if args.rerank else None
+    # the reranker picks the top_k out of more candidates than the vector search alone would
+    candidates = max(args.top_k, settings.rerank_candidates) if reranker else args.top_k
+
+    with span("vector_query"):
+        query_results = await vector_store.query(
+            input_vector=query_vector,
+            top_k=candidates,
+            namespaces=args.namespaces,
+            sources=args.sources,
+            nprobe=args.nprobe,
+            metadata_filter=args.filter,
+        )
+    if args.hybrid and settings.lexical_search:
+        lexical_index = get_lexical_index()
+        lexical_index.refresh()
+        if lexical_index.ready:
+            with span("lexical"):
+                query_results = lexical_index.fuse(
+                    prompt, query_vector, query_results, candidates, args.namespaces, args.sources, args.filter
+                )
+    if reranker:
+        with span("rerank"):
+            query_results.matches = await reranker.rerank(prompt, query_results.matches, args.top_k)
+    if query_results.partial:
+        logger.warning("Partial results, namespaces %s are missing", query_results.failed_namespaces)
+    context = select_context(query_results.matches, args)
+    retrieval = Retrieval(query_vector, query_results, context, vector_store.corpus_version, args.max_context_tokens)
+    logger.debug(
+        "Vector ids: %s (selected %d of %d matches)", retrieval.vector_ids, len(context), len(query_results.matches)
+    )
+
+    return retrieval
+
+
+@dataclass
+class BatchItem:
+    """Result of a single prompt of a batch request."""
+    prompt: str
+    # HTTP status the prompt would have got from POST /user_prompt
+    status: int
+    answer: str | None = None
+    error: str | None = None
+    prompt_tokens: int = 0
+
+
+@dataclass
+class Answer:
+    """Outcome of the generation stage of a single prompt."""
+    text: str
+    # 0 when the answer was served from the answer cache
+    prompt_tokens: int = 0
+
+
+def build_prompt(prompt: str, retrieval: Retrieval, llm: SuperPrompt) -> BuiltPrompt:
+    """Pack the selected context into the prompt token budget of the request."""
+    with span("context_build"):
+        built = llm.build_prompt(prompt, retrieval.context, retrieval.max_context_tokens)
+    logger.debug(
+        "Prompt tokens: %d (%d context tokens in %d chunks, %d dropped)",
+        built.prompt_tokens, built.context_tokens, len(built.chunks), built.dropped_chunks,
+    )
+    return built
+
+
+async def generate(prompt: str, retrieval: Retrieval, llm: SuperPrompt, answer_cache: SemanticAnswerCache) -> Answer:
+    """Answer the prompt from the retrieved context, reusing the answer of a near-duplicate question if cached."""
+    cached = answer_cache.lookup(retrieval.query_vector, retrieval.vector_ids, retrieval.corpus_version)
+    if cached is not None:
+        return Answer(cached)
+
+    built = build_prompt(prompt, retrieval, llm)
+    started = time.perf_counter()
+    with span("llm"):
+        answer = await llm.process_prompt(built.text, built.prompt_tokens)
+    answer_cache.store(
+        retrieval.query_vector, retrieval.vector_ids, answer, time.perf_counter() - started, retrieval.corpus_version
+    )
+    return Answer(answer, built.prompt_tokens)
+
+
+async def answer_batch(
+    prompts: list[str],
+    args: PromptArgs,
+    embedder: VoyageEmbedder,
+    vector_store: VectorStore,
+    llm: SuperPrompt,
+    answer_cache: SemanticAnswerCache,
+    admission: AdmissionController,
+) -> list[BatchItem]:
+    """Answer many prompts: one batched embedding call, then concurrent retrieval and generation per prompt.
+
+    Items run in the batch lane of the admission controller, interactive requests are served first.
+    Failures are reported per item, only a failed embedding call fails the whole batch.
+    """
+    logger.debug("Prompt batch of %d prompts", len(prompts))
+    with span("embed"):
+        query_vectors = await embedder.embed_queries(prompts)
+
+    async def answer_item(prompt: str, query_vector: list[float]) -> BatchItem:
+        try:
+            async with admission.slot("batch", settings.admission_batch_max_wait):
+                retrieval = await search(prompt, query_vector, args, vector_store)
+                if not retrieval.context:
+                    scores = [match.score for match in retrieval.query_results.matches]
+                    return BatchItem(prompt, status=409, error=(
+                        f"No vectors with similarity score above the mss threshold: {args.mss}. MSS scores: {scores}"
+                    ))
+                answer = await generate(prompt, retrieval, llm, answer_cache)
+            return BatchItem(prompt, status=200, answer=answer.text, prompt_tokens=answer.prompt_tokens)
+        except (VectorStoreNotReady, Overloaded) as err:
+            return BatchItem(prompt, status=503, error=str(err))
+        except Exception as err:  # one failing item must not fail the others
+            logger.exception("Batch item failed: %s", prompt)
+            return BatchItem(prompt, status=500, error=str(err))
+
+    return list(await asyncio.gather(*(answer_item(*item) for item in zip(prompts, query_vectors))))
+
+
+def sse_event(event: str, data: dict) -> str:
+    """Format a single Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_answer(
+    prompt: str, retrieval: Retrieval, llm: SuperPrompt, answer_cache: SemanticAnswerCache
+) -> AsyncIterator[str]:
+    """Stream the retrieval metadata first, then the LLM answer token by token as Server-Sent Events."""
+    yield sse_event("retrieval", {
+        "failed_namespaces": retrieval.query_results.failed_namespaces,
+        "matches": [
+            {"id": match.id, "score": match.score, "namespace": getattr(match, "namespace", None)}
+            for match in retrieval.context
+        ]
+    })
+
+    cached = answer_cache.lookup(retrieval.query_vector, retrieval.vector_ids, retrieval.corpus_version)
+    if cached is not None:
+        yield sse_event("token", {"text": cached})
+        yield sse_event("done", {"prompt_tokens": 0})
+        return
+
+    built = build_prompt(prompt, retrieval, llm)
+    started = time.perf_counter()
+    answer_parts = []
+    try:
+        with span("llm"):
+            async for token in llm.stream_prompt(built.text, built.prompt_tokens):
+                answer_parts.append(token)
+                yield sse_event("token", {"text": token})
+    except Exception as err:  # the response status is already sent, report failures in-band
+        logger.warning("Streaming failed: %s", err)
+        yield sse_event("error", {"detail": str(err)})
+        return
+
+    answer_cache.store(
+        retrieval.query_vector, retrieval.vector_ids, "".join(answer_parts), time.perf_counter() - started,
+        retrieval.corpus_version,
+    )
+    yield sse_event("done", {"prompt_tokens": built.prompt_tokens})
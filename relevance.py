@@ -0,0 +1,52 @@
+"""Relevance filtering and adaptive selection of the retrieved chunks sent to the LLM as context."""
+import hashlib
+
+from request_models import PromptArgs
+
+# metadata fields identifying the document section a chunk was cut from
+SECTION_FIELDS = ("main_header", "header_0", "header_1", "header_2")
+
+
+def section_key(metadata: dict) -> tuple:
+    """Source document and header path of a chunk."""
+    return (metadata.get("source"),) + tuple(metadata.get(field) for field in SECTION_FIELDS)
+
+
+def rank_score(match) -> float:
+    """Score ordering the matches, the reranker's relevance when the match was reranked."""
+    rerank_score = getattr(match, "rerank_score", None)
+    return match.score if rerank_score is None else rerank_score
+
+
+def select_context(matches: list, args: PromptArgs) -> list:
+    """Pick the matches worth sending to the LLM, in descending rank score order.
+
+    A match is dropped when its similarity score is not above `args.mss`, when its content duplicates a
+    better match, or when `args.max_chunks_per_section` better matches of the same source section were
+    already selected. Selection stops at the first rank score drop larger than `args.max_score_gap`
+    between consecutive selected matches. The token budget is applied by the context builder.
+    """
+    selected = []
+    seen_contents = set()
+    section_counts = {}
+
+    for match in sorted(matches, key=rank_score, reverse=True):
+        if match.score <= args.mss:
+            continue
+        if selected and rank_score(selected[-1]) - rank_score(match) > args.max_score_gap:
+            break
+
+        metadata = match.metadata or {}
+        content = metadata.get("content", "")
+        content_hash = hashlib.sha1(" ".join(content.split()).encode("UTF-8")).digest()
+        if content and content_hash in seen_contents:
+            continue
+        section = section_key(metadata)
+        if section_counts.get(section, 0) >= args.max_chunks_per_section:
+            continue
+
+        selected.append(match)
+        seen_contents.add(content_hash)
+        section_counts[section] = section_counts.get(section, 0) + 1
+
+    return selected
@@ -1,7 +1,41 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
+
+FilterValue = str | int | float | bool
 
 
 class PromptArgs(BaseModel):
     """Prompt endpoint customizable arguments."""
     mss: float = Field(default=0.5, gt=0, le=1.0)
     top_k: int = Field(default=5, gt=0)
+    # adaptive context selection, see relevance.select_context
+    max_score_gap: float = Field(default=0.15, ge=0, le=2.0)
+    max_chunks_per_section: int = Field(default=2, gt=0)
+    max_context_tokens: int = Field(default=6000, gt=0)
+    # fuse BM25 matches of the local replica into the dense results
+    hybrid: bool = True
+    # over-fetch candidates and rerank them down to top_k
+    rerank: bool = True
+    # query routing, only these namespaces / sources are searched when set
+    namespaces: list[str] | None = None
+    sources: list[str] | None = None
+    # only vectors whose metadata fields have one of the given values, e.g. {"ms.service": "azure-monitor"}
+    filter: dict[str, FilterValue | list[FilterValue]] | None = None
+    # IVF clusters scanned by the local backend, more raise recall and latency (BARREL_IVF_NPROBE by default)
+    nprobe: int | None = Field(default=None, gt=0)
+
+    @field_validator("filter")
+    @classmethod
+    def check_filter(cls, metadata_filter: dict | None) -> dict | None:
+        """Plain field -> values conditions, operators of the Pinecone filter language are not accepted."""
+        for field, values in (metadata_filter or {}).items():
+            if not field or field.startswith("$"):
+                raise ValueError(f"Invalid filter field: {field!r}")
+            if values == []:
+                raise ValueError(f"No values for the filter field {field!r}")
+        return metadata_filter
+
+
+class BatchPromptRequest(BaseModel):
+    """Batch prompt endpoint request body."""
+    prompts: list[str] = Field(min_length=1, max_length=256)
+    args: PromptArgs = Field(default_factory=PromptArgs)
@@ -0,0 +1,131 @@
+"""Reranking of the over-fetched retrieval candidates before the context is selected."""
+import logging
+import time
+import asyncio
+from abc import ABC, abstractmethod
+
+import aiohttp
+import voyageai
+from voyageai.error import VoyageError
+
+from settings import settings
+from admission import Overloaded
+from telemetry import VOYAGE_TOKENS
+from vector_store import VectorMatch
+from lexical_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+_reranker = None
+
+RERANK_MODEL = "rerank-2"
+# metadata fields of a chunk the rerankers compare with the prompt
+TEXT_FIELDS = ("title", "main_header", "header_0", "header_1", "header_2", "content")
+
+
+def chunk_text(match: VectorMatch) -> str:
+    """Headers and content of a chunk."""
+    return "\n".join(str(value) for field in TEXT_FIELDS if (value := match.metadata.get(field)))
+
+
+class Reranker(ABC):
+    """Scores the relevance of candidate chunks to the prompt, more precisely than the vector search."""
+
+    name = "reranker"
+
+    @abstractmethod
+    async def score(self, prompt: str, matches: list[VectorMatch]) -> list[float]:
+        """Relevance scores of all matches in a single batch, in the order of the matches."""
+
+    async def rerank(self, prompt: str, matches: list[VectorMatch], top_n: int) -> list[VectorMatch]:
+        """Return the top_n matches by relevance, with their rerank_score set.
+
+        If scoring fails or exceeds the BARREL_RERANK_TIMEOUT latency budget the original
+        order of the matches is kept.
+        """
+        if not matches:
+            return matches
+        started = time.perf_counter()
+        try:
+            scores = await asyncio.wait_for(self.score(prompt, matches), timeout=settings.rerank_timeout)
+        except (asyncio.TimeoutError, Overloaded, VoyageError, aiohttp.ClientError) as err:
+            # reranking only improves the order, an unavailable reranker must not fail the request
+            logger.warning(
+                "Reranking skipped, %s failed after %.3fs: %r", self.name, time.perf_counter() - started, err
+            )
+            return matches[:top_n]
+
+        for match, score in zip(matches, scores):
+            match.rerank_score = score
+        reranked = sorted(matches, key=lambda match: match.rerank_score, reverse=True)[:top_n]
+        logger.debug(
+            "%s reranker scored %d candidates in %.3fs", self.name, len(matches), time.perf_counter() - started
+        )
+        return reranked
+
+
+class LocalReranker(Reranker):
+    """CPU-only reranker combining the vector similarity with the overlap of prompt and chunk terms.
+
+    The similarity is the score of the match, which already is the cosine of the query and the chunk vector:
+    Voyage embeddings have unit length, and the local replica and the lexical fusion score matches with the
+    exact cosine of the replica vectors. It is not recomputed against the replica vectors for that reason.
+    """
+
+    name = "local"
+
+    def __init__(self, lexical_weight: float = 0.3) -> None:
+        self.lexical_weight = lexical_weight
+
+    async def score(self, prompt: str, matches: list[VectorMatch]) -> list[float]:
+        # in a thread, so the event loop keeps serving and the rerank timeout can give up on it
+        return await asyncio.to_thread(self._score, prompt, matches)
+
+    def _score(self, prompt: str, matches: list[VectorMatch]) -> list[float]:
+        query_terms = set(tokenize(prompt))
+        scores = []
+        for match in matches:
+            overlap = len(query_terms.intersection(tokenize(chunk_text(match)))) / max(len(query_terms), 1)
+            scores.append((1 - self.lexical_weight) * match.score + self.lexical_weight * overlap)
+        return scores
+
+
+class VoyageReranker(Reranker):
+    """Cross-encoder reranking with the Voyage rerank API, one request per candidate batch."""
+
+    name = "voyage"
+
+    def __init__(self, embedder) -> None:
+        # shares the client and the keep-alive connection pool of the embedder
+        self.embedder = embedder
+
+    async def score(self, prompt: str, matches: list[VectorMatch]) -> list[float]:
+        await self.embedder.rate_limiter.acquire(max_wait=settings.rate_limit_max_wait)
+        token = voyageai.aiosession.set(self.embedder._get_session())
+        try:
+            async with self.embedder.semaphore:
+                result = await self.embedder.client.rerank(
+                    prompt, [chunk_text(match) for match in matches], model=RERANK_MODEL, truncation=True
+                )
+        finally:
+            voyageai.aiosession.reset(token)
+
+        scores = [0.0] * len(matches)
+        for item in result.results:
+            scores[item.index] = item.relevance_score
+        VOYAGE_TOKENS.inc(result.total_tokens, operation="rerank")
+        return scores
+
+
+def get_reranker() -> Reranker | None:
+    """Get or create the singleton reranker configured by BARREL_RERANKER, None when reranking is off."""
+    global _reranker
+    if _reranker is None:
+        if settings.reranker == "local":
+            _reranker = LocalReranker()
+        elif settings.reranker == "voyage":
+            from embedding_client_voyage import get_embedder_client
+            _reranker = VoyageReranker(get_embedder_client())
+        elif settings.reranker != "none":
+            raise ValueError(f"Unknown reranker: {settings.reranker}")
+    return _reranker
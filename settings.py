@@ -0,0 +1,119 @@
+"""Runtime tuning knobs of the RAG backend."""
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    """Read an integer environment variable with a fallback value."""
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_float(name: str, default: float) -> float:
+    """Read a float environment variable with a fallback value."""
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+class Settings:
+    """Runtime settings manager class."""
+
+    def __init__(self):
+        """Load settings from BARREL_* env variables."""
+        # gunicorn server of gunicorn.conf.py: worker processes (0 for one per CPU), keep-alive of idle client
+        # connections, seconds in-flight requests (long LLM completions) get to finish on shutdown, and
+        # preloading the app, so the read-only state is built once and shared copy-on-write by the workers
+        self.server_bind = os.getenv("BARREL_BIND", "0.0.0.0:8000")
+        self.server_workers = _env_int("BARREL_WORKERS", 0)
+        self.server_keepalive = _env_int("BARREL_KEEPALIVE", 75)
+        self.server_graceful_timeout = _env_int("BARREL_GRACEFUL_TIMEOUT", 150)
+        self.server_preload = _env_int("BARREL_PRELOAD", 1)
+
+        # max number of in-flight upstream calls per pipeline stage and worker
+        self.embed_concurrency = _env_int("BARREL_EMBED_CONCURRENCY", 32)
+        self.vector_query_concurrency = _env_int("BARREL_VECTOR_QUERY_CONCURRENCY", 32)
+        self.llm_concurrency = _env_int("BARREL_LLM_CONCURRENCY", 16)
+
+        # keep-alive HTTP connection pools of the long-lived upstream clients
+        self.embed_pool_size = _env_int("BARREL_EMBED_POOL_SIZE", 32)
+        self.llm_pool_size = _env_int("BARREL_LLM_POOL_SIZE", 32)
+        self.http_keepalive_expiry = _env_float("BARREL_HTTP_KEEPALIVE_EXPIRY", 60.0)
+
+        # upstream timeouts in seconds
+        self.connect_timeout = _env_float("BARREL_CONNECT_TIMEOUT", 5.0)
+        self.embed_timeout = _env_float("BARREL_EMBED_TIMEOUT", 10.0)
+        self.llm_timeout = _env_float("BARREL_LLM_TIMEOUT", 120.0)
+
+        # admission control: pipeline executions in flight per worker, the batch lane may only take part of them,
+        # requests waiting longer than the max wait of their lane or beyond the queue size are rejected with 503
+        self.admission_max_in_flight = _env_int("BARREL_ADMISSION_MAX_IN_FLIGHT", 128)
+        self.admission_batch_max_in_flight = _env_int("BARREL_ADMISSION_BATCH_MAX_IN_FLIGHT", 32)
+        self.admission_max_queue = _env_int("BARREL_ADMISSION_MAX_QUEUE", 512)
+        self.admission_max_wait = _env_float("BARREL_ADMISSION_MAX_WAIT", 2.0)
+        self.admission_batch_max_wait = _env_float("BARREL_ADMISSION_BATCH_MAX_WAIT", 60.0)
+
+        # upstream rate limits per worker (0 disables them), set to the API quota divided by the number of workers
+        self.voyage_rps = _env_float("BARREL_VOYAGE_RPS", 0.0)
+        self.pinecone_rps = _env_float("BARREL_PINECONE_RPS", 0.0)
+        self.llm_rps = _env_float("BARREL_LLM_RPS", 0.0)
+        self.llm_tpm = _env_float("BARREL_LLM_TPM", 0.0)
+        # completion tokens reserved per LLM call in the tokens/min limit
+        self.llm_completion_tokens = _env_int("BARREL_LLM_COMPLETION_TOKENS", 500)
+        # longest wait for an upstream rate limit before the request is rejected with 503
+        self.rate_limit_max_wait = _env_float("BARREL_RATE_LIMIT_MAX_WAIT", 5.0)
+        # SDK retries of failed upstream calls, every retry adds load to a saturated upstream
+        self.upstream_max_retries = _env_int("BARREL_UPSTREAM_MAX_RETRIES", 1)
+
+        # hard limit of the LLM prompt size in tokens, caps the per-request max_context_tokens
+        self.max_prompt_tokens = _env_int("BARREL_MAX_PROMPT_TOKENS", 32768)
+
+        # query embedding cache, the on-disk tier is disabled when no path is set
+        self.embed_cache_max_entries = _env_int("BARREL_EMBED_CACHE_MAX_ENTRIES", 4096)
+        self.embed_cache_ttl = _env_float("BARREL_EMBED_CACHE_TTL", 7 * 86400.0)
+        self.embed_cache_path = os.getenv("BARREL_EMBED_CACHE_PATH", "")
+
+        # semantic answer cache, 0 entries disables it
+        self.answer_cache_max_entries = _env_int("BARREL_ANSWER_CACHE_MAX_ENTRIES", 1024)
+        self.answer_cache_similarity = _env_float("BARREL_ANSWER_CACHE_SIMILARITY", 0.97)
+
+        # vector database backend: "pinecone" or "local" (memory-mapped snapshot of the exported index)
+        self.vector_backend = os.getenv("BARREL_VECTOR_BACKEND", "pinecone")
+        self.vector_snapshot_dir = os.getenv("BARREL_VECTOR_SNAPSHOT_DIR", "cache/snapshots")
+        # codes scanned by local queries: "none" (exact float32 search), "int8" or "binary"
+        self.vector_quantization = os.getenv("BARREL_VECTOR_QUANTIZATION", "none")
+        # shortlist of a quantized query rescored with the float32 vectors, as a multiple of top_k
+        self.quantization_rescore = _env_int("BARREL_QUANTIZATION_RESCORE", 8)
+        # approximate index of local queries: "flat" (scan every row) or "ivf" (scan the nearest clusters)
+        self.vector_index = os.getenv("BARREL_VECTOR_INDEX", "flat")
+        # IVF clusters, 0 for the square root of the vector count, and clusters scanned per query
+        self.ivf_lists = _env_int("BARREL_IVF_LISTS", 0)
+        self.ivf_nprobe = _env_int("BARREL_IVF_NPROBE", 8)
+
+        # deadline of the per-namespace Pinecone queries, slower namespaces are left out of the results
+        self.namespace_query_timeout = _env_float("BARREL_NAMESPACE_QUERY_TIMEOUT", 2.0)
+
+        # hybrid retrieval with a BM25 index of the local vector replica, 0 disables it
+        self.lexical_search = _env_int("BARREL_LEXICAL_SEARCH", 1)
+
+        # reranking of over-fetched candidates: "local", "voyage" or "none"
+        self.reranker = os.getenv("BARREL_RERANKER", "local")
+        self.rerank_candidates = _env_int("BARREL_RERANK_CANDIDATES", 50)
+        # latency budget of the reranker in seconds, the vector search order is kept when it is exceeded
+        self.rerank_timeout = _env_float("BARREL_RERANK_TIMEOUT", 0.5)
+
+        # background refresh of the Pinecone index stats, failures are retried with exponential backoff
+        self.stats_refresh_interval = _env_float("BARREL_STATS_REFRESH_INTERVAL", 300.0)
+        self.retry_backoff_base = _env_float("BARREL_RETRY_BACKOFF_BASE", 1.0)
+        self.retry_backoff_max = _env_float("BARREL_RETRY_BACKOFF_MAX", 60.0)
+
+        # incremental sync of the local vector replica with Pinecone, 0 seconds disables the background task
+        self.vector_sync_interval = _env_float("BARREL_VECTOR_SYNC_INTERVAL", 0.0)
+        self.vector_sync_concurrency = _env_int("BARREL_VECTOR_SYNC_CONCURRENCY", 8)
+        self.vector_sync_compact_ratio = _env_float("BARREL_VECTOR_SYNC_COMPACT_RATIO", 0.05)
+
+        # observability: level of the buffered logs, 1 adds the stage durations as a Server-Timing response header
+        self.log_level = os.getenv("BARREL_LOG_LEVEL", "INFO")
+        self.server_timing = _env_int("BARREL_SERVER_TIMING", 0)
+
+
+# Import this variable directly from this file as a singleton
+settings = Settings()
@@ -0,0 +1,108 @@
+"""Coalescing of identical concurrent requests into a single upstream execution."""
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Hashable
+
+from embedding_cache import normalize_prompt
+from request_models import PromptArgs
+
+_single_flight = None
+
+
+def request_key(prompt: str, args: PromptArgs) -> tuple[str, str]:
+    """Requests with the same normalized prompt and arguments get the same answer."""
+    return normalize_prompt(prompt), args.model_dump_json()
+
+
+class _Broadcast:
+    """Items of a stream buffered for every subscriber, including the ones joining late."""
+
+    def __init__(self) -> None:
+        self.items: list = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.changed = asyncio.Event()
+        # strong reference to the producer task, the event loop only keeps weak ones
+        self.producer: asyncio.Task | None = None
+
+    def notify(self) -> None:
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    async def subscribe(self) -> AsyncIterator:
+        position = 0
+        while True:
+            while position < len(self.items):
+                yield self.items[position]
+                position += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self.changed.wait()
+
+
+class SingleFlight:
+    """Run a coroutine or stream at most once per key at a time, sharing its result with every caller.
+
+    The shared execution runs in its own task, so a disconnecting caller does not cancel it
+    for the others. A key is released when its execution finishes, later callers start a new one.
+    """
+
+    def __init__(self) -> None:
+        self.calls: dict[Hashable, asyncio.Task] = {}
+        self.streams: dict[Hashable, _Broadcast] = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Await the in-flight call of the key or start it."""
+        task = self.calls.get(key)
+        if task is None:
+            self.executions += 1
+            task = self.calls[key] = asyncio.ensure_future(func())
+            task.add_done_callback(lambda _task: self.calls.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def stream(self, key: Hashable, func: Callable[[], AsyncIterator]) -> AsyncIterator:
+        """Iterate the in-flight stream of the key from its first item or start it."""
+        broadcast = self.streams.get(key)
+        if broadcast is None:
+            self.executions += 1
+            broadcast = self.streams[key] = _Broadcast()
+            broadcast.producer = asyncio.ensure_future(self._produce(key, broadcast, func))
+        else:
+            self.coalesced += 1
+        async for item in broadcast.subscribe():
+            yield item
+
+    async def _produce(self, key: Hashable, broadcast: _Broadcast, func: Callable[[], AsyncIterator]) -> None:
+        try:
+            async for item in func():
+                broadcast.items.append(item)
+                broadcast.notify()
+        except Exception as err:  # re-raised in every subscriber
+            broadcast.error = err
+        finally:
+            broadcast.done = True
+            broadcast.notify()
+            self.streams.pop(key, None)
+
+    def stats(self) -> dict[str, int | float]:
+        """Return the coalescing counters."""
+        requests = self.executions + self.coalesced
+        return {
+            "in_flight": len(self.calls) + len(self.streams),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "coalesced_rate": self.coalesced / requests if requests else 0.0,
+        }
+
+
+def get_single_flight() -> SingleFlight:
+    """Get or create the singleton request coalescing layer of this worker."""
+    global _single_flight
+    if _single_flight is None:
+        _single_flight = SingleFlight()
+    return _single_flight
@@ -0,0 +1,226 @@
+"""Per-stage latency spans, usage counters in the Prometheus text format and buffered logging."""
+import os
+import sys
+import time
+import bisect
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from settings import settings
+
+# upper bounds in seconds of the latency histogram buckets, from cache hits to long LLM completions
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# stage durations of the request being served, None outside of a request
+_request_timings: ContextVar[dict[str, float] | None] = ContextVar("request_timings", default=None)
+_log_listener = None
+# queue handler and stdout handler of the root logger, created by the first configure_logging()
+_log_handlers: tuple[logging.handlers.QueueHandler, logging.Handler] | None = None
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values: dict[tuple[str, ...], float] = {}
+        # the vector sync and the lexical index update metrics from worker threads too
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self.values.get(tuple(str(labels[name]) for name in self.labels), 0.0)
+
+    def samples(self) -> Iterator[str]:
+        with self.lock:
+            values = sorted(self.values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labels, key)} {value:g}"
+
+
+class Histogram:
+    """Cumulative bucket histogram with optional labels."""
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        # per label values: [count per bucket (the last one is +Inf), sum of the observations]
+        self.values: dict[tuple[str, ...], list] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self.lock:
+            counts, _ = entry = self.values.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0])
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+
+    def count(self, **labels: str) -> int:
+        entry = self.values.get(tuple(str(labels[name]) for name in self.labels))
+        return sum(entry[0]) if entry else 0
+
+    def samples(self) -> Iterator[str]:
+        with self.lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self.values.items())
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                bucket_labels = _format_labels(self.labels, key, f'le="{le}"')
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, key)} {total:g}"
+            yield f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}"
+
+
+class Registry:
+    """Metrics of this worker process, rendered for GET /metrics."""
+
+    def __init__(self) -> None:
+        self.metrics: list[Counter | Histogram] = []
+
+    def counter(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, documentation, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> Histogram:
+        metric = Histogram(name, documentation, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    "barrel_request_duration_seconds", "Duration of the HTTP requests until the response starts.", ("path", "status")
+)
+STAGE_SECONDS = registry.histogram("barrel_stage_duration_seconds", "Duration of the RAG pipeline stages.", ("stage",))
+VOYAGE_TOKENS = registry.counter("barrel_voyage_tokens_total", "Tokens billed by the Voyage API.", ("operation",))
+PINECONE_READ_UNITS = registry.counter(
+    "barrel_pinecone_read_units_total", "Read units consumed by Pinecone requests.", ("operation",)
+)
+LLM_TOKENS = registry.counter("barrel_llm_tokens_total", "Tokens of the LLM completions.", ("kind",))
+CACHE_LOOKUPS = registry.counter("barrel_cache_lookups_total", "Lookups of the caches.", ("cache", "result"))
+ADMISSIONS = registry.counter(
+    "barrel_admissions_total", "Admission decisions of the pipeline executions.", ("lane", "result")
+)
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time a pipeline stage into the stage histogram and the Server-Timing of the current request."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            # concurrent items of a batch request add up
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+def start_request() -> dict[str, float]:
+    """Collect the stage durations of the spans of the current request, and of the tasks it starts, into a dict."""
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def server_timing(timings: dict[str, float]) -> str:
+    """Format stage durations as the value of a Server-Timing header, in milliseconds."""
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
+
+def configure_logging() -> None:
+    """Log through a queue, so request handlers never wait for the writes to stdout.
+
+    The level is set by BARREL_LOG_LEVEL. Idempotent, every worker process configures itself once,
+    workers forked from a configured process (gunicorn --preload) restart the listener thread.
+    After stop_logging() the records are written synchronously until logging is configured again.
+    """
+    global _log_handlers
+    if _log_listener is not None:
+        return
+    if _log_handlers is None:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s"))
+        _log_handlers = (logging.handlers.QueueHandler(queue.SimpleQueue()), handler)
+        atexit.register(stop_logging)
+        os.register_at_fork(after_in_child=_restart_listener)
+
+    queue_handler, handler = _log_handlers
+    _start_listener()
+    root = logging.getLogger()
+    root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(settings.log_level.upper())
+
+
+def stop_logging() -> None:
+    """Write out the queued records, stop the listener thread and write later records synchronously.
+
+    Called once the upstream clients are closed, so the warnings of the interpreter shutdown still reach stdout.
+    """
+    global _log_listener
+    if _log_listener is None:
+        return
+    queue_handler, handler = _log_handlers
+    root = logging.getLogger()
+    root.removeHandler(queue_handler)
+    # processes the records still in the queue before returning
+    _log_listener.stop()
+    _log_listener = None
+    root.addHandler(handler)
+
+
+def _start_listener() -> None:
+    global _log_listener
+    queue_handler, handler = _log_handlers
+    queue_handler.queue = queue.SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(queue_handler.queue, handler)
+    _log_listener.start()
+
+
+def _restart_listener() -> None:
+    # threads do not survive a fork, the child gets a new queue and listener thread
+    if _log_listener is not None:
+        _start_listener()
@@ -0,0 +1,109 @@
+"""Unit tests of the admission control and the upstream rate limiters."""
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, Overloaded, TokenBucket
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_token_bucket_paces_and_refuses_long_waits():
+    """Bursts up to the capacity pass, then callers wait for the refill or are refused past their max wait."""
+    clock = FakeClock()
+    bucket = TokenBucket("test", rate=10, capacity=2, clock=clock)
+    sleeps = []
+
+    async def main():
+        original_sleep = asyncio.sleep
+
+        async def fake_sleep(seconds):
+            sleeps.append(seconds)
+            await original_sleep(0)
+
+        asyncio.sleep = fake_sleep
+        try:
+            await bucket.acquire()
+            await bucket.acquire()
+            assert sleeps == []
+            await bucket.acquire()
+            assert sleeps == [pytest.approx(0.1)]
+            with pytest.raises(Overloaded) as err:
+                await bucket.acquire(5, max_wait=0.2)
+            assert err.value.retry_after_header == "1"
+            clock.now += 1.0
+            await bucket.acquire(2)
+            assert len(sleeps) == 1
+        finally:
+            asyncio.sleep = original_sleep
+
+    asyncio.run(main())
+
+
+def test_disabled_token_bucket_never_waits():
+    async def main():
+        bucket = TokenBucket("test", rate=0)
+        for _ in range(1000):
+            await bucket.acquire(max_wait=0)
+
+    asyncio.run(main())
+
+
+def test_interactive_requests_start_before_queued_batch_items():
+    """Freed slots go to the interactive lane first, batch items are capped at their share."""
+    admission = AdmissionController(max_in_flight=2, batch_max_in_flight=1, max_queue=10)
+    started = []
+
+    async def run(lane, name, hold):
+        async with admission.slot(lane, max_wait=5):
+            started.append(name)
+            await hold.wait()
+
+    async def main():
+        hold = asyncio.Event()
+        tasks = [asyncio.create_task(run("batch", "batch-1", hold))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(run("batch", "batch-2", hold)))
+        await asyncio.sleep(0)
+        # the batch lane is full, batch-2 waits although a slot is free
+        assert started == ["batch-1"]
+        assert admission.stats()["batch"] == {"in_flight": 1, "queued": 1}
+        tasks.append(asyncio.create_task(run("interactive", "interactive-1", hold)))
+        tasks.append(asyncio.create_task(run("interactive", "interactive-2", hold)))
+        await asyncio.sleep(0)
+        assert started == ["batch-1", "interactive-1"]
+        hold.set()
+        await asyncio.gather(*tasks)
+        assert started.index("interactive-2") < started.index("batch-2")
+        assert admission.stats() == {lane: {"in_flight": 0, "queued": 0} for lane in ("interactive", "batch")}
+
+    asyncio.run(main())
+
+
+def test_full_queue_and_timeouts_are_rejected():
+    """Requests are shed with Overloaded when the queue is full or no slot frees up in time."""
+    admission = AdmissionController(max_in_flight=1, batch_max_in_flight=1, max_queue=1)
+
+    async def main():
+        await admission.acquire("interactive", max_wait=1)
+        waiting = asyncio.create_task(admission.acquire("interactive", max_wait=5))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded):
+            await admission.acquire("interactive", max_wait=5)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        with pytest.raises(Overloaded):
+            await admission.acquire("interactive", max_wait=0.01)
+        admission.release("interactive")
+        # cancelled and timed out waiters left no slot or queue entry behind
+        assert admission.stats()["interactive"] == {"in_flight": 0, "queued": 0}
+        await admission.acquire("interactive", max_wait=0)
+
+    asyncio.run(main())
@@ -0,0 +1,46 @@
+"""Unit tests of the semantic answer cache."""
+from answer_cache import SemanticAnswerCache
+
+
+def test_near_duplicate_question_with_same_context_hits():
+    """Answers are reused for similar query embeddings that retrieved the same vector ids."""
+    cache = SemanticAnswerCache(similarity_threshold=0.95)
+    cache.store([1.0, 0.0, 0.0], ["a", "b"], "answer", llm_seconds=2.0)
+
+    assert cache.lookup([0.99, 0.05, 0.0], ["b", "a"]) == "answer"
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["saved_llm_seconds"] == 2.0
+
+
+def test_different_question_or_context_misses():
+    """Dissimilar questions and different retrieved contexts are not served from the cache."""
+    cache = SemanticAnswerCache(similarity_threshold=0.95)
+    cache.store([1.0, 0.0, 0.0], ["a", "b"], "answer", llm_seconds=2.0)
+
+    assert cache.lookup([0.0, 1.0, 0.0], ["a", "b"]) is None
+    assert cache.lookup([1.0, 0.0, 0.0], ["a", "c"]) is None
+    assert cache.stats()["misses"] == 2
+
+
+def test_corpus_change_invalidates():
+    """A new corpus version drops every cached answer."""
+    cache = SemanticAnswerCache()
+    cache.store([1.0, 0.0], ["a"], "answer", llm_seconds=1.0, corpus_version="ns:10")
+
+    assert cache.lookup([1.0, 0.0], ["a"], corpus_version="ns:10") == "answer"
+    assert cache.lookup([1.0, 0.0], ["a"], corpus_version="ns:11") is None
+    assert cache.stats()["invalidations"] == 1
+    assert cache.stats()["size"] == 0
+
+
+def test_least_recently_used_slot_is_replaced():
+    """The least recently used answer is replaced when the cache is full."""
+    cache = SemanticAnswerCache(max_entries=2)
+    cache.store([1.0, 0.0, 0.0], ["a"], "first", llm_seconds=1.0)
+    cache.store([0.0, 1.0, 0.0], ["b"], "second", llm_seconds=1.0)
+    cache.lookup([1.0, 0.0, 0.0], ["a"])
+    cache.store([0.0, 0.0, 1.0], ["c"], "third", llm_seconds=1.0)
+
+    assert cache.lookup([1.0, 0.0, 0.0], ["a"]) == "first"
+    assert cache.lookup([0.0, 1.0, 0.0], ["b"]) is None
+    assert cache.lookup([0.0, 0.0, 1.0], ["c"]) == "third"
@@ -1,25 +1,34 @@
 """End-to-end tests."""
+import os
 import re
+import time
+import asyncio
 from pathlib import Path
 
-from fastapi.testclient import TestClient
-from openai import OpenAI, RateLimitError, AuthenticationError
+import httpx
+import numpy as np
+from openai import AsyncOpenAI, RateLimitError, AuthenticationError
 import pytest
 
 from main import app
 from credentials.secrets import secrets
 from tests.utils import (
     load_test_suit, calculate_and_display_test_score,
-    display_table, save_test_results, results_dir, TestCase
+    display_table, save_test_results, results_dir, TestCase,
+    GradeCache, RetryLater, with_retries,
 )
 
 
-client = TestClient(app)
-evaluator_client = OpenAI(api_key=secrets.llm_api_key)
+# questions answered / graded at the same time, the evaluator retries rate limited calls
+CONCURRENCY = int(os.getenv("BARREL_E2E_CONCURRENCY", "8"))
+READY_TIMEOUT = 120
+
+# retries are handled by with_retries, honoring the Retry-After of rate limited calls
+evaluator_client = AsyncOpenAI(api_key=secrets.llm_api_key, max_retries=0)
 current_dir = Path(__file__).parent
 
 
-def evaluate_test_with_llm(test_case: TestCase) -> dict[str, float | str]:
+async def evaluate_test_with_llm(test_case: TestCase) -> dict[str, float | str]:
     """
     Send an evaluation request to an LLM, using a super prompt that
     includes the question, the expected reference answer, and the API answer.
@@ -42,12 +51,14 @@ def evaluate_test_with_llm(test_case: TestCase) -> dict[str, float | str]:
         "if it aligns with the reference answer, give it a 10."
     )
 
-    response = evaluator_client.responses.create(model="gpt-4o", input=prompt)
+    try:
+        response = await evaluator_client.responses.create(model="gpt-4o", input=prompt)
+    except RateLimitError as err:
+        raise RetryLater(float(err.response.headers.get("retry-after") or 0)) from err
 
     # sample answer: 'rating=[9]'
     if match := re.search(r'\d+(?:\.\d+)?', response.output_text):
         number = float(match.group())  # The LLM is not reliable, it can give the rating as a float
-        print("Extracted number:", number)
         eval_result = {"rating": number, "eval_explanation": response.output_text}
     else:
         print(f"  FAILED to find rating in LLM evaluation response: {response.output_text}")
@@ -56,42 +67,98 @@ def evaluate_test_with_llm(test_case: TestCase) -> dict[str, float | str]:
     return eval_result
 
 
-def executor(test_yaml: Path):
-    """Test cases of az-networking-2.yaml."""
+async def answer_question(client: httpx.AsyncClient, test_case: TestCase) -> None:
+    """Ask Barrel the question of a test case and record the answer and its latency."""
+    async def ask() -> httpx.Response:
+        response = await client.post(app.url_path_for("user_prompt"), params={"prompt": test_case["question"]}, json={})
+        if response.status_code in (429, 503):
+            raise RetryLater(float(response.headers.get("retry-after") or 0))
+        return response
+
+    started = time.perf_counter()
+    response = await with_retries(ask)
+    test_case["latency_seconds"] = round(time.perf_counter() - started, 3)
+    if response.status_code == 200:
+        test_case["llm_answer"] = response.json()
+    else:
+        test_case["llm_answer"] = f"HTTP {response.status_code}: {response.text}"
+
+
+async def wait_until_ready(client: httpx.AsyncClient) -> None:
+    """Wait for the background warmup of the app."""
+    deadline = time.monotonic() + READY_TIMEOUT
+    while (await client.get(app.url_path_for("ready"))).status_code != 200:
+        if time.monotonic() > deadline:
+            pytest.fail(f"Barrel was not ready after {READY_TIMEOUT}s")
+        await asyncio.sleep(0.5)
+
+
+def suite_results(test_suit: list[TestCase]) -> dict:
+    """Score, latency percentiles and evaluations of the test cases graded so far."""
+    graded = [tc for tc in test_suit if tc["rating"] != -1]
+    latencies = [tc["latency_seconds"] for tc in test_suit if tc["latency_seconds"] is not None]
+    p50, p95 = np.percentile(latencies, [50, 95]).tolist() if latencies else (None, None)
+    return {
+        "final_score_percentage": sum(tc["rating"] for tc in graded) / (len(graded) * 10) * 100 if graded else 0.0,
+        "graded": f"{len(graded)}/{len(test_suit)}",
+        "latency_p50_seconds": p50,
+        "latency_p95_seconds": p95,
+        "evaluations": test_suit,
+    }
+
+
+async def run_suite(test_yaml: Path, report_file_path: Path) -> list[TestCase]:
+    """Answer and grade the questions of a suite concurrently, saving the results after every graded question.
+
+    Grades of unchanged answers are reused from earlier runs.
+    """
     test_suit = load_test_suit(test_yaml)
+    grade_cache = GradeCache(results_dir / "grades.yaml")
+    semaphore = asyncio.Semaphore(CONCURRENCY)
 
-    for tc in test_suit:
-        response = client.post(
-            app.url_path_for("user_prompt"),
-            params={"prompt": tc["question"]},
-            json={}
-        )
-        response.raise_for_status()
-        tc["llm_answer"] = response.json()
-        # print(f"  Barrel has answered the question: '{tc["question"]}'")
+    async def run_test_case(client: httpx.AsyncClient, test_case: TestCase) -> None:
+        async with semaphore:
+            await answer_question(client, test_case)
+            eval_result = grade_cache.get(test_case)
+            if eval_result is None:
+                eval_result = await with_retries(lambda: evaluate_test_with_llm(test_case))
+                grade_cache.put(test_case, eval_result)
+        test_case.update(eval_result)
+        save_test_results(report_file_path, suite_results(test_suit))
 
-        try:
-            eval_result = evaluate_test_with_llm(tc)
-        except (AuthenticationError, RateLimitError) as err:
-            pytest.exit(reason=f"UNABLE TO EVALUATE TEST: {err.args[0]}")
+    # the lifespan starts the upstream clients and their warmup, as in production
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://barrel", timeout=300) as client:
+            await wait_until_ready(client)
+            await asyncio.gather(*(run_test_case(client, test_case) for test_case in test_suit))
 
-        tc.update(eval_result)
+    return test_suit
+
+
+def executor(test_yaml: Path):
+    """Answer and grade the questions of a test suite, then report the score and the latencies."""
+    report_file_path = results_dir / test_yaml.name.replace(test_yaml.suffix, ".yaml")
+    try:
+        test_suit = asyncio.run(run_suite(test_yaml, report_file_path))
+    except AuthenticationError as err:
+        pytest.exit(reason=f"UNABLE TO EVALUATE TEST: {err.args[0]}")
 
     print(f"LLM test evaluation for {test_yaml.name}")
-    final_score = calculate_and_display_test_score(test_suit)
+    calculate_and_display_test_score(test_suit)
 
     # --- Display the test results as a table ---
     display_table(test_suit)
-
-    results = {
-        "final_score_percentage": final_score,
-        "evaluations": test_suit
-    }
-    report_file_path = results_dir / test_yaml.name.replace(test_yaml.suffix, ".yaml")
-    save_test_results(report_file_path, results)
+    save_test_results(report_file_path, suite_results(test_suit))
 
 
 def test_az_networking_2_qa():
     """Test cases of az-networking-2.yaml."""
     test_yaml = current_dir / "az-networking-2.yaml"
     executor(test_yaml)
+
+
+def test_az_networking_50_qa():
+    """Test cases of az-networking-50.yaml."""
+    test_yaml = current_dir / "az-networking-50.yaml"
+    executor(test_yaml)
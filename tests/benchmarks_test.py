@@ -0,0 +1,48 @@
+"""Unit tests of the offline benchmark harness."""
+import asyncio
+
+import numpy as np
+
+from benchmarks.fakes import FakeEmbedder, LatencyModel, build_corpus
+from benchmarks.load_test import Sample, parse_server_timing, summarize
+
+
+def test_latency_model_matches_median_and_p99():
+    """Samples follow the configured log-normal distribution and are reproducible."""
+    model = LatencyModel.parse("100,400", seed=1)
+    samples = np.array([model.sample() for _ in range(20_000)])
+
+    assert abs(np.median(samples) - 0.1) < 0.005
+    assert abs(np.percentile(samples, 99) - 0.4) < 0.04
+    assert LatencyModel.parse("100,400", seed=1).sample() == samples[0]
+    assert LatencyModel.parse("0").sample() == 0.0
+
+
+def test_fake_embeddings_retrieve_the_chunks_of_the_question():
+    """The chunks generated for a question are its nearest neighbours in the fake corpus."""
+    questions = [("What is a VNet?", "A virtual network."), ("What is an NSG?", "A network security group.")]
+    corpus = build_corpus(questions, size=500)
+    embedder = FakeEmbedder(LatencyModel())
+
+    async def search():
+        vector = await embedder.embed_query("what is an  NSG?")
+        return await corpus.query(vector, top_k=4)
+
+    results = asyncio.run(search())
+
+    assert len(corpus) == 500
+    assert {match.id for match in results.matches} == {f"q1-{chunk}" for chunk in range(4)}
+    assert all(match.score > 0.5 for match in results.matches)
+
+
+def test_summary_percentiles_per_stage():
+    """Stage percentiles come from the Server-Timing headers, failed requests only count as errors."""
+    stages = parse_server_timing("embed;dur=10.0, vector_query;dur=30.0, total;dur=50.0")
+    assert stages == {"embed": 0.01, "vector_query": 0.03, "total": 0.05}
+
+    report = summarize([Sample(200, 0.05, stages=stages), Sample(200, 0.07, stages=stages), Sample(503, 0.0)], 2.0)
+
+    assert report["errors"] == 1 and report["throughput_rps"] == 1.5
+    assert set(report["stages"]) == {"total", "embed", "vector_query"}
+    assert report["stages"]["total"]["p50_ms"] == 60.0
+    assert report["stages"]["embed"]["count"] == 2
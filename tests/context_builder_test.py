@@ -0,0 +1,46 @@
+"""Unit tests of the token-budgeted context builder."""
+import json
+
+from context_builder import ContextBuilder, render_chunk
+from vector_store import VectorMatch
+
+
+def match(vector_id: str, score: float, content: str, **metadata) -> VectorMatch:
+    return VectorMatch(id=vector_id, score=score, metadata={"content": content, **metadata})
+
+
+def test_render_chunk_strips_empty_and_repeated_fields():
+    """Empty values and values repeating an earlier field are not sent to the LLM."""
+    rendered = json.loads(render_chunk(match(
+        "a", 0.812345, "body", title="Intro", main_header="Intro", description="N/A", header_0="", source="a.md",
+    )))
+    assert rendered == {"score": 0.8123, "main_header": "Intro", "source": "a.md", "content": "body"}
+    assert list(rendered)[-1] == "content"
+
+
+def test_build_packs_chunks_into_the_budget():
+    """Chunks that do not fit are skipped and the prompt token count is reported."""
+    builder = ContextBuilder("gpt-4.1", max_prompt_tokens=100_000)
+    small, large = "small chunk " * 10, "large chunk " * 400
+    matches = [match("a", 0.9, small), match("b", 0.8, large), match("c", 0.7, small + "again")]
+    budget = 2 * builder.count_tokens(render_chunk(matches[0])) + 20
+
+    built = builder.build("What is a VNet?", matches, budget)
+
+    assert [chunk.id for chunk in built.chunks] == ["a", "c"]
+    assert built.dropped_chunks == 1
+    assert built.context_tokens <= budget
+    assert "What is a VNet?" in built.text and "large chunk" not in built.text
+    assert built.prompt_tokens == builder.count_tokens(built.text)
+
+
+def test_build_never_overflows_the_prompt_limit():
+    """A single chunk larger than the whole prompt limit is truncated."""
+    builder = ContextBuilder("gpt-4.1", max_prompt_tokens=100_000)
+    builder.load()
+    builder.max_prompt_tokens = builder.template_tokens + 200
+
+    built = builder.build("question", [match("a", 0.9, "word " * 5000)], 10_000)
+
+    assert [chunk.id for chunk in built.chunks] == ["a"]
+    assert built.prompt_tokens <= builder.max_prompt_tokens + 1
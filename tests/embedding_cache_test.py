@@ -0,0 +1,104 @@
+"""Unit tests of the query embedding cache."""
+import asyncio
+
+import pytest
+
+import embedding_cache
+from embedding_cache import EmbeddingCache, normalize_prompt
+
+
+class FakeClock:
+    """Manually advanced clock."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_normalize_prompt():
+    """Case and whitespace differences map to the same prompt."""
+    assert normalize_prompt("  Can VNets   span\tregions? ") == normalize_prompt("can vnets span regions?")
+
+
+def test_cache_hit_and_miss():
+    """Cached embeddings are returned for the same prompt, model and input type only."""
+    cache = EmbeddingCache(max_entries=10)
+    assert asyncio.run(cache.get("question", "model", "query")) is None
+
+    cache.put("question", "model", "query", [0.5, 0.25])
+
+    assert asyncio.run(cache.get(" Question ", "model", "query")) == [0.5, 0.25]
+    assert asyncio.run(cache.get("question", "other-model", "query")) is None
+    assert asyncio.run(cache.get("question", "model", "document")) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 3
+
+
+def test_lru_eviction():
+    """The least recently used entry is evicted when the cache is full."""
+    cache = EmbeddingCache(max_entries=2)
+    cache.put("a", "model", "query", [1.0])
+    cache.put("b", "model", "query", [2.0])
+    asyncio.run(cache.get("a", "model", "query"))
+    cache.put("c", "model", "query", [3.0])
+
+    assert asyncio.run(cache.get("b", "model", "query")) is None
+    assert asyncio.run(cache.get("a", "model", "query")) == [1.0]
+    assert asyncio.run(cache.get("c", "model", "query")) == [3.0]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_expiration():
+    """Entries older than the time-to-live are not returned."""
+    clock = FakeClock()
+    cache = EmbeddingCache(ttl_seconds=60, clock=clock)
+    cache.put("a", "model", "query", [1.0])
+
+    clock.now += 59
+    assert asyncio.run(cache.get("a", "model", "query")) == [1.0]
+
+    clock.now += 2
+    assert asyncio.run(cache.get("a", "model", "query")) is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    """Embeddings written to the on-disk tier are served by a new cache instance."""
+    disk_path = str(tmp_path / "embeddings.sqlite3")
+    cache = EmbeddingCache(disk_path=disk_path)
+    cache.put("a", "model", "query", [0.125, -1.5])
+    cache.close()
+
+    restarted = EmbeddingCache(disk_path=disk_path)
+    assert asyncio.run(restarted.get("a", "model", "query")) == pytest.approx([0.125, -1.5])
+    assert restarted.stats()["disk_hits"] == 1
+
+    # promoted to the memory tier
+    assert asyncio.run(restarted.get("a", "model", "query")) == pytest.approx([0.125, -1.5])
+    assert restarted.stats()["hits"] == 1
+    restarted.close()
+
+
+def test_disk_tier_is_written_behind_in_batches(tmp_path, monkeypatch):
+    """Puts inside the event loop are written together after the delay, lookups see them before."""
+    monkeypatch.setattr(embedding_cache, "WRITE_BEHIND_DELAY", 0.01)
+    disk_path = str(tmp_path / "embeddings.sqlite3")
+    cache = EmbeddingCache(max_entries=1, disk_path=disk_path)
+
+    async def run():
+        cache.put("a", "model", "query", [1.0])
+        cache.put("b", "model", "query", [2.0])
+        assert len(cache.pending) == 2
+        # "a" was evicted from the memory tier and is served from the pending writes
+        assert await cache.get("a", "model", "query") == [1.0]
+        await asyncio.sleep(0.1)
+        assert not cache.pending
+
+    asyncio.run(run())
+    restarted = EmbeddingCache(max_entries=1, disk_path=disk_path)
+    assert asyncio.run(restarted.get("b", "model", "query")) == [2.0]
+    assert restarted.stats()["disk_hits"] == 1
+    cache.close()
+    restarted.close()
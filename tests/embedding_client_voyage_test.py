@@ -0,0 +1,105 @@
+"""Unit tests of the batched query embeddings."""
+import os
+import asyncio
+from types import SimpleNamespace
+
+# the clients under test are constructed with fake keys, real ones set in the environment are kept
+for _name in ("EMBEDDER_API_KEY", "VECTOR_DB_API_KEY", "LLM_API_KEY"):
+    os.environ.setdefault(_name, "offline-test")
+
+import pytest
+
+import embedding_client_voyage
+from embedding_cache import EmbeddingCache
+from embedding_client_voyage import VoyageEmbedder, _split_batches
+
+
+class FakeVoyage:
+    """Stand-in of voyageai.AsyncClient recording the size of every request."""
+
+    def __init__(self) -> None:
+        self.requests: list[list[str]] = []
+
+    async def embed(self, texts, model, input_type):
+        self.requests.append(texts)
+        return SimpleNamespace(embeddings=[[float(len(text)), 1.0] for text in texts], total_tokens=len(texts))
+
+
+def test_split_batches_respects_count_and_token_limits(monkeypatch):
+    """A new batch is started when either request limit would be exceeded."""
+    monkeypatch.setattr(embedding_client_voyage, "MAX_BATCH_TEXTS", 3)
+    monkeypatch.setattr(embedding_client_voyage, "MAX_BATCH_TOKENS", 12)
+    assert _split_batches(["a"] * 7) == [["a"] * 3, ["a"] * 3, ["a"]]
+    # 15 characters are estimated as 6 tokens
+    assert _split_batches(["x" * 15, "y" * 15, "z" * 15]) == [["x" * 15, "y" * 15], ["z" * 15]]
+
+
+def test_embed_queries_skips_cached_and_duplicate_prompts():
+    """Only distinct uncached prompts are sent, results keep the order of the prompts."""
+    embedder = VoyageEmbedder()
+    embedder.client = FakeVoyage()
+    embedder.cache = EmbeddingCache()
+    embedder.cache.put("cached", embedder.model, "query", [9.0, 9.0])
+
+    embeddings = asyncio.run(embedder.embed_queries(["ab", "cached", "abc", "ab"]))
+
+    assert embedder.client.requests == [["ab", "abc"]]
+    assert embeddings == [[2.0, 1.0], [9.0, 9.0], [3.0, 1.0], [2.0, 1.0]]
+    asyncio.run(embedder.close())
+
+
+class SlowVoyage(FakeVoyage):
+    """FakeVoyage taking a while per request, recording the peak number of concurrent requests."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.running = 0
+        self.peak = 0
+
+    async def embed(self, texts, model, input_type):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        return await super().embed(texts, model, input_type)
+
+
+def test_concurrent_requests_share_one_pooled_session(monkeypatch):
+    """At most embed_concurrency requests run at once, all over one session closed with the client."""
+    monkeypatch.setattr(embedding_client_voyage.settings, "embed_concurrency", 2)
+    embedder = VoyageEmbedder()
+    embedder.client = SlowVoyage()
+    embedder.cache = EmbeddingCache()
+
+    async def embed_and_close():
+        await asyncio.gather(*(embedder.embed_query(f"prompt {number}") for number in range(6)))
+        session = embedder.session
+        await embedder.close()
+        return session
+
+    session = asyncio.run(embed_and_close())
+
+    assert len(embedder.client.requests) == 6
+    assert embedder.client.peak == 2
+    assert session.closed
+    assert embedder.session is None
+
+
+def test_closed_client_opens_no_new_session(monkeypatch):
+    """Calls still running after close() fail instead of opening a session nobody closes."""
+    monkeypatch.setattr(embedding_client_voyage, "_embedder_client", None)
+    embedder = embedding_client_voyage.get_embedder_client()
+    embedder.client = FakeVoyage()
+    embedder.cache = EmbeddingCache()
+
+    async def embed_after_close():
+        await embedder.embed_query("before")
+        await embedder.close()
+        await embedder.embed_query("after")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(embed_after_close())
+
+    assert embedder.session is None
+    # the next app lifespan of the process gets a new client
+    assert embedding_client_voyage.get_embedder_client() is not embedder
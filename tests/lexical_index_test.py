@@ -0,0 +1,81 @@
+"""Unit tests of the BM25 index and the hybrid fusion."""
+import asyncio
+
+import numpy as np
+
+from lexical_index import BM25Index, LexicalIndex, reciprocal_rank_fusion, tokenize
+from vector_store import QueryResults, VectorMatch
+from vectordb_local import LocalVectorStore
+
+
+def test_tokenize_keeps_compounds_and_their_parts():
+    """Exact technical tokens are searchable whole and by their parts."""
+    assert tokenize("What is VNet-peering for 10.0.0.0/16?") == [
+        "vnet-peering", "vnet", "peering", "10.0.0.0/16", "10", "0", "0", "0", "16"
+    ]
+
+
+def test_bm25_ranking():
+    """Exact rare terms are found, shorter documents win at equal term frequency."""
+    index = BM25Index([
+        "configure the gateway of the virtual network",
+        "a user defined route UDR overrides the system route",
+        "the virtual network gateway and the virtual network peering of the virtual network",
+    ])
+    assert [doc for doc, _ in index.search("UDR", top_k=2)] == [1]
+    assert [doc for doc, _ in index.search("gateway", top_k=2)] == [0, 2]
+    assert index.search("nothing matches", top_k=2) == []
+
+
+def test_reciprocal_rank_fusion():
+    """Ids ranked high in both rankings win."""
+    assert set(reciprocal_rank_fusion([["a", "b", "c"], ["c", "b", "d"]])[:2]) == {"b", "c"}
+
+
+def test_fuse_adds_lexical_matches_with_cosine_scores():
+    """A chunk only found lexically joins the results with its dense similarity as score."""
+    replica = LocalVectorStore.from_records({
+        "dense": {"values": [1.0, 0.0], "metadata": {"content": "virtual network overview"}, "namespace": "n"},
+        "udr": {"values": [0.6, 0.8], "metadata": {"content": "UDR route tables"}, "namespace": "n"},
+    })
+    lexical_index = LexicalIndex(replica)
+
+    async def build():
+        lexical_index.refresh()
+        await lexical_index.rebuild_task
+
+    asyncio.run(build())
+    dense = QueryResults(matches=[VectorMatch("dense", 1.0, {"content": "virtual network overview"}, "n")])
+
+    fused = lexical_index.fuse("how do UDR tables work", [1.0, 0.0], dense, top_k=2)
+
+    assert [match.id for match in fused.matches] == ["dense", "udr"]
+    assert np.isclose(fused.matches[1].score, 0.6)
+    assert lexical_index.fuse("UDR", [1.0, 0.0], dense, top_k=2, namespaces=["other"]).matches == []
+
+
+def test_fuse_searches_only_the_filtered_rows():
+    """Lexical matches passing the filter are found even when better matches of other rows fill top_k."""
+    records = {
+        f"other-{number}": {"values": [1.0, 0.0], "metadata": {"content": "UDR", "category": "a"}, "namespace": "n"}
+        for number in range(5)
+    }
+    records["wanted"] = {
+        "values": [0.6, 0.8], "metadata": {"content": "UDR with many other words", "category": "b"}, "namespace": "n",
+    }
+    lexical_index = LexicalIndex(LocalVectorStore.from_records(records))
+
+    async def build():
+        lexical_index.refresh()
+        await lexical_index.rebuild_task
+
+    asyncio.run(build())
+    dense = QueryResults(matches=[])
+
+    fused = lexical_index.fuse("UDR", [1.0, 0.0], dense, top_k=2, metadata_filter={"category": "b"})
+
+    assert [match.id for match in fused.matches] == ["wanted"]
+    # rows added to the replica after the build are not indexed
+    assert [vector_id for vector_id, _ in lexical_index.search("UDR", top_k=5, rows=np.array([1, 5, 9]))] == [
+        "other-1", "wanted",
+    ]
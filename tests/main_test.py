@@ -0,0 +1,221 @@
+"""Endpoint tests of the app served with the offline stand-ins of benchmarks/fakes.py."""
+import os
+import json
+import time
+import asyncio
+
+# the clients replaced by the fakes are still constructed by the imported modules, real keys are kept
+for _name in ("EMBEDDER_API_KEY", "VECTOR_DB_API_KEY", "LLM_API_KEY"):
+    os.environ.setdefault(_name, "offline-test")
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.requests import ClientDisconnect
+
+import main
+import admission
+import reranker
+import single_flight
+import answer_cache
+import lexical_index
+import vector_store
+import vectordb_local
+import llm_client_azure
+import embedding_client_voyage
+from admission import AdmissionController
+from benchmarks.fakes import FakeEmbedder, FakeLLM, FakeVectorStore, LatencyModel, build_corpus
+
+QUESTIONS = [
+    ("What is a virtual network?", "A virtual network isolates Azure resources."),
+    ("What is a network security group?", "A network security group filters network traffic."),
+]
+
+
+@pytest.fixture
+def fakes(monkeypatch):
+    """Install the fakes as the upstream clients and start every worker singleton afresh."""
+    corpus = build_corpus(QUESTIONS, size=200)
+    clients = {
+        "replica": corpus,
+        "vector_store": FakeVectorStore(corpus, LatencyModel()),
+        "embedder": FakeEmbedder(LatencyModel()),
+        "llm": FakeLLM(LatencyModel(), LatencyModel(), answer_tokens=3),
+    }
+    monkeypatch.setattr(vectordb_local, "_vector_replica", clients["replica"])
+    monkeypatch.setattr(vector_store, "_vector_store", clients["vector_store"])
+    monkeypatch.setattr(embedding_client_voyage, "_embedder_client", clients["embedder"])
+    monkeypatch.setattr(llm_client_azure, "_llm_client", clients["llm"])
+    for module, name in ((admission, "_admission_controller"), (answer_cache, "_answer_cache"),
+                         (single_flight, "_single_flight"), (lexical_index, "_lexical_index"),
+                         (reranker, "_reranker")):
+        monkeypatch.setattr(module, name, None)
+    return clients
+
+
+@pytest.fixture
+def client(fakes):
+    with TestClient(main.app) as test_client:
+        _wait_until_ready(test_client)
+        yield test_client
+
+
+def _wait_until_ready(test_client: TestClient, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while test_client.get("/ready").status_code != 200:
+        assert time.monotonic() < deadline, "the app did not become ready"
+        time.sleep(0.01)
+
+
+def _events(body: str) -> list[tuple[str, dict]]:
+    """(event, data) pairs of a Server-Sent Events body."""
+    events = []
+    for block in filter(None, body.split("\n\n")):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def _in_flight(test_client: TestClient) -> int:
+    return sum(lane["in_flight"] for lane in test_client.get("/cache_stats").json()["admission"].values())
+
+
+def test_ready_turns_healthy_once_warm(fakes):
+    """/ready answers 503 until the warmup is done and the vector store can serve queries."""
+    serving = {"ready": False}
+    fakes["vector_store"].is_ready = lambda: serving["ready"]
+
+    with TestClient(main.app) as test_client:
+        response = test_client.get("/ready")
+        assert response.status_code == 503
+        assert response.json()["ready"] is False
+        assert response.json()["vector_store"] is False
+
+        serving["ready"] = True
+        _wait_until_ready(test_client)
+        assert test_client.get("/ready").json() == {"ready": True, "warmup": True, "vector_store": True}
+
+
+def test_prompt_answer_and_partial_results(client, fakes):
+    """Namespaces missing from the vector search results are reported in X-Failed-Namespaces."""
+    response = client.post("/user_prompt", params={"prompt": QUESTIONS[0][0]}, json={})
+    assert response.status_code == 200
+    assert response.json() == "token0 token1 token2 "
+    assert int(response.headers["X-Prompt-Tokens"]) > 0
+    assert "X-Failed-Namespaces" not in response.headers
+
+    store = fakes["vector_store"]
+    query = store.query
+
+    async def partial_query(*args, **kwargs):
+        results = await query(*args, **kwargs)
+        results.failed_namespaces = ["ns2", "ns3"]
+        return results
+
+    store.query = partial_query
+    response = client.post("/user_prompt", params={"prompt": QUESTIONS[1][0]}, json={})
+    assert response.status_code == 200
+    assert response.headers["X-Failed-Namespaces"] == "ns2,ns3"
+
+
+def test_stream_events(client, fakes):
+    """Streams send the retrieval, then the tokens, then done or an in-band error, and free their slot."""
+    response = client.post("/user_prompt/stream", params={"prompt": QUESTIONS[0][0]}, json={})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = _events(response.text)
+    assert [event for event, _ in events] == ["retrieval", "token", "token", "token", "done"]
+    assert {match["id"] for match in events[0][1]["matches"]} <= {f"q0-{chunk}" for chunk in range(4)}
+    assert "".join(data["text"] for event, data in events if event == "token") == "token0 token1 token2 "
+
+    llm = fakes["llm"]
+
+    async def failing_stream(super_prompt, prompt_tokens=None):
+        yield "partial "
+        raise RuntimeError("deployment overloaded")
+
+    llm.stream_prompt = failing_stream
+    events = _events(client.post("/user_prompt/stream", params={"prompt": QUESTIONS[1][0]}, json={}).text)
+    assert [event for event, _ in events] == ["retrieval", "token", "error"]
+    assert events[-1][1] == {"detail": "deployment overloaded"}
+    assert _in_flight(client) == 0
+
+
+def test_batch_statuses_keep_the_prompt_order(client):
+    """Every prompt gets the status POST /user_prompt would return, in the order of the request."""
+    prompts = [QUESTIONS[1][0], "Completely unrelated gibberish zqxj", QUESTIONS[0][0]]
+    response = client.post("/user_prompt/batch", json={"prompts": prompts})
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [item["prompt"] for item in results] == prompts
+    assert [item["status"] for item in results] == [200, 409, 200]
+    assert results[0]["answer"] == "token0 token1 token2 "
+    assert results[1]["answer"] is None
+    assert _in_flight(client) == 0
+
+
+def test_indexes_are_revalidated_with_etags(client, fakes):
+    """/indexes answers 304 to a matching If-None-Match until the vectors change."""
+    response = client.get("/indexes")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert response.json()
+
+    revalidated = client.get("/indexes", headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+
+    fakes["replica"].add({"new": {"values": [1.0] * 1024, "metadata": {"source": "new"}, "namespace": "ns9"}})
+    changed = client.get("/indexes", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+
+
+def test_upstream_clients_are_shared_and_closed_on_shutdown(fakes):
+    """Requests reuse the singleton clients, the lifespan closes each of them once when the app stops."""
+    closed = []
+    for name in ("embedder", "llm", "vector_store"):
+        original = fakes[name].close
+
+        async def close(name=name, close=original):
+            closed.append(name)
+            await close()
+
+        fakes[name].close = close
+
+    with TestClient(main.app) as test_client:
+        _wait_until_ready(test_client)
+        for question, _ in QUESTIONS:
+            assert test_client.post("/user_prompt", params={"prompt": question}, json={}).status_code == 200
+        assert embedding_client_voyage.get_embedder_client() is fakes["embedder"]
+        assert llm_client_azure.get_llm_client() is fakes["llm"]
+        assert not closed
+
+    assert sorted(closed) == ["embedder", "llm", "vector_store"]
+
+
+def test_stream_slot_is_released_when_the_client_leaves_before_the_body():
+    """The admission slot of a stream does not depend on its body generator ever being started."""
+    controller = AdmissionController(max_in_flight=2, batch_max_in_flight=1, max_queue=4)
+    started = []
+
+    async def events():
+        started.append(True)
+        yield "event: token\n\n"
+
+    async def send(message):
+        raise OSError("Connection reset by peer")
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def respond():
+        await controller.acquire("interactive", max_wait=1.0)
+        response = main._AdmittedStreamingResponse(events(), controller, "interactive")
+        await response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send)
+
+    with pytest.raises(ClientDisconnect):
+        asyncio.run(respond())
+
+    assert not started
+    assert controller.stats()["interactive"]["in_flight"] == 0
@@ -0,0 +1,80 @@
+"""Unit tests of the metadata filters and of their evaluation by the local vector store."""
+import asyncio
+
+import numpy as np
+import pytest
+from pydantic import ValidationError
+
+from metadata_index import PostingIndex, filter_conditions, matches, pinecone_filter
+from request_models import PromptArgs
+from vector_snapshot import write_snapshot
+from vectordb_local import LocalVectorStore
+
+
+def test_posting_index_lookup():
+    """Rows of any of the values, list valued fields are posted under each item."""
+    index = PostingIndex.from_values(["a", None, ["a", "b"], "b", 1, True, "a"])
+
+    assert index.lookup(["a"]).tolist() == [0, 2, 6]
+    assert index.lookup(["b", "a"]).tolist() == [0, 2, 3, 6]
+    assert index.lookup([1]).tolist() == [4]
+    assert index.lookup([True]).tolist() == [5]
+    assert index.lookup(["missing"]).tolist() == []
+
+
+def test_conditions_pinecone_filter_and_matches():
+    conditions = filter_conditions({"ms.service": "monitor", "tags": ["x", "y"]}, sources=["s1"])
+
+    assert pinecone_filter(conditions) == {"$and": [
+        {"ms.service": {"$eq": "monitor"}}, {"tags": {"$in": ["x", "y"]}}, {"source": {"$eq": "s1"}},
+    ]}
+    assert pinecone_filter(filter_conditions(sources=["s1", "s2"])) == {"source": {"$in": ["s1", "s2"]}}
+    assert pinecone_filter(filter_conditions()) is None
+    assert matches({"ms.service": "monitor", "tags": ["z", "y"], "source": "s1"}, conditions)
+    assert not matches({"ms.service": "monitor", "tags": ["z"], "source": "s1"}, conditions)
+    assert not matches({"tags": ["x"], "source": "s1"}, conditions)
+
+
+def test_pinecone_filter_compares_booleans_with_eq():
+    """Pinecone rejects booleans in `$in`."""
+    assert pinecone_filter(filter_conditions({"is_preview": True})) == {"is_preview": {"$eq": True}}
+    assert pinecone_filter(filter_conditions({"is_preview": [True, False], "rank": [1, 2]})) == {"$and": [
+        {"$or": [{"is_preview": {"$eq": True}}, {"is_preview": {"$eq": False}}]}, {"rank": {"$in": [1, 2]}},
+    ]}
+
+
+def test_prompt_args_reject_operators():
+    assert PromptArgs(filter={"main_category": ["a", "b"]}).filter == {"main_category": ["a", "b"]}
+    with pytest.raises(ValidationError):
+        PromptArgs(filter={"$or": ["a"]})
+    with pytest.raises(ValidationError):
+        PromptArgs(filter={"main_category": []})
+
+
+@pytest.mark.parametrize("index", ["flat", "ivf"])
+def test_filtered_query_of_snapshot_and_delta_rows(tmp_path, index):
+    """Filtered queries return the nearest matching rows of the base snapshot and of the synced delta."""
+    rng = np.random.default_rng(0)
+    count = 2000
+    vectors = rng.normal(size=(count, 16)).astype(np.float32)
+    metadata = [{"main_category": f"c{i % 4}", "service": f"s{i % 50}", "content": str(i)} for i in range(count)]
+    write_snapshot(str(tmp_path), [f"id-{i}" for i in range(count)], vectors, metadata,
+                   [f"ns-{i % 2}" for i in range(count)])
+    store = LocalVectorStore.load(str(tmp_path), index=index)
+    asyncio.run(store.warmup())
+    store.add({"delta": {"values": vectors[0].tolist(), "metadata": {"main_category": "c1"}, "namespace": "ns-0"}})
+
+    results = asyncio.run(store.query(vectors[0].tolist(), top_k=5, metadata_filter={"main_category": "c1"}))
+    assert [match.id for match in results.matches][0] == "delta"
+    assert all(match.metadata["main_category"] == "c1" for match in results.matches)
+
+    # a selective filter is scanned exactly, whatever clusters the query probes
+    query = vectors[7] + vectors[57]
+    results = asyncio.run(store.query(query.tolist(), top_k=3, namespaces=["ns-1"],
+                                      metadata_filter={"service": ["s7", "s9"]}, nprobe=1))
+    routed = [i for i in range(count) if i % 50 in (7, 9) and i % 2 == 1]
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    exact = sorted(routed, key=lambda i: -float(normalized[i] @ query))[:3]
+    assert [match.id for match in results.matches] == [f"id-{i}" for i in exact]
+
+    assert store.route(metadata_filter={"service": "s7", "main_category": "c0"}).tolist() == []
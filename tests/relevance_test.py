@@ -0,0 +1,42 @@
+"""Unit tests of the adaptive context selection."""
+from request_models import PromptArgs
+from relevance import select_context
+from vector_store import VectorMatch
+
+
+def match(vector_id: str, score: float, source: str = "doc.md", header: str = "", content: str = "") -> VectorMatch:
+    return VectorMatch(
+        id=vector_id,
+        score=score,
+        metadata={"source": source, "header_0": header, "content": content or f"content of {vector_id}"},
+    )
+
+
+def selected_ids(matches, **args) -> list[str]:
+    return [selected.id for selected in select_context(matches, PromptArgs(**args))]
+
+
+def test_mss_threshold_drops_irrelevant_matches():
+    """Nothing is selected when no score is above the threshold."""
+    matches = [match("a", 0.45, header="a"), match("b", 0.6, header="b"), match("c", 0.55, header="c")]
+    assert selected_ids(matches, mss=0.5) == ["b", "c"]
+    assert selected_ids(matches, mss=0.7) == []
+
+
+def test_duplicates_and_section_cap():
+    """Identical contents are sent once and sections are capped."""
+    matches = [
+        match("a", 0.9, header="intro", content="same text"),
+        match("b", 0.89, header="other", content="same  text"),
+        match("c", 0.88, header="intro"),
+        match("d", 0.87, header="intro"),
+    ]
+    assert selected_ids(matches, mss=0.5) == ["a", "c"]
+    assert selected_ids(matches, mss=0.5, max_chunks_per_section=1) == ["a"]
+
+
+def test_score_gap():
+    """Selection stops at a large score drop."""
+    matches = [match("a", 0.9, header="a"), match("b", 0.85, header="b"), match("c", 0.6, header="c")]
+    assert selected_ids(matches, mss=0.5, max_score_gap=0.1) == ["a", "b"]
+
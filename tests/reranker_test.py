@@ -0,0 +1,100 @@
+"""Unit tests of the reranking stage."""
+import time
+import asyncio
+from types import SimpleNamespace
+
+import reranker
+from admission import TokenBucket
+from relevance import select_context
+from request_models import PromptArgs
+from reranker import LocalReranker, Reranker, VoyageReranker
+from vector_store import VectorMatch
+
+
+def match(vector_id: str, score: float, content: str) -> VectorMatch:
+    return VectorMatch(id=vector_id, score=score, metadata={"content": content, "source": vector_id})
+
+
+def test_local_reranker_promotes_term_overlap():
+    """A slightly less similar chunk containing the prompt terms is ranked first and top_n is applied."""
+    matches = [
+        match("generic", 0.82, "Azure networking overview"),
+        match("exact", 0.80, "Configure vnet peering between two virtual networks"),
+        match("other", 0.60, "Storage accounts"),
+    ]
+    reranked = asyncio.run(LocalReranker().rerank("How to configure vnet peering?", matches, top_n=2))
+
+    assert [m.id for m in reranked] == ["exact", "generic"]
+    assert all(m.rerank_score is not None for m in reranked)
+    # the context follows the rerank order while mss still applies to the similarity
+    assert [m.id for m in select_context(reranked, PromptArgs(mss=0.81, max_score_gap=1))] == ["generic"]
+    assert [m.id for m in select_context(reranked, PromptArgs(mss=0.5, max_score_gap=1))] == ["exact", "generic"]
+
+
+def test_slow_reranker_keeps_the_vector_order(monkeypatch):
+    """Exceeding the latency budget falls back to the candidates in their original order."""
+    monkeypatch.setattr(reranker.settings, "rerank_timeout", 0.01)
+
+    class SlowReranker(Reranker):
+        async def score(self, prompt, matches):
+            await asyncio.sleep(1)
+            return [1.0] * len(matches)
+
+    matches = [match("a", 0.9, "a"), match("b", 0.8, "b"), match("c", 0.7, "c")]
+    reranked = asyncio.run(SlowReranker().rerank("q", matches, top_n=2))
+
+    assert [m.id for m in reranked] == ["a", "b"]
+    assert all(m.rerank_score is None for m in reranked)
+
+
+def test_cpu_bound_local_reranker_keeps_the_latency_budget(monkeypatch):
+    """Scoring that blocks for longer than the budget neither delays the answer nor the event loop."""
+    monkeypatch.setattr(reranker.settings, "rerank_timeout", 0.05)
+
+    class BlockingReranker(LocalReranker):
+        def _score(self, prompt, matches):
+            time.sleep(0.5)
+            return super()._score(prompt, matches)
+
+    async def run():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.create_task(tick())
+        started = time.perf_counter()
+        reranked = await BlockingReranker().rerank("q", matches, top_n=2)
+        elapsed = time.perf_counter() - started
+        ticker.cancel()
+        return reranked, elapsed, ticks
+
+    matches = [match("a", 0.7, "a"), match("b", 0.9, "q b"), match("c", 0.8, "c")]
+    reranked, elapsed, ticks = asyncio.run(run())
+
+    assert [m.id for m in reranked] == ["a", "b"]
+    assert elapsed < 0.3
+    assert ticks >= 2
+
+
+def test_voyage_reranker_scores_in_one_batch(monkeypatch):
+    """All candidates go to a single rerank call, scores are mapped back by index."""
+    calls = []
+
+    async def rerank(query, documents, model, truncation):
+        calls.append(documents)
+        results = [SimpleNamespace(index=1, relevance_score=0.9), SimpleNamespace(index=0, relevance_score=0.2)]
+        return SimpleNamespace(results=results, total_tokens=10)
+
+    embedder = SimpleNamespace(
+        client=SimpleNamespace(rerank=rerank), semaphore=asyncio.Semaphore(1), _get_session=lambda: None,
+        rate_limiter=TokenBucket("Voyage", rate=0),
+    )
+    matches = [match("a", 0.9, "first"), match("b", 0.8, "second")]
+    reranked = asyncio.run(VoyageReranker(embedder).rerank("q", matches, top_n=2))
+
+    assert calls == [["first", "second"]]
+    assert [(m.id, m.rerank_score) for m in reranked] == [("b", 0.9), ("a", 0.2)]
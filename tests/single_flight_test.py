@@ -0,0 +1,85 @@
+"""Unit tests of the request coalescing layer."""
+import asyncio
+
+import pytest
+
+from request_models import PromptArgs
+from single_flight import SingleFlight, request_key
+
+
+def test_request_key_normalizes_the_prompt():
+    """Trivially different spellings coalesce, different arguments do not."""
+    assert request_key("What is  a VNet?", PromptArgs()) == request_key("what is a vnet?", PromptArgs())
+    assert request_key("What is a VNet?", PromptArgs()) != request_key("What is a VNet?", PromptArgs(top_k=9))
+
+
+def test_concurrent_calls_share_one_execution():
+    """Callers of the same key get the result of a single execution, failures are shared too."""
+    single_flight = SingleFlight()
+    calls = []
+
+    async def work(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        if value == "boom":
+            raise ValueError(value)
+        return value
+
+    async def main():
+        results = await asyncio.gather(*(single_flight.do("k", lambda: work("v")) for _ in range(5)))
+        assert results == ["v"] * 5
+        failures = await asyncio.gather(
+            *(single_flight.do("f", lambda: work("boom")) for _ in range(3)), return_exceptions=True
+        )
+        assert all(isinstance(failure, ValueError) for failure in failures)
+        # the key is released once the execution finished
+        assert await single_flight.do("k", lambda: work("again")) == "again"
+
+    asyncio.run(main())
+    assert calls == ["v", "boom", "again"]
+    assert single_flight.stats()["coalesced"] == 6
+    assert single_flight.stats()["in_flight"] == 0
+
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    """The shared execution survives the caller that started it."""
+    single_flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.02)
+        return 42
+
+    async def main():
+        leader = asyncio.ensure_future(single_flight.do("k", work))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(single_flight.do("k", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        assert await follower == 42
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+
+    asyncio.run(main())
+
+
+def test_streams_are_replayed_to_late_subscribers():
+    """Subscribers joining mid-stream receive every item from the first one."""
+    single_flight = SingleFlight()
+    started = []
+
+    async def tokens():
+        started.append(True)
+        for token in ["a", "b", "c"]:
+            await asyncio.sleep(0.01)
+            yield token
+
+    async def collect(delay):
+        await asyncio.sleep(delay)
+        return [token async for token in single_flight.stream("k", tokens)]
+
+    async def main():
+        return await asyncio.gather(collect(0), collect(0.015), collect(0.025))
+
+    assert asyncio.run(main()) == [["a", "b", "c"]] * 3
+    assert started == [True]
+    assert single_flight.stats()["coalesced"] == 2
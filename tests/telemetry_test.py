@@ -0,0 +1,71 @@
+"""Unit tests of the latency spans and the Prometheus metrics."""
+import io
+import asyncio
+import logging
+
+import telemetry
+from telemetry import Registry, configure_logging, server_timing, span, start_request, stop_logging, STAGE_SECONDS
+
+
+def test_histogram_renders_cumulative_buckets():
+    """Buckets are cumulative and end with +Inf, sum and count follow them."""
+    registry = Registry()
+    histogram = registry.histogram("latency_seconds", "Latency.", ("stage",))
+    counter = registry.counter("tokens_total", "Tokens.", ("kind",))
+    for value in (0.003, 0.02, 0.02, 100.0):
+        histogram.observe(value, stage="embed")
+    counter.inc(12, kind="prompt")
+
+    lines = registry.render().splitlines()
+
+    assert "# TYPE latency_seconds histogram" in lines
+    assert 'latency_seconds_bucket{stage="embed",le="0.005"} 1' in lines
+    assert 'latency_seconds_bucket{stage="embed",le="0.025"} 3' in lines
+    assert 'latency_seconds_bucket{stage="embed",le="60"} 3' in lines
+    assert 'latency_seconds_bucket{stage="embed",le="+Inf"} 4' in lines
+    assert 'latency_seconds_count{stage="embed"} 4' in lines
+    assert 'tokens_total{kind="prompt"} 12' in lines
+
+
+def test_spans_of_a_request_and_its_tasks_are_collected():
+    """Stage durations of tasks started by the request add up in its timings."""
+    count_before = STAGE_SECONDS.count(stage="test_stage")
+
+    async def stage():
+        with span("test_stage"):
+            await asyncio.sleep(0.01)
+
+    async def request():
+        timings = start_request()
+        await asyncio.gather(stage(), stage())
+        return timings
+
+    timings = asyncio.run(request())
+
+    assert list(timings) == ["test_stage"] and timings["test_stage"] >= 0.02
+    assert STAGE_SECONDS.count(stage="test_stage") == count_before + 2
+    assert server_timing({"embed": 0.0123, "total": 0.5}) == "embed;dur=12.3, total;dur=500.0"
+
+
+def test_stopped_logging_writes_out_the_queue_and_then_logs_synchronously():
+    """Records queued before stop_logging() are written, later ones are written right away."""
+    configure_logging()
+    queue_handler, handler = telemetry._log_handlers
+    output = io.StringIO()
+    stream = handler.setStream(output)
+    logger = logging.getLogger("telemetry_test")
+    try:
+        logger.warning("queued record")
+        stop_logging()
+        assert "queued record" in output.getvalue()
+        assert telemetry._log_listener is None
+
+        logger.warning("synchronous record")
+        assert "synchronous record" in output.getvalue()
+        assert queue_handler not in logging.getLogger().handlers
+    finally:
+        configure_logging()
+        handler.setStream(stream)
+
+    root_handlers = logging.getLogger().handlers
+    assert queue_handler in root_handlers and handler not in root_handlers
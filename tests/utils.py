@@ -1,6 +1,10 @@
 """Test helper methods."""
+import os
+import random
+import asyncio
+import hashlib
 from pathlib import Path
-from typing import TypedDict
+from typing import Any, Awaitable, Callable, TypedDict
 
 import yaml
 from rich.console import Console
@@ -8,6 +12,8 @@ from rich.panel import Panel
 from rich.table import Table
 
 
+results_dir = Path(__file__).parent / "azure-docs" / "results"
+
 TestCase = TypedDict(
     "TestCase",
     {
@@ -15,11 +21,60 @@ TestCase = TypedDict(
         "reference_answer": str,
         "llm_answer": None | str,
         "eval_explanation": str | None,
-        "rating": int | float
+        "rating": int | float,
+        "latency_seconds": float | None,
     }
 )
 
 
+class RetryLater(Exception):
+    """The service is rate limiting or busy, the call may be retried after `seconds`."""
+
+    def __init__(self, seconds: float = 0.0) -> None:
+        super().__init__(f"retry after {seconds}s")
+        self.seconds = seconds
+
+
+async def with_retries(call: Callable[[], Awaitable[Any]], attempts: int = 6, backoff_base: float = 1.0) -> Any:
+    """Await call(), retrying RetryLater failures after the requested delay or a jittered exponential backoff."""
+    for attempt in range(attempts):
+        try:
+            return await call()
+        except RetryLater as err:
+            if attempt == attempts - 1:
+                raise
+            delay = max(err.seconds, backoff_base * 2 ** attempt * random.uniform(0.5, 1.0))
+            await asyncio.sleep(delay)
+
+
+class GradeCache:
+    """Evaluations of earlier runs, so unchanged answers are not graded again.
+
+    Grades are keyed by the question, the reference answer and the graded answer.
+    """
+
+    def __init__(self, file_path: Path) -> None:
+        self.file_path = file_path
+        self.grades: dict[str, dict] = {}
+        if file_path.exists():
+            with open(file_path, "r", encoding="UTF-8") as file:
+                self.grades = yaml.safe_load(file) or {}
+
+    @staticmethod
+    def key(test_case: TestCase) -> str:
+        text = "\x00".join((test_case["question"], test_case["reference_answer"], test_case["llm_answer"] or ""))
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def get(self, test_case: TestCase) -> dict | None:
+        return self.grades.get(self.key(test_case))
+
+    def put(self, test_case: TestCase, grade: dict) -> None:
+        """Remember a grade with a rating, failed evaluations are graded again next time."""
+        if "rating" in grade:
+            self.grades[self.key(test_case)] = grade
+            save_test_results(self.file_path, self.grades)
+
+
 def load_test_suit(yaml_file: Path) -> list[TestCase]:
     """Gather Q&A data"""
     with open(yaml_file, "r", encoding="UTF-8") as file:
@@ -31,7 +86,8 @@ def load_test_suit(yaml_file: Path) -> list[TestCase]:
             "reference_answer": item["answer"].rstrip(),
             "llm_answer": None,
             "eval_explanation": "",
-            "rating": -1
+            "rating": -1,
+            "latency_seconds": None,
         }
         for item in data["questions"]
     ]
@@ -45,6 +101,7 @@ def display_table(test_suit: list[TestCase]):
     table.add_column("Reference Answer", style="green", justify="full")
     table.add_column("LLM Answer", style="yellow", justify="full")
     table.add_column("Rating", style="green", justify="center", highlight=True)
+    table.add_column("Latency", style="green", justify="center")
     table.add_column("Evaluation", style="green", justify="full")
 
     for tc in test_suit:
@@ -53,6 +110,7 @@ def display_table(test_suit: list[TestCase]):
             tc["reference_answer"],
             tc["llm_answer"],
             str(tc["rating"]),
+            f"{tc['latency_seconds']:.2f}s" if tc["latency_seconds"] is not None else "-",
             tc["eval_explanation"]
         )
 
@@ -77,11 +135,14 @@ def calculate_and_display_test_score(test_suit: list[TestCase]) -> float:
 
 
 def save_test_results(file_path: Path, results: dict) -> None:
-    """Save the test results to a file."""
-    with open(file_path, "w", encoding="utf-8") as out_file:
+    """Save the test results to a file, readers never see a partially written file."""
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = file_path.with_name(file_path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as out_file:
         yaml.dump(
             results,
             out_file,
             default_flow_style=False,
             sort_keys=False
         )
+    os.replace(tmp_path, file_path)
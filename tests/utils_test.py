@@ -0,0 +1,49 @@
+"""Unit tests of the e2e test helpers."""
+import asyncio
+
+import pytest
+
+import tests.utils
+from tests.utils import GradeCache, RetryLater, load_test_suit, with_retries
+
+
+def test_with_retries_waits_for_the_requested_delay(monkeypatch):
+    """Rate limited calls are retried after at least their Retry-After, other failures are not retried."""
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(tests.utils.asyncio, "sleep", sleep)
+    outcomes = [RetryLater(5.0), RetryLater(0.0), "ok"]
+
+    async def call():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert asyncio.run(with_retries(call, backoff_base=1.0)) == "ok"
+    assert delays[0] == 5.0 and 1.0 <= delays[1] <= 2.0
+
+    async def broken():
+        raise ValueError("not retried")
+
+    with pytest.raises(ValueError):
+        asyncio.run(with_retries(broken))
+    assert len(delays) == 2
+
+
+def test_grade_cache_survives_runs_and_tracks_the_answer(tmp_path):
+    """Grades are reused for the same answer only, and only when the evaluation found a rating."""
+    test_case = load_test_suit(tests.utils.Path(__file__).parent / "azure-docs" / "az-networking-2.yaml")[0]
+    test_case["llm_answer"] = "Yes."
+    cache = GradeCache(tmp_path / "grades.yaml")
+    cache.put(test_case, {"rating": 9.0, "eval_explanation": "rating=[9]"})
+    cache.put({**test_case, "llm_answer": "Maybe."}, {"eval_explanation": "no rating"})
+
+    reloaded = GradeCache(tmp_path / "grades.yaml")
+
+    assert reloaded.get(test_case) == {"rating": 9.0, "eval_explanation": "rating=[9]"}
+    assert reloaded.get({**test_case, "llm_answer": "No."}) is None
+    assert reloaded.get({**test_case, "llm_answer": "Maybe."}) is None
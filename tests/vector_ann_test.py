@@ -0,0 +1,74 @@
+"""Unit tests of the IVF index of the local vector store."""
+import os
+import asyncio
+
+import numpy as np
+
+from vector_ann import FILES, IVFIndex
+from vector_snapshot import write_snapshot
+from vectordb_local import LocalVectorStore
+
+
+def clustered_rows(count: int = 2000, dim: int = 32, clusters: int = 20, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    vectors = (centers[rng.integers(0, clusters, count)] + rng.normal(size=(count, dim)) * 0.5).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_probe_finds_the_nearest_neighbours():
+    """Every row is in exactly one list, probing the nearest lists finds the exact neighbours."""
+    vectors = clustered_rows()
+    index = IVFIndex.train(vectors, lists=40)
+
+    assert sorted(index.rows.tolist()) == list(range(len(vectors)))
+    assert index.offsets[-1] == len(vectors)
+    assert len(index.probe(vectors[0], nprobe=40)) == len(vectors)
+    for row in (0, 1, 2):
+        candidates = index.probe(vectors[row], nprobe=4)
+        exact = set(np.argsort(-(vectors @ vectors[row]))[:5])
+        assert len(candidates) < len(vectors) // 2
+        assert exact <= set(candidates.tolist())
+
+
+def test_store_saves_the_index_and_searches_added_rows(tmp_path):
+    """The first warmup saves the index with the snapshot, later ones map it, synced rows are searchable."""
+    vectors = clustered_rows()
+    write_snapshot(str(tmp_path), [f"id-{i}" for i in range(len(vectors))], vectors,
+                   [{"content": str(i)} for i in range(len(vectors))], [f"ns-{i % 2}" for i in range(len(vectors))])
+    store = LocalVectorStore.load(str(tmp_path), index="ivf")
+    asyncio.run(store.warmup())
+    assert all(os.path.exists(os.path.join(store.snapshot.path, name)) for name in FILES)
+
+    reloaded = LocalVectorStore.load(str(tmp_path), index="ivf")
+    asyncio.run(reloaded.warmup())
+    assert np.array_equal(reloaded.ann.rows, store.ann.rows)
+
+    reloaded.add({"new": {"values": vectors[5], "namespace": "ns-0"}})
+    reloaded.remove("id-5")
+    results = asyncio.run(reloaded.query(vectors[5].tolist(), top_k=3, nprobe=2))
+    exact = asyncio.run(LocalVectorStore.load(str(tmp_path)).query(vectors[5].tolist(), top_k=3))
+    assert [match.id for match in results.matches] == ["new"] + [match.id for match in exact.matches][1:]
+
+    routed = asyncio.run(reloaded.query(vectors[5].tolist(), top_k=50, namespaces=["ns-1"]))
+    assert routed.matches and all(match.namespace == "ns-1" for match in routed.matches)
+
+
+def test_sparse_probe_still_returns_top_k():
+    """Probed lists holding fewer than top_k live rows widen the probe or fall back to the exact scan."""
+    vectors = clustered_rows(count=200)
+    index = IVFIndex.train(vectors, lists=100)
+    assert len(index.probe(vectors[0], nprobe=1, min_rows=30)) >= 30
+
+    store = LocalVectorStore.from_records(
+        {f"id-{i}": {"values": vectors[i], "namespace": "ns"} for i in range(len(vectors))}, index="ivf"
+    )
+    store.ann = index
+    results = asyncio.run(store.query(vectors[0].tolist(), top_k=30, nprobe=1))
+    assert len(results.matches) == 30
+
+    # every probed row is tombstoned
+    for row in index.probe(vectors[0], nprobe=1, min_rows=30):
+        store.remove(f"id-{row}")
+    results = asyncio.run(store.query(vectors[0].tolist(), top_k=30, nprobe=1))
+    assert len(results.matches) == 30
@@ -0,0 +1,60 @@
+"""Unit tests of the quantized codes and the two-phase local vector search."""
+import asyncio
+
+import numpy as np
+
+from vectordb_local import LocalVectorStore
+from vector_quantization import BinaryQuantizer, Int8Quantizer, get_quantizer
+
+
+def unit_rows(count: int, dim: int, seed: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_int8_scores_approximate_the_dot_product():
+    vectors = unit_rows(200, 64)
+    quantizer = Int8Quantizer().fit(vectors)
+    codes = quantizer.encode_blocks(vectors)
+
+    assert codes.dtype == np.int8 and codes.nbytes == vectors.nbytes // 4
+    assert np.allclose(quantizer.scores(codes, vectors[0]), vectors @ vectors[0], atol=0.02)
+
+
+def test_binary_scores_count_equal_signs():
+    vectors = unit_rows(20, 64)
+    quantizer = BinaryQuantizer()
+    codes = quantizer.encode(vectors)
+
+    equal_signs = ((vectors > 0) == (vectors[3] > 0)).sum(axis=1)
+    assert codes.shape == (20, 8)
+    assert np.array_equal(quantizer.scores(codes, vectors[3]), 2 * equal_signs - 64)
+    assert get_quantizer("none") is None
+
+
+def test_quantized_store_returns_the_exact_top_k():
+    """The shortlist rescoring finds the exact neighbours and scores, also of added and routed rows."""
+    vectors = unit_rows(500, 128)
+    # a few close neighbours of the query among random vectors, like the chunks of a topic
+    vectors[:4] = vectors[0] + unit_rows(4, 128, seed=1) * 0.5
+    records = {f"id-{i}": {"values": vectors[i], "namespace": f"ns-{i % 2}"} for i in range(500)}
+    query = (vectors[0] + unit_rows(1, 128, seed=2)[0] * 0.3).tolist()
+
+    for quantization in ("none", "int8", "binary"):
+        store = LocalVectorStore.from_records(records, quantization)
+        asyncio.run(store.warmup())
+        store.add({"new": {"values": vectors[0], "namespace": "ns-0"}})
+        store.remove("id-1")
+        results = asyncio.run(store.query(query, top_k=4, namespaces=["ns-1", "ns-0"]))
+        if quantization == "none":
+            exact = results
+            continue
+
+        assert [match.id for match in results.matches] == [match.id for match in exact.matches]
+        ids = [match.id for match in results.matches]
+        assert "new" in ids and "id-1" not in ids
+        assert np.allclose([match.score for match in results.matches], [match.score for match in exact.matches])
+        # one byte (int8) or bit (binary) per dimension of the 500 base rows and the added row
+        assert store.codes_nbytes() == 501 * (128 if quantization == "int8" else 16)
+        routed = asyncio.run(store.query(query, top_k=5, namespaces=["ns-1"]))
+        assert all(match.namespace == "ns-1" for match in routed.matches)
@@ -0,0 +1,103 @@
+"""Unit tests of the memory-mapped vector snapshot."""
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from vector_snapshot import VectorSnapshot, SnapshotError, write_snapshot, HEADER
+from vectordb_local import LocalVectorStore
+
+
+def write_sample(root: str, count: int = 20) -> np.ndarray:
+    """Write a snapshot with a low and a high cardinality metadata field."""
+    vectors = np.random.default_rng(0).normal(size=(count, 4)).astype(np.float32)
+    write_snapshot(
+        root,
+        [f"id-{i:03d}" for i in range(count)][::-1],
+        vectors,
+        [
+            {"source": f"doc-{i % 2}.md", "content": f"chunk {i}"} if i else {"content": "no source"}
+            for i in range(count)
+        ],
+        [f"ns-{i % 3}" for i in range(count)],
+        corpus_version="v1",
+    )
+    return vectors
+
+
+def test_round_trip(tmp_path):
+    """Vectors, ids, metadata and namespaces are read back from the active generation."""
+    vectors = write_sample(str(tmp_path))
+    snapshot = VectorSnapshot.open_current(str(tmp_path))
+
+    assert isinstance(snapshot.vectors, np.memmap)
+    assert (snapshot.count, snapshot.dim, snapshot.corpus_version) == (20, 4, "v1")
+    assert np.allclose(snapshot.vectors, vectors / np.linalg.norm(vectors, axis=1, keepdims=True))
+    assert snapshot.ids[0] == "id-019"
+    assert snapshot.metadata[0] == {"content": "no source"}
+    assert snapshot.metadata[3] == {"source": "doc-1.md", "content": "chunk 3"}
+    assert snapshot.namespaces[4] == "ns-1"
+    assert snapshot.metadata.column("source")[2] == "doc-0.md"
+    assert [column["encoding"] for column in snapshot.manifest["columns"]] == ["json", "dictionary"]
+
+
+def test_row_of(tmp_path):
+    """Vector ids are resolved to rows by binary search."""
+    write_sample(str(tmp_path))
+    snapshot = VectorSnapshot.open_current(str(tmp_path))
+
+    assert snapshot.row_of("id-019") == 0
+    assert snapshot.row_of("id-000") == 19
+    assert snapshot.row_of("missing") is None
+
+
+def test_new_generation_becomes_current(tmp_path):
+    """Writing again activates a new generation and prunes the oldest ones."""
+    for _ in range(3):
+        write_sample(str(tmp_path))
+    snapshot = VectorSnapshot.open_current(str(tmp_path))
+
+    assert snapshot.generation == 3
+    assert sorted(name for name in os.listdir(tmp_path) if name.isdigit()) == ["00000002", "00000003"]
+
+
+def test_concurrent_writers_take_turns(tmp_path):
+    """Writers of the same root never pick the same generation or remove each other's files."""
+    vectors = np.random.default_rng(0).normal(size=(200, 4)).astype(np.float32)
+
+    def write(_):
+        return write_snapshot(str(tmp_path), [f"id-{i}" for i in range(200)], vectors, [{}] * 200, ["ns"] * 200)
+
+    with ThreadPoolExecutor(4) as pool:
+        snapshots = list(pool.map(write, range(8)))
+
+    assert sorted(snapshot.generation for snapshot in snapshots) == list(range(1, 9))
+    assert VectorSnapshot.open_current(str(tmp_path)).generation == 8
+
+
+def test_truncated_vector_file_is_rejected(tmp_path):
+    """Integrity checks of the header catch truncated files."""
+    write_sample(str(tmp_path))
+    snapshot = VectorSnapshot.open_current(str(tmp_path))
+    vectors_path = os.path.join(snapshot.path, "vectors.f32")
+    del snapshot
+    with open(vectors_path, "r+b") as file:
+        file.truncate(HEADER.size + 10)
+
+    with pytest.raises(SnapshotError):
+        VectorSnapshot.open_current(str(tmp_path))
+
+
+def test_local_store_serves_snapshot(tmp_path):
+    """The local backend queries the mapped vectors without copying them."""
+    vectors = write_sample(str(tmp_path))
+    store = LocalVectorStore.load(str(tmp_path))
+
+    assert isinstance(store.vectors, np.memmap)
+    assert store.return_sources() == [("Unknown Source", 1), ("doc-0.md", 9), ("doc-1.md", 10)]
+
+    best = asyncio.run(store.query(vectors[5].tolist(), top_k=1)).matches[0]
+    assert best.id == "id-014"
+    assert best.metadata["content"] == "chunk 5"
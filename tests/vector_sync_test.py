@@ -0,0 +1,156 @@
+"""Unit tests of the incremental sync of the local vector replica."""
+import os
+import asyncio
+
+# the clients under test are constructed with fake keys, real ones set in the environment are kept
+for _name in ("EMBEDDER_API_KEY", "VECTOR_DB_API_KEY", "LLM_API_KEY"):
+    os.environ.setdefault(_name, "offline-test")
+
+import numpy as np
+import pytest
+
+from vector_snapshot import VectorSnapshot
+from vector_sync import VectorSync
+from vectordb_local import LocalVectorStore
+
+
+class FakePinecone:
+    """In-memory stand-in of PineConeClient charging one read unit per list and fetch call."""
+
+    def __init__(self, index: dict[str, dict[str, list[float]]]) -> None:
+        self.index = index
+        self.max_batch_size = 2
+        self.read_units_used = 0
+        self.fetched: list[str] = []
+
+    @property
+    def namespaces(self) -> list[str]:
+        return list(self.index)
+
+    async def refresh_index_stats(self) -> None:
+        pass
+
+    async def list_ids(self, namespace: str) -> list[str]:
+        self.read_units_used += 1
+        return list(self.index[namespace])
+
+    async def fetch_vectors(self, ids: list[str], namespace: str) -> dict[str, dict]:
+        self.read_units_used += 1
+        self.fetched.extend(ids)
+        return {
+            vid: {"values": self.index[namespace][vid], "metadata": {"source": vid}, "namespace": namespace}
+            for vid in ids
+        }
+
+
+def vector(seed: int) -> list[float]:
+    return np.random.default_rng(seed).normal(size=4).tolist()
+
+
+def test_sync_transfers_only_changes(tmp_path):
+    """Only new ids are fetched, deleted ids are tombstoned and the result is compacted into a snapshot."""
+    pinecone = FakePinecone({"a": {f"a{i}": vector(i) for i in range(5)}, "b": {"b0": vector(10)}})
+    replica = LocalVectorStore.empty()
+    sync = VectorSync(pinecone, replica, str(tmp_path), compact_ratio=0.5)
+
+    report = asyncio.run(sync.sync_once())
+    assert (report.added, report.removed, report.compacted) == (6, 0, True)
+    assert replica.namespace_ids() == {"a": {f"a{i}" for i in range(5)}, "b": {"b0"}}
+    assert VectorSnapshot.open_current(str(tmp_path)).count == 6
+
+    pinecone.fetched.clear()
+    del pinecone.index["a"]["a1"]
+    pinecone.index["a"]["a9"] = vector(9)
+    del pinecone.index["b"]
+
+    report = asyncio.run(sync.sync_once())
+    assert pinecone.fetched == ["a9"]
+    assert (report.added, report.removed) == (1, 2)
+    assert replica.namespace_ids() == {"a": {"a0", "a2", "a3", "a4", "a9"}}
+    assert replica.corpus_version == "a:5"
+
+    results = asyncio.run(replica.query(vector(9), top_k=1))
+    assert results.matches[0].id == "a9"
+    assert sync.status()["read_units_used"] == pinecone.read_units_used
+
+
+def test_sync_without_changes_reads_no_vectors(tmp_path):
+    """A run without changes only lists the ids and does not write a new snapshot."""
+    pinecone = FakePinecone({"a": {"a0": vector(0), "a1": vector(1)}})
+    sync = VectorSync(pinecone, LocalVectorStore.empty(), str(tmp_path))
+    asyncio.run(sync.sync_once())
+    pinecone.fetched.clear()
+
+    report = asyncio.run(sync.sync_once())
+    assert pinecone.fetched == []
+    assert (report.added, report.removed, report.compacted, report.read_units) == (0, 0, False, 1)
+
+
+def test_replica_add_replaces_and_remove_tombstones():
+    """Re-adding an id replaces its vector, removed ids are never returned."""
+    replica = LocalVectorStore.from_records({
+        "x": {"values": [1.0, 0.0], "namespace": "n"},
+        "y": {"values": [0.0, 1.0], "namespace": "n"},
+    })
+    replica.add({"x": {"values": [-1.0, 0.0], "namespace": "n"}})
+    assert len(replica) == 2
+    results = asyncio.run(replica.query([-1.0, 0.0], top_k=1))
+    assert results.matches[0].id == "x" and results.matches[0].score > 0.99
+
+    assert replica.remove("y") and not replica.remove("y")
+    results = asyncio.run(replica.query([0.0, 1.0], top_k=5))
+    assert [match.id for match in results.matches] == ["x"]
+
+
+def test_one_process_syncs_and_the_others_reload(tmp_path):
+    """The sync lock elects one syncing process, the others serve the generations it writes."""
+    pinecone = FakePinecone({"a": {f"a{i}": vector(i) for i in range(3)}})
+    leader = VectorSync(pinecone, LocalVectorStore.empty(), str(tmp_path))
+    follower = VectorSync(pinecone, LocalVectorStore.empty(), str(tmp_path))
+    assert leader.lead() and not follower.lead()
+
+    asyncio.run(leader.sync_once())
+    assert asyncio.run(follower.replica.reload(str(tmp_path)))
+    assert not asyncio.run(follower.replica.reload(str(tmp_path)))
+    assert follower.replica.namespace_ids() == {"a": {"a0", "a1", "a2"}}
+    assert (leader.status()["role"], follower.status()["role"]) == ("leader", "follower")
+
+    # the lock is released when the syncing process exits
+    leader.leader_lock.close()
+    assert follower.lead()
+    follower.leader_lock.close()
+
+
+def test_replica_appends_into_spare_capacity():
+    """Appends grow the delta buffers geometrically instead of copying them on every batch."""
+    replica = LocalVectorStore.empty()
+    buffers = set()
+    for batch in range(50):
+        replica.add({f"v{batch}-{i}": {"values": vector(batch * 10 + i), "namespace": "n"} for i in range(10)})
+        buffers.add(id(replica._delta_buffer))
+    asyncio.run(replica.add_in_thread({"last": {"values": vector(999), "namespace": "n"}}))
+
+    assert len(replica) == 501 and len(buffers) <= 5
+    assert replica.remove("v7-3") and replica.deleted.sum() == 1
+    results = asyncio.run(replica.query(vector(999), top_k=1))
+    assert results.matches[0].id == "last"
+
+
+def test_failed_lock_attempts_close_the_lock_file(tmp_path, monkeypatch):
+    """Errors other than a held lock are raised without leaking the descriptor."""
+    opened = []
+    real_open = open
+
+    def tracking_open(*args, **kwargs):
+        opened.append(real_open(*args, **kwargs))
+        return opened[-1]
+
+    def failing_flock(file, operation):
+        raise OSError("flock not supported")
+
+    monkeypatch.setattr("builtins.open", tracking_open)
+    monkeypatch.setattr("vector_sync.fcntl.flock", failing_flock)
+    sync = VectorSync(FakePinecone({}), LocalVectorStore.empty(), str(tmp_path))
+    with pytest.raises(OSError):
+        sync.lead()
+    assert opened and all(file.closed for file in opened) and sync.leader_lock is None
@@ -0,0 +1,105 @@
+"""Unit tests of the Pinecone client."""
+import os
+import asyncio
+from types import SimpleNamespace
+
+# the clients under test are constructed with fake keys, real ones set in the environment are kept
+for _name in ("EMBEDDER_API_KEY", "VECTOR_DB_API_KEY", "LLM_API_KEY"):
+    os.environ.setdefault(_name, "offline-test")
+
+import pytest
+
+import vectordb_client
+from vector_store import VectorStoreNotReady
+from vectordb_client import PineConeClient
+
+
+def test_query_before_stats_are_loaded_is_rejected():
+    """Queries fail with VectorStoreNotReady instead of exiting the worker."""
+    client = PineConeClient()
+    assert not client.is_ready()
+    with pytest.raises(VectorStoreNotReady):
+        asyncio.run(client.query([0.1, 0.2]))
+
+
+def test_stats_refresh_retries_with_backoff(monkeypatch):
+    """Failed refreshes are retried with growing delays until one succeeds."""
+    client = PineConeClient()
+    outcomes = [ConnectionError("down"), ConnectionError("down"), None]
+    delays = []
+
+    async def refresh_index_stats():
+        outcome = outcomes.pop(0)
+        if outcome is not None:
+            raise outcome
+        client.stats = object()
+
+    async def sleep(delay):
+        delays.append(delay)
+        if not outcomes:
+            raise asyncio.CancelledError
+
+    monkeypatch.setattr(client, "refresh_index_stats", refresh_index_stats)
+    monkeypatch.setattr(vectordb_client.asyncio, "sleep", sleep)
+    monkeypatch.setattr(vectordb_client.settings, "retry_backoff_base", 1.0)
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(client.refresh_forever())
+
+    assert client.is_ready()
+    assert 0.5 <= delays[0] <= 1.0 and 1.0 <= delays[1] <= 2.0
+    assert delays[2] == vectordb_client.settings.stats_refresh_interval
+
+
+class FakeAsyncIndex:
+    """Per-namespace query stand-in of IndexAsyncio with configurable latencies and failures."""
+
+    def __init__(self, namespaces: dict[str, list[tuple[str, float]]], delays: dict[str, float]) -> None:
+        self.namespaces = namespaces
+        self.delays = delays
+        self.filters = []
+
+    async def query(self, namespace, vector, top_k, filter, include_values, include_metadata):
+        self.filters.append(filter)
+        await asyncio.sleep(self.delays.get(namespace, 0))
+        if namespace == "broken":
+            raise ConnectionError("shard down")
+        matches = [
+            SimpleNamespace(id=vid, score=score, metadata={"source": vid}) for vid, score in self.namespaces[namespace]
+        ]
+        return SimpleNamespace(matches=matches[:top_k], usage={"read_units": 1})
+
+
+def ready_client(index: FakeAsyncIndex) -> PineConeClient:
+    client = PineConeClient()
+    client.async_index = index
+    client.namespaces = list(index.namespaces) + ["broken"]
+    client.stats = SimpleNamespace(namespaces={})
+    return client
+
+
+def test_query_merges_namespaces_and_flags_partial_results(monkeypatch):
+    """Slow and failing namespaces are left out and reported, the rest are merged by score."""
+    monkeypatch.setattr(vectordb_client.settings, "namespace_query_timeout", 0.05)
+    index = FakeAsyncIndex(
+        {"a": [("a1", 0.9), ("a2", 0.5)], "b": [("b1", 0.7), ("b2", 0.6)], "slow": [("s1", 0.99)]},
+        {"slow": 1.0},
+    )
+    client = ready_client(index)
+
+    results = asyncio.run(client.query([0.1], top_k=3))
+
+    assert [(match.id, match.namespace) for match in results.matches] == [("a1", "a"), ("b1", "b"), ("b2", "b")]
+    assert results.partial and results.failed_namespaces == ["broken", "slow"]
+    assert results.read_units == 2
+
+
+def test_query_routing():
+    """Only the requested namespaces are queried, sources are pushed down as a metadata filter."""
+    index = FakeAsyncIndex({"a": [("a1", 0.9)], "b": [("b1", 0.7)]}, {})
+    client = ready_client(index)
+
+    results = asyncio.run(client.query([0.1], top_k=3, namespaces=["b"], sources=["b1"]))
+
+    assert [match.id for match in results.matches] == ["b1"] and not results.partial
+    assert index.filters == [{"source": {"$eq": "b1"}}]
@@ -0,0 +1,83 @@
+"""Unit tests of the in-process vector database backend."""
+import json
+import asyncio
+
+import numpy as np
+
+from vectordb_local import LocalVectorStore
+
+
+def make_store(count: int = 50, dim: int = 8, seed: int = 0) -> tuple[LocalVectorStore, np.ndarray]:
+    """Random store with alternating namespaces and sources."""
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(count, dim)).astype(np.float32)
+    records = {
+        f"id-{i}": {
+            "values": vectors[i].tolist(),
+            "metadata": {"source": f"doc-{i % 3}.md", "content": f"chunk {i}"},
+            "namespace": f"ns-{i % 2}",
+        }
+        for i in range(count)
+    }
+    return LocalVectorStore.from_records(records), vectors
+
+
+def test_query_matches_brute_force_cosine():
+    """Top-k results equal an exact cosine similarity ranking."""
+    store, vectors = make_store()
+    query = np.random.default_rng(1).normal(size=8).astype(np.float32)
+
+    results = asyncio.run(store.query(query.tolist(), top_k=5))
+
+    cosine = vectors @ query / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(query))
+    expected = [f"id-{i}" for i in np.argsort(-cosine)[:5]]
+    assert [match.id for match in results.matches] == expected
+    assert np.allclose([match.score for match in results.matches], np.sort(cosine)[::-1][:5], atol=1e-5)
+    assert results.matches[0].metadata["content"] == f"chunk {expected[0].split('-')[1]}"
+
+
+def test_top_k_larger_than_corpus():
+    """Asking for more vectors than stored returns all of them."""
+    store, _ = make_store(count=3)
+    results = asyncio.run(store.query([1.0] * 8, top_k=10))
+    assert len(results.matches) == 3
+
+
+def test_sources_and_corpus_version():
+    """Source counts and the corpus version are derived from the stored vectors."""
+    store, _ = make_store(count=6)
+    assert store.return_sources() == [("doc-0.md", 2), ("doc-1.md", 2), ("doc-2.md", 2)]
+    assert store.corpus_version == "ns-0:3,ns-1:3"
+
+
+def test_query_routing_by_namespace_and_source():
+    """Routed queries only return vectors of the requested namespaces and sources."""
+    store, _ = make_store()
+    query = np.random.default_rng(1).normal(size=8).tolist()
+
+    results = asyncio.run(store.query(query, top_k=50, namespaces=["ns-1"], sources=["doc-0.md", "doc-1.md"]))
+
+    assert results.matches
+    assert all(match.namespace == "ns-1" for match in results.matches)
+    assert {match.metadata["source"] for match in results.matches} == {"doc-0.md", "doc-1.md"}
+    assert len(results.matches) == sum(1 for i in range(50) if i % 2 == 1 and i % 3 != 2)
+
+
+def test_facets_are_updated_incrementally():
+    """Aggregates follow added and removed vectors and equal a recount, the ETag changes with them."""
+    store, vectors = make_store(count=6)
+    facets = store.facets()
+    body, etag = facets.render()
+    assert json.loads(body)["facets"]["namespace"] == {"ns-0": 3, "ns-1": 3}
+
+    store.add({"new": {"values": vectors[0].tolist(), "metadata": {"main_category": "net"}, "namespace": "ns-2"}})
+    store.remove("id-1")
+    assert store.facets() is facets and facets.render()[1] != etag
+    assert store.return_sources() == [("Unknown Source", 1), ("doc-0.md", 2), ("doc-1.md", 1), ("doc-2.md", 2)]
+
+    recounted = LocalVectorStore.from_records({
+        store.id_at(row): {"values": store.vector_at(row), "metadata": store.metadata_at(row),
+                           "namespace": store.namespace_at(row)}
+        for row in store.live_rows()
+    })
+    assert recounted.facets().render() == facets.render()
@@ -0,0 +1,130 @@
+"""Inverted file (IVF) index of the local vector store for approximate nearest neighbour search.
+
+The normalized rows are clustered around k-means centroids, a query only scores the rows of the
+`nprobe` clusters whose centroids are nearest to it. The index of a snapshot generation is saved
+next to its vectors, so every worker maps the same files instead of training its own.
+"""
+import os
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# rows assigned to their nearest centroid at once, bounds the temporary score matrix
+ASSIGN_BLOCK_ROWS = 16384
+# k-means is trained on a sample of this many rows per list, at most MAX_TRAINING_ROWS
+TRAINING_ROWS_PER_LIST = 64
+MAX_TRAINING_ROWS = 131072
+FILES = ("ivf.centroids.npy", "ivf.offsets.npy", "ivf.rows.npy")
+
+
+class IVFIndex:
+    """Centroids and the rows of each list, as one array of rows sorted by list with start offsets.
+
+    Rows added after the index was built are assigned to their nearest list without retraining.
+    """
+
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, rows: np.ndarray) -> None:
+        self.centroids = centroids
+        self.offsets = offsets
+        self.rows = rows
+        self.added_rows = np.zeros(0, dtype=np.int64)
+        self.added_lists = np.zeros(0, dtype=np.int32)
+
+    @property
+    def lists(self) -> int:
+        return len(self.centroids)
+
+    def __len__(self) -> int:
+        return len(self.rows) + len(self.added_rows)
+
+    @classmethod
+    def train(cls, vectors: np.ndarray, lists: int, iterations: int = 8, seed: int = 0) -> "IVFIndex":
+        """Cluster the rows with spherical k-means on a sample, then assign every row to its nearest centroid."""
+        rng = np.random.default_rng(seed)
+        lists = max(1, min(lists, len(vectors)))
+        sample_size = min(len(vectors), lists * TRAINING_ROWS_PER_LIST, MAX_TRAINING_ROWS)
+        # sorted rows read the memory-mapped vectors sequentially
+        sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), size=sample_size, replace=False))])
+        centroids = sample[rng.choice(sample_size, size=lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = _nearest(sample, centroids)
+            order = np.argsort(assignments, kind="stable")
+            counts = np.bincount(assignments, minlength=lists)
+            # empty lists keep their centroid
+            filled = np.flatnonzero(counts)
+            sums = np.add.reduceat(sample[order], (np.cumsum(counts) - counts)[filled])
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids[filled] = sums / norms
+        return cls.assign(centroids, vectors)
+
+    @classmethod
+    def assign(cls, centroids: np.ndarray, vectors: np.ndarray) -> "IVFIndex":
+        """Index the rows with given centroids, e.g. those of the previous generation, without training."""
+        assignments = _nearest(vectors, centroids)
+        rows = np.argsort(assignments, kind="stable").astype(np.int64)
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assignments, minlength=len(centroids)))
+        return cls(centroids, offsets, rows)
+
+    def nearest(self, vectors: np.ndarray) -> np.ndarray:
+        """Nearest list of each row."""
+        return _nearest(vectors, self.centroids)
+
+    def add(self, rows: np.ndarray, vectors: np.ndarray, lists: np.ndarray | None = None) -> None:
+        """Assign rows added after the index was built to their nearest lists, unless `lists` are given."""
+        self.added_rows = np.concatenate([self.added_rows, np.asarray(rows, dtype=np.int64)])
+        self.added_lists = np.concatenate([self.added_lists, self.nearest(vectors) if lists is None else lists])
+
+    def probe(self, query_vector: np.ndarray, nprobe: int, min_rows: int = 0) -> np.ndarray:
+        """Sorted rows of the nprobe lists nearest to the normalized query.
+
+        More lists are probed, nearest first, while the probed ones hold fewer than `min_rows` rows.
+        """
+        nprobe = min(nprobe, self.lists)
+        scores = self.centroids @ query_vector
+        probed = np.argpartition(scores, -nprobe)[-nprobe:]
+        sizes = np.diff(self.offsets) + np.bincount(self.added_lists, minlength=self.lists)
+        if sizes[probed].sum() < min_rows:
+            order = np.argsort(-scores)
+            nprobe = min(int(np.searchsorted(np.cumsum(sizes[order]), min_rows)) + 1, self.lists)
+            probed = order[:nprobe]
+        rows = [self.rows[self.offsets[number]:self.offsets[number + 1]] for number in probed]
+        if len(self.added_rows):
+            rows.append(self.added_rows[np.isin(self.added_lists, probed)])
+        return np.sort(np.concatenate(rows))
+
+    def save(self, path: str) -> None:
+        """Write the index into a snapshot generation directory, atomically per file."""
+        for name, array in zip(FILES, (self.centroids, self.offsets, self.rows)):
+            tmp_path = os.path.join(path, f".{name}.{os.getpid()}.tmp")
+            with open(tmp_path, "wb") as file:
+                np.save(file, array)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, os.path.join(path, name))
+
+    @classmethod
+    def load(cls, path: str, count: int, dim: int) -> "IVFIndex | None":
+        """Map the index of a snapshot generation, None if there is none for `count` rows of `dim` dimensions."""
+        try:
+            centroids, offsets, rows = (np.load(os.path.join(path, name), mmap_mode="r") for name in FILES)
+        except (OSError, ValueError):
+            return None
+        if centroids.shape[1:] != (dim,) or len(offsets) != len(centroids) + 1 or len(rows) != count:
+            logger.warning("Ignoring the IVF index of %s, it does not match the snapshot", path)
+            return None
+        if int(offsets[-1]) != count:
+            return None
+        return cls(centroids, offsets, rows)
+
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """List of the nearest centroid of each row, block by block."""
+    assignments = np.zeros(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_BLOCK_ROWS):
+        block = np.asarray(vectors[start:start + ASSIGN_BLOCK_ROWS])
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
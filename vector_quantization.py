@@ -0,0 +1,90 @@
+"""Compact codes of the normalized vectors for the first phase of a two-phase local search.
+
+A query scans the codes instead of the float32 rows for a shortlist of candidates, only the
+shortlisted rows are read from the float32 matrix (memory-mapped from the snapshot) and rescored
+exactly, so the scan touches 4x (int8) or 32x (binary) less memory than an exact search.
+"""
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+# rows quantized at once, the float32 rows of a block are read from the memory map only once
+ENCODE_BLOCK_ROWS = 65536
+
+
+class Quantizer(ABC):
+    """Encodes normalized vectors into codes and scores a query against the codes."""
+
+    name = "none"
+
+    def fit(self, vectors: np.ndarray) -> "Quantizer":
+        """Learn the parameters of the codes from a sample of the vectors."""
+        return self
+
+    @abstractmethod
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """Codes of the rows of a float32 matrix."""
+
+    @abstractmethod
+    def scores(self, codes: np.ndarray, query_vector: np.ndarray) -> np.ndarray:
+        """Approximate similarity of the normalized query to every code, higher is more similar."""
+
+    def encode_blocks(self, vectors: np.ndarray) -> np.ndarray:
+        """Codes of a possibly memory-mapped matrix, encoded block by block."""
+        blocks = [self.encode(np.asarray(vectors[start:start + ENCODE_BLOCK_ROWS]))
+                  for start in range(0, len(vectors), ENCODE_BLOCK_ROWS)]
+        return np.concatenate(blocks) if blocks else self.encode(np.zeros((0, vectors.shape[1]), dtype=np.float32))
+
+
+class Int8Quantizer(Quantizer):
+    """Symmetric int8 codes with one scale per dimension, 1 byte per dimension."""
+
+    name = "int8"
+
+    def __init__(self) -> None:
+        self.scales: np.ndarray | None = None
+
+    def fit(self, vectors: np.ndarray) -> "Int8Quantizer":
+        peaks = np.zeros(vectors.shape[1], dtype=np.float32)
+        for start in range(0, len(vectors), ENCODE_BLOCK_ROWS):
+            np.maximum(peaks, np.abs(np.asarray(vectors[start:start + ENCODE_BLOCK_ROWS])).max(axis=0), out=peaks)
+        peaks[peaks == 0] = 1.0
+        self.scales = peaks / 127
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        # vectors added after the fit may exceed the peaks of their dimension and are clipped
+        return np.clip(np.rint(vectors / self.scales), -127, 127).astype(np.int8)
+
+    def scores(self, codes: np.ndarray, query_vector: np.ndarray) -> np.ndarray:
+        # dot(code * scales, query) == dot(code, scales * query), einsum casts the codes element by element
+        # instead of materializing a float32 copy of the matrix
+        scaled_query = (query_vector * self.scales).astype(np.float32)
+        return np.einsum("ij,j->i", codes, scaled_query, dtype=np.float32, casting="unsafe")
+
+
+class BinaryQuantizer(Quantizer):
+    """1-bit sign codes packed 8 dimensions per byte, compared by Hamming distance."""
+
+    name = "binary"
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.packbits(vectors > 0, axis=1)
+
+    def scores(self, codes: np.ndarray, query_vector: np.ndarray) -> np.ndarray:
+        query_code = np.packbits(query_vector > 0)
+        distances = np.bitwise_count(np.bitwise_xor(codes, query_code)).sum(axis=1, dtype=np.int32)
+        # dimensions with equal signs minus dimensions with different signs
+        return (len(query_vector) - 2 * distances).astype(np.float32)
+
+
+QUANTIZERS = {"int8": Int8Quantizer, "binary": BinaryQuantizer}
+
+
+def get_quantizer(name: str) -> Quantizer | None:
+    """New quantizer by name, None for "none" (exact search over the float32 rows)."""
+    if name == "none":
+        return None
+    if name not in QUANTIZERS:
+        raise ValueError(f"Unknown vector quantization: {name}")
+    return QUANTIZERS[name]()
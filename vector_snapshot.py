@@ -0,0 +1,340 @@
+"""Versioned on-disk snapshot of the vector index, memory-mapped read-only by every worker.
+
+Layout of a snapshot root directory:
+
+    CURRENT                 name of the active generation directory
+    LOCK                    flock held while a process writes a generation
+    SYNC.lock               flock held by the process syncing the root with Pinecone (see vector_sync.py)
+    <generation>/
+        manifest.json       format version, counts, metadata field names and encodings
+        vectors.f32         64 byte header + count x dim float32 rows (L2 normalized)
+        ids.bin, ids.off    UTF-8 vector ids, concatenated, with int64 start offsets (count + 1)
+        ids.order           int64 row numbers sorted by vector id, for binary search id -> row
+        namespaces.codes    int32 codes into the namespace dictionary of the manifest
+        col_<n>.codes       dictionary encoded metadata column (low cardinality), -1 when missing
+        col_<n>.bin/.off    JSON encoded metadata column values (high cardinality), empty when missing
+        ivf.*.npy           optional IVF index (see vector_ann.py), saved by the first worker that builds it
+
+Opening a snapshot reads the header and the manifest and maps the files, so startup time and
+private memory do not grow with the corpus, and all workers share the pages of the OS page cache.
+"""
+import logging
+import os
+import json
+import mmap
+import struct
+import fcntl
+import shutil
+import time
+from collections.abc import Sequence
+from contextlib import contextmanager
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+FORMAT_VERSION = 1
+MAGIC = b"BRLV"
+# magic, format version, vector count, dimension, flags, generation, padded to 64 bytes
+HEADER = struct.Struct("<4sIQIIQ36x")
+FLAG_NORMALIZED = 1
+# metadata columns with at most this many distinct values are dictionary encoded
+MAX_DICTIONARY_SIZE = 4096
+KEEP_GENERATIONS = 2
+
+
+class SnapshotError(Exception):
+    """The snapshot is missing, incomplete or corrupt."""
+
+
+class _StringColumn(Sequence):
+    """Read-only view of variable length byte strings stored in a blob with int64 offsets."""
+
+    def __init__(self, blob_path: str, offsets_path: str, count: int, decode) -> None:
+        self.offsets = np.memmap(offsets_path, dtype=np.int64, mode="r")
+        if len(self.offsets) != count + 1:
+            raise SnapshotError(f"{offsets_path} has {len(self.offsets) - 1} rows instead of {count}")
+        self.blob = _map_file(blob_path)
+        if int(self.offsets[-1]) != len(self.blob):
+            raise SnapshotError(f"{blob_path} is truncated")
+        self.decode = decode
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return self.decode(self.blob[start:end])
+
+
+class _DictionaryColumn(Sequence):
+    """Read-only view of a dictionary encoded column."""
+
+    def __init__(self, codes_path: str, dictionary: list, count: int) -> None:
+        self.codes = np.memmap(codes_path, dtype=np.int32, mode="r") if count else np.zeros(0, dtype=np.int32)
+        if len(self.codes) != count:
+            raise SnapshotError(f"{codes_path} has {len(self.codes)} rows instead of {count}")
+        self.dictionary = dictionary
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, row):
+        code = int(self.codes[row])
+        return None if code < 0 else self.dictionary[code]
+
+
+class SnapshotMetadata(Sequence):
+    """Lazily decoded metadata dicts of the snapshot rows."""
+
+    def __init__(self, columns: dict[str, Sequence], count: int) -> None:
+        self.columns = columns
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, row) -> dict:
+        if not 0 <= row < self.count:
+            raise IndexError(row)
+        metadata = {}
+        for field, column in self.columns.items():
+            value = column[row]
+            if value is not None:
+                metadata[field] = value
+        return metadata
+
+    def column(self, field: str) -> Sequence | None:
+        """Values of a single metadata field, None for rows without it."""
+        return self.columns.get(field)
+
+
+class VectorSnapshot:
+    """Memory-mapped read-only snapshot generation."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        try:
+            with open(os.path.join(path, "manifest.json"), "r", encoding="UTF-8") as file:
+                self.manifest = json.load(file)
+        except (OSError, ValueError) as err:
+            raise SnapshotError(f"Unreadable snapshot manifest in {path}: {err}") from err
+
+        if self.manifest.get("format_version") != FORMAT_VERSION:
+            raise SnapshotError(f"Unsupported snapshot format version: {self.manifest.get('format_version')}")
+
+        vectors_path = os.path.join(path, "vectors.f32")
+        with open(vectors_path, "rb") as file:
+            header = file.read(HEADER.size)
+        if len(header) != HEADER.size:
+            raise SnapshotError(f"{vectors_path} has no header")
+        magic, version, count, dim, flags, generation = HEADER.unpack(header)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise SnapshotError(f"{vectors_path} is not a version {FORMAT_VERSION} vector file")
+        if (count, dim, generation) != (self.manifest["count"], self.manifest["dim"], self.manifest["generation"]):
+            raise SnapshotError(f"{vectors_path} header does not match the manifest")
+        if os.path.getsize(vectors_path) != HEADER.size + count * dim * 4:
+            raise SnapshotError(f"{vectors_path} is truncated")
+
+        self.count = count
+        self.dim = dim
+        self.generation = generation
+        self.normalized = bool(flags & FLAG_NORMALIZED)
+        self.corpus_version = self.manifest.get("corpus_version")
+
+        if count:
+            self.vectors = np.memmap(vectors_path, dtype=np.float32, mode="r", offset=HEADER.size, shape=(count, dim))
+        else:
+            self.vectors = np.zeros((0, dim), dtype=np.float32)
+
+        self.ids = _StringColumn(
+            os.path.join(path, "ids.bin"), os.path.join(path, "ids.off"), count, lambda raw: raw.decode("UTF-8")
+        )
+        self.id_order = np.memmap(os.path.join(path, "ids.order"), dtype=np.int64, mode="r") if count else []
+        self.namespaces = _DictionaryColumn(
+            os.path.join(path, "namespaces.codes"), self.manifest["namespaces"], count
+        )
+
+        columns = {}
+        for n, column in enumerate(self.manifest["columns"]):
+            if column["encoding"] == "dictionary":
+                columns[column["field"]] = _DictionaryColumn(
+                    os.path.join(path, f"col_{n}.codes"), column["dictionary"], count
+                )
+            else:
+                columns[column["field"]] = _StringColumn(
+                    os.path.join(path, f"col_{n}.bin"), os.path.join(path, f"col_{n}.off"), count, _decode_json
+                )
+        self.metadata = SnapshotMetadata(columns, count)
+
+    @staticmethod
+    def current_path(root: str) -> str:
+        """Directory of the active generation of the snapshot root directory."""
+        try:
+            with open(os.path.join(root, "CURRENT"), "r", encoding="UTF-8") as file:
+                generation_dir = file.read().strip()
+        except OSError as err:
+            raise SnapshotError(f"No vector snapshot in {root}: {err}") from err
+        return os.path.join(root, generation_dir)
+
+    @classmethod
+    def open_current(cls, root: str) -> "VectorSnapshot":
+        """Open the active generation of the snapshot root directory."""
+        return cls(cls.current_path(root))
+
+    def row_of(self, vector_id: str) -> int | None:
+        """Row number of a vector id by binary search over the sorted id order."""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            middle_id = self.ids[int(self.id_order[middle])]
+            if middle_id < vector_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.ids[int(self.id_order[low])] == vector_id:
+            return int(self.id_order[low])
+        return None
+
+
+def write_snapshot(
+    root: str,
+    ids: Sequence[str],
+    vectors: np.ndarray,
+    metadata: Sequence[dict],
+    namespaces: Sequence[str],
+    corpus_version: str | None = None,
+) -> VectorSnapshot:
+    """Write a new snapshot generation, then atomically make it the active one.
+
+    Processes writing into the same root take turns, each one writes the next generation.
+    """
+    count = len(ids)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if vectors.ndim != 2 or len(vectors) != count:
+        raise ValueError(f"Expected {count} vectors in a 2 dimensional array, got shape {vectors.shape}")
+    dim = vectors.shape[1]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors = vectors / norms
+
+    with snapshot_lock(root):
+        return _write_generation(root, ids, vectors, metadata, namespaces, corpus_version, count, dim)
+
+
+@contextmanager
+def snapshot_lock(root: str):
+    """Exclusive lock of the snapshot root directory across processes."""
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, "LOCK"), "a") as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def _write_generation(root, ids, vectors, metadata, namespaces, corpus_version, count, dim) -> VectorSnapshot:
+    generation = _latest_generation(root) + 1
+    generation_dir = f"{generation:08d}"
+    tmp_path = os.path.join(root, f".{generation_dir}.tmp")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    with open(os.path.join(tmp_path, "vectors.f32"), "wb") as file:
+        file.write(HEADER.pack(MAGIC, FORMAT_VERSION, count, dim, FLAG_NORMALIZED, generation))
+        file.write(vectors.tobytes())
+
+    _write_strings(tmp_path, "ids", [vid.encode("UTF-8") for vid in ids])
+    np.array(sorted(range(count), key=lambda row: ids[row]), dtype=np.int64).tofile(os.path.join(tmp_path, "ids.order"))
+
+    namespace_dictionary = sorted(set(namespaces))
+    namespace_codes = {ns: code for code, ns in enumerate(namespace_dictionary)}
+    np.array([namespace_codes[ns] for ns in namespaces], dtype=np.int32).tofile(
+        os.path.join(tmp_path, "namespaces.codes")
+    )
+
+    fields = sorted({field for meta in metadata for field in meta})
+    columns = []
+    for n, field in enumerate(fields):
+        values = [meta.get(field) for meta in metadata]
+        encoded = [None if value is None else json.dumps(value, sort_keys=True) for value in values]
+        distinct = sorted({value for value in encoded if value is not None})
+        if len(distinct) <= MAX_DICTIONARY_SIZE and len(distinct) * 2 <= count:
+            codes = {value: code for code, value in enumerate(distinct)}
+            np.array([-1 if value is None else codes[value] for value in encoded], dtype=np.int32).tofile(
+                os.path.join(tmp_path, f"col_{n}.codes")
+            )
+            columns.append({
+                "field": field, "encoding": "dictionary", "dictionary": [json.loads(value) for value in distinct]
+            })
+        else:
+            _write_strings(tmp_path, f"col_{n}", [b"" if value is None else value.encode("UTF-8") for value in encoded])
+            columns.append({"field": field, "encoding": "json"})
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "generation": generation,
+        "count": count,
+        "dim": dim,
+        "corpus_version": corpus_version,
+        "created": time.time(),
+        "namespaces": namespace_dictionary,
+        "columns": columns,
+    }
+    with open(os.path.join(tmp_path, "manifest.json"), "w", encoding="UTF-8") as file:
+        json.dump(manifest, file)
+
+    for name in os.listdir(tmp_path):
+        with open(os.path.join(tmp_path, name), "rb") as file:
+            os.fsync(file.fileno())
+    os.rename(tmp_path, os.path.join(root, generation_dir))
+
+    current_tmp = os.path.join(root, "CURRENT.tmp")
+    with open(current_tmp, "w", encoding="UTF-8") as file:
+        file.write(generation_dir)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(current_tmp, os.path.join(root, "CURRENT"))
+
+    _prune_generations(root)
+    logger.info("Vector snapshot generation %s written with %d vectors to %s", generation_dir, count, root)
+    return VectorSnapshot(os.path.join(root, generation_dir))
+
+
+def _write_strings(path: str, name: str, values: list[bytes]) -> None:
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    if values:
+        offsets[1:] = np.cumsum([len(value) for value in values])
+    with open(os.path.join(path, f"{name}.bin"), "wb") as file:
+        for value in values:
+            file.write(value)
+    offsets.tofile(os.path.join(path, f"{name}.off"))
+
+
+def _decode_json(raw: bytes):
+    return json.loads(raw) if raw else None
+
+
+def _map_file(path: str):
+    """Map a file read-only, empty files cannot be mapped."""
+    if os.path.getsize(path) == 0:
+        return b""
+    with open(path, "rb") as file:
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _generations(root: str) -> list[str]:
+    return sorted(name for name in os.listdir(root) if name.isdigit())
+
+
+def _latest_generation(root: str) -> int:
+    generations = _generations(root)
+    return int(generations[-1]) if generations else 0
+
+
+def _prune_generations(root: str) -> None:
+    """Delete old generations, workers still mapping them keep their pages until they reopen."""
+    for name in _generations(root)[:-KEEP_GENERATIONS]:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
@@ -0,0 +1,162 @@
+"""Common interface of the vector database backends."""
+import json
+import hashlib
+from abc import ABC, abstractmethod
+from collections import Counter
+from dataclasses import dataclass, field
+
+from settings import settings
+
+_vector_store = None
+
+# metadata fields counted per value for GET /indexes, besides the namespaces
+FACET_FIELDS = ("source", "main_category", "sub_category")
+UNKNOWN_SOURCE = "Unknown Source"
+
+
+@dataclass
+class VectorMatch:
+    """Single scored vector of a query result, mirrors Pinecone's ScoredVectorWithNamespace."""
+    id: str
+    score: float
+    metadata: dict = field(default_factory=dict)
+    namespace: str = ""
+    # relevance assigned by the reranker, None when the match was not reranked
+    rerank_score: float | None = None
+
+
+@dataclass
+class QueryResults:
+    """Result of a vector query, mirrors Pinecone's QueryNamespacesResults."""
+    matches: list[VectorMatch]
+    read_units: int = 0
+    # namespaces that failed or missed their deadline, the matches are the best of the others
+    failed_namespaces: list[str] = field(default_factory=list)
+
+    @property
+    def partial(self) -> bool:
+        """Whether some namespaces are missing from the results."""
+        return bool(self.failed_namespaces)
+
+
+class Facets:
+    """Vector counts per namespace and per value of the FACET_FIELDS metadata.
+
+    Kept up to date as vectors are added and removed, the response body of GET /indexes and its
+    ETag are rendered once per change, so serving them does not depend on the corpus size.
+    """
+
+    def __init__(self) -> None:
+        self.counts: dict[str, Counter] = {name: Counter() for name in ("namespace",) + FACET_FIELDS}
+        self._rendered: tuple[bytes, str] | None = None
+
+    def count(self, name: str, values) -> None:
+        """Count the values of the namespace or a metadata field of many vectors, None where missing."""
+        self.counts[name].update(_facet_value(value) for value in values if value is not None)
+        self._rendered = None
+
+    def update(self, namespace: str, metadata: dict, delta: int = 1) -> None:
+        """Count an added (delta 1) or removed (delta -1) vector."""
+        self.counts["namespace"][namespace] += delta
+        for name in FACET_FIELDS:
+            value = metadata.get(name)
+            if value is not None:
+                self.counts[name][_facet_value(value)] += delta
+        self._rendered = None
+
+    @property
+    def vector_count(self) -> int:
+        return sum(self.counts["namespace"].values())
+
+    def sources(self) -> list[tuple[str, int]]:
+        """Sources with their vector counts, vectors without a source are counted as UNKNOWN_SOURCE."""
+        sources = {source: count for source, count in self.counts["source"].items() if count > 0}
+        unknown = self.vector_count - sum(sources.values())
+        if unknown:
+            sources[UNKNOWN_SOURCE] = sources.get(UNKNOWN_SOURCE, 0) + unknown
+        return sorted(sources.items())
+
+    def render(self) -> tuple[bytes, str]:
+        """JSON body and ETag of the aggregates, the ETag is the same in every worker with the same vectors."""
+        if self._rendered is None:
+            body = json.dumps({
+                "vector_count": self.vector_count,
+                "sources": dict(self.sources()),
+                "facets": {
+                    name: {value: count for value, count in sorted(counts.items()) if count > 0}
+                    for name, counts in self.counts.items() if name != "source"
+                },
+            }, sort_keys=True).encode()
+            self._rendered = body, '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        return self._rendered
+
+
+def _facet_value(value) -> str:
+    return value if isinstance(value, str) else json.dumps(value, sort_keys=True)
+
+
+class VectorStoreNotReady(Exception):
+    """The backend cannot serve queries at the moment, e.g. its startup is still in progress."""
+
+
+class VectorStore(ABC):
+    """Vector database backend queried by the retrieval stage."""
+
+    # changes whenever vectors are added or removed, see SemanticAnswerCache
+    corpus_version: str | None = None
+
+    async def warmup(self) -> None:
+        """Prepare the backend for serving queries."""
+
+    async def close(self) -> None:
+        """Release the resources of the backend."""
+
+    def is_ready(self) -> bool:
+        """Whether the backend can serve queries."""
+        return True
+
+    async def refresh_forever(self) -> None:
+        """Background maintenance of the backend, runs until cancelled."""
+
+    @abstractmethod
+    async def query(
+        self,
+        input_vector: list[float],
+        top_k=10,
+        namespaces: list[str] | None = None,
+        sources: list[str] | None = None,
+        nprobe: int | None = None,
+        metadata_filter: dict | None = None,
+    ) -> QueryResults:
+        """Return the top_k most similar vectors with their metadata.
+
+        The query is routed to the given namespaces (all by default) and to vectors whose `source`
+        metadata is one of the given sources (any by default) and that match the metadata filter,
+        see metadata_index. `nprobe` trades recall for latency in backends with an approximate index,
+        the others ignore it.
+        """
+
+    @abstractmethod
+    def facets(self) -> Facets | None:
+        """Return the aggregates of the stored vectors, None when no vectors are available locally."""
+
+    def return_sources(self) -> list[tuple[str, int]] | None:
+        """Return the metadata sources of the stored vectors with their vector counts."""
+        facets = self.facets()
+        return facets.sources() if facets is not None else None
+
+
+def get_vector_store() -> VectorStore:
+    """Get or create the singleton instance of the configured vector database backend."""
+    global _vector_store
+    if _vector_store is None:
+        # imported lazily so the local backend runs without the Pinecone client being configured
+        if settings.vector_backend == "local":
+            from vectordb_local import get_vector_replica
+            _vector_store = get_vector_replica()
+        elif settings.vector_backend == "pinecone":
+            from vectordb_client import get_pinecone_client
+            _vector_store = get_pinecone_client()
+        else:
+            raise ValueError(f"Unknown vector backend: {settings.vector_backend}")
+    return _vector_store
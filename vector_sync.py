@@ -0,0 +1,208 @@
+"""Incremental synchronization of the local vector replica with the Pinecone index."""
+import logging
+import os
+import time
+import fcntl
+import asyncio
+from dataclasses import dataclass, asdict
+
+from settings import settings
+from telemetry import configure_logging, stop_logging
+from vectordb_client import PINECONE_ERRORS, PineConeClient, get_pinecone_client
+from vectordb_local import LocalVectorStore, get_vector_replica
+from vector_snapshot import SnapshotError
+
+logger = logging.getLogger(__name__)
+
+_vector_sync = None
+
+
+@dataclass
+class SyncReport:
+    """Outcome of a single synchronization run."""
+    added: int = 0
+    removed: int = 0
+    read_units: int = 0
+    seconds: float = 0.0
+    compacted: bool = False
+    finished_at: float | None = None
+
+
+class VectorSync:
+    """Keep the local replica in sync with Pinecone by transferring only the changed vectors.
+
+    Every run lists the vector ids of each namespace, fetches only the ids missing from the replica
+    in concurrent batches and tombstones the ids that disappeared from the index. Vectors updated
+    in place under an existing id are not detected, re-upsert them under a new id or re-export.
+    The replica is compacted into a new snapshot generation once the pending changes exceed
+    `compact_ratio` of its size.
+
+    Only one process per snapshot root syncs, e.g. one of the gunicorn workers: it holds the SYNC.lock
+    flock of the root, the other processes reload the generations it writes and take over when it exits.
+    """
+
+    def __init__(
+        self,
+        pc_client: PineConeClient,
+        replica: LocalVectorStore,
+        snapshot_root: str,
+        fetch_concurrency: int = 8,
+        compact_ratio: float = 0.05,
+    ) -> None:
+        self.pc_client = pc_client
+        self.replica = replica
+        self.snapshot_root = snapshot_root
+        self.fetch_concurrency = fetch_concurrency
+        self.compact_ratio = compact_ratio
+        self.lock = asyncio.Lock()
+        # open SYNC.lock file while this process is the one syncing the snapshot root
+        self.leader_lock = None
+
+        self.runs = 0
+        self.failures = 0
+        self.read_units_used = 0
+        self.last_report: SyncReport | None = None
+        self.last_error: str | None = None
+
+    async def sync_once(self, force_compact: bool = False) -> SyncReport:
+        """Apply the vectors added to and removed from the index since the last run to the replica."""
+        async with self.lock:
+            started = time.perf_counter()
+            read_units_before = self.pc_client.read_units_used
+            report = SyncReport()
+
+            await self.pc_client.refresh_index_stats()
+            # a loop over every row, off the event loop
+            known_ids = await asyncio.to_thread(self.replica.namespace_ids)
+            namespaces = sorted(set(self.pc_client.namespaces) | set(known_ids))
+            remote_ids = await asyncio.gather(*(
+                self.pc_client.list_ids(ns) if ns in self.pc_client.namespaces else _no_ids()
+                for ns in namespaces
+            ))
+
+            # removals first, so ids that moved to another namespace are re-added there
+            added_ids = {}
+            for ns, remote in zip(namespaces, remote_ids):
+                remote = set(remote)
+                local = known_ids.get(ns, set())
+                for vector_id in local - remote:
+                    report.removed += self.replica.remove(vector_id)
+                if remote - local:
+                    added_ids[ns] = sorted(remote - local)
+
+            semaphore = asyncio.Semaphore(self.fetch_concurrency)
+            # appended at once after the fetches, appending every batch would copy the delta rows each time
+            fetched = {}
+
+            async def fetch(ids: list[str], namespace: str) -> None:
+                async with semaphore:
+                    fetched.update(await self.pc_client.fetch_vectors(ids, namespace))
+
+            batch = self.pc_client.max_batch_size
+            await asyncio.gather(*(
+                fetch(ids[start:start + batch], ns)
+                for ns, ids in added_ids.items()
+                for start in range(0, len(ids), batch)
+            ))
+            await self.replica.add_in_thread(fetched)
+            report.added = len(fetched)
+
+            if self.replica.pending_changes and (
+                force_compact
+                or self.replica.snapshot is None
+                or self.replica.pending_changes > self.compact_ratio * len(self.replica)
+            ):
+                await self.replica.compact(self.snapshot_root)
+                report.compacted = True
+
+            report.read_units = self.pc_client.read_units_used - read_units_before
+            report.seconds = round(time.perf_counter() - started, 3)
+            report.finished_at = time.time()
+            self.read_units_used += report.read_units
+            self.runs += 1
+            self.last_report = report
+            logger.info("Vector sync finished: %s", report)
+            return report
+
+    def lead(self) -> bool:
+        """Whether this process syncs the snapshot root, it does if no other process holds the sync lock."""
+        if self.leader_lock is None:
+            os.makedirs(self.snapshot_root, exist_ok=True)
+            # held open for as long as this process leads, closed by every failed attempt
+            file = open(os.path.join(self.snapshot_root, "SYNC.lock"), "a", encoding="UTF-8")
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                file.close()
+                return False
+            except BaseException:
+                file.close()
+                raise
+            self.leader_lock = file
+            logger.info("Process %d syncs the vector replica in %s", os.getpid(), self.snapshot_root)
+        return True
+
+    async def run_forever(self, interval: float) -> None:
+        """Synchronize on a fixed schedule until cancelled, or follow the process that does."""
+        while True:
+            try:
+                if self.lead():
+                    await self.sync_once()
+                else:
+                    await self.replica.reload(self.snapshot_root)
+                self.last_error = None
+            except (*PINECONE_ERRORS, SnapshotError) as err:  # the next run retries the whole delta
+                self.failures += 1
+                self.last_error = str(err)
+                logger.error("Vector sync failed: %s", err)
+            await asyncio.sleep(interval)
+
+    def status(self) -> dict:
+        """Return the read unit accounting and the outcome of the last run."""
+        return {
+            "role": "leader" if self.leader_lock is not None else "follower",
+            "runs": self.runs,
+            "failures": self.failures,
+            "read_units_used": self.read_units_used,
+            "replica_vectors": len(self.replica),
+            "pending_changes": self.replica.pending_changes,
+            "last_report": asdict(self.last_report) if self.last_report else None,
+            "last_error": self.last_error,
+        }
+
+
+async def _no_ids() -> list[str]:
+    return []
+
+
+def get_vector_sync() -> VectorSync:
+    """Get or create a singleton vector sync instance."""
+    global _vector_sync
+    if _vector_sync is None:
+        _vector_sync = VectorSync(
+            get_pinecone_client(),
+            get_vector_replica(),
+            settings.vector_snapshot_dir,
+            fetch_concurrency=settings.vector_sync_concurrency,
+            compact_ratio=settings.vector_sync_compact_ratio,
+        )
+    return _vector_sync
+
+
+async def _sync_and_compact() -> None:
+    vector_sync = get_vector_sync()
+    try:
+        if not vector_sync.lead():
+            logger.error("%s is synced by a running server, not syncing it again", vector_sync.snapshot_root)
+            return
+        await vector_sync.sync_once(force_compact=True)
+    finally:
+        await vector_sync.pc_client.close()
+
+
+if __name__ == "__main__":
+    configure_logging()
+    try:
+        asyncio.run(_sync_and_compact())
+    finally:
+        stop_logging()
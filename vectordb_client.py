@@ -1,227 +1,250 @@
-import os
-import sys
-import pickle
-import pprint
-from collections import Counter
-# from concurrent.futures import ThreadPoolExecutor, as_completed
-
+import logging
+import time
+import heapq
+import itertools
+import random
+import asyncio
+
+import aiohttp
 from pinecone import Pinecone
+from pinecone.exceptions import PineconeException
 
 from credentials.secrets import secrets
+from settings import settings
+from admission import TokenBucket
+from telemetry import PINECONE_READ_UNITS
+from vector_store import Facets, VectorStore, VectorStoreNotReady, VectorMatch, QueryResults
+from vectordb_local import get_vector_replica
+from metadata_index import filter_conditions, pinecone_filter
+
+logger = logging.getLogger(__name__)
 
 _pinecone_client = None
 
-class PineConeClient:
+# failures of a Pinecone request that a later one may not see: API errors, lost connections and timeouts
+PINECONE_ERRORS = (PineconeException, aiohttp.ClientError, OSError)
+
+class PineConeClient(VectorStore):
 
     def __init__(self) -> None:
         self.max_batch_size = 100
         self.index_name = "voyage1042dev"
         self.index_host = f"https://{self.index_name}-226a147.svc.aped-4627-b74a.pinecone.io"
         self.namespaces = [] # all nsses will be added automatically
-        self.cached_vectors = {}
-
-        # this value should be coming from the local cache
-        self.cached_vectors_count = None
-        self.local_cache = "cache/vectors.dict"
-        self.cache_refreshed_already = False
 
         # this data should be coming from the api
         self.ns_vectorcount = None
+        # changes whenever the index stats show that vectors were added or removed
+        self.corpus_version = None
         self.pc = Pinecone(api_key=secrets.vector_db_api_key)
-        self.index = self.pc.Index(name=self.index_name, host=self.index_host)
+        # the aiohttp backed index must be created inside the running event loop, see _get_async_index()
+        self.async_index = None
+        self.query_semaphore = asyncio.Semaphore(settings.vector_query_concurrency)
+        # every namespace of a fanned out query is a request against the quota
+        self.rate_limiter = TokenBucket("Pinecone", settings.pinecone_rps)
+        # loaded by warmup() and refresh_forever() in the background, queries are rejected until then
         self.stats = None
-        print("successfully connected to PineCone!")
-        self._refresh_index_stats()
+        self.stats_refreshed_at = None
 
         self.read_units_used = 0
 
-        # cache refresh is disabled for now (29 may 2025)
-        # if not self._cache_synced():
-        #     if not self.cache_refreshed_already:
-        #         self.refresh_cache()
-        #     else:
-        #         print("Something went wrong with the cache refresh, please reach out to your admin to refresh manually.")
-        # else:
-        #     print("Cache is synced")
-
-    def _refresh_index_stats(self) -> None:
+    async def refresh_index_stats(self) -> None:
+        """Reload the namespaces and vector counts of the index."""
+        self.stats = await self._get_async_index().describe_index_stats()
+        self.stats_refreshed_at = time.time()
+        self.ns_vectorcount = 0
+        for ns in self.stats.namespaces:
+            if ns not in self.namespaces:
+                logger.info("Namespace %s was not in the namespaces list, adding it", ns)
+                self.namespaces.append(ns)
+            self.ns_vectorcount = self.ns_vectorcount + int(self.stats.namespaces[ns].vector_count)
+        self.corpus_version = ",".join(
+            f"{ns}:{int(self.stats.namespaces[ns].vector_count)}" for ns in sorted(self.stats.namespaces)
+        )
+        logger.info("Refreshed index stats: %d vectors in %d namespaces", self.ns_vectorcount, len(self.namespaces))
+
+    def is_ready(self) -> bool:
+        """The index stats were loaded at least once, so the namespaces to query are known."""
+        return self.stats is not None
+
+    async def refresh_forever(self) -> None:
+        """Refresh the index stats periodically, retrying failures with exponential backoff."""
+        failures = 0
+        while True:
+            if self.is_ready() and not failures:
+                await asyncio.sleep(settings.stats_refresh_interval)
+            try:
+                await self.refresh_index_stats()
+                failures = 0
+            except PINECONE_ERRORS as err:  # a transient outage must not take the worker down
+                failures += 1
+                delay = min(settings.retry_backoff_max, settings.retry_backoff_base * 2 ** (failures - 1))
+                delay *= random.uniform(0.5, 1.0)
+                logger.warning(
+                    "Failed to refresh index stats (attempt %d), retrying in %.1fs: %s", failures, delay, err
+                )
+                await asyncio.sleep(delay)
+
+    def _get_async_index(self):
+        if self.async_index is None:
+            self.async_index = self.pc.IndexAsyncio(host=self.index_host)
+        return self.async_index
+
+    async def warmup(self) -> None:
+        """Load the index stats over a pooled connection so the first query skips the TLS handshake."""
         try:
-            self.stats = self.index.describe_index_stats()
-            print("successfully refreshed index stats:")
-            pprint.pprint(self.stats)
-            self.ns_vectorcount = 0
-            for ns in self.stats.namespaces:
-                if ns not in self.namespaces:
-                    print(f"namespace {ns} was not in the namespaces list, adding it...")
-                    self.namespaces.append(ns)
-                self.ns_vectorcount = self.ns_vectorcount + int(self.stats.namespaces[ns].vector_count)
-
-
-        except Exception as err:
-            sys.exit(f"Failed to refresh index stats, must exit: {err}")
-
-    def query(self, input_vector: list[float], top_k=10):
-        results = self.index.query_namespaces(
-            namespaces=self.namespaces,
-            metric="cosine",
+            await self.refresh_index_stats()
+            logger.info("Pinecone connection pool warmed up")
+        except PINECONE_ERRORS as err:
+            logger.warning("Failed to warm up the Pinecone connection pool, retrying in the background: %s", err)
+
+    def route(self, namespaces: list[str] | None = None) -> list[str]:
+        """Namespaces a query has to hit: the requested ones that exist and hold vectors."""
+        targets = [ns for ns in self.namespaces if namespaces is None or ns in namespaces]
+        if self.stats is not None:
+            targets = [
+                ns for ns in targets if ns not in self.stats.namespaces or self.stats.namespaces[ns].vector_count
+            ]
+        return targets
+
+    async def query(
+        self,
+        input_vector: list[float],
+        top_k=10,
+        namespaces: list[str] | None = None,
+        sources: list[str] | None = None,
+        nprobe: int | None = None,
+        metadata_filter: dict | None = None,
+    ) -> QueryResults:
+        """Query the namespaces of the index concurrently and merge the top_k matches as they arrive.
+
+        Namespaces that fail or miss the per-namespace deadline are reported in the failed_namespaces
+        of the results instead of stalling or failing the whole query.
+        """
+        if not self.is_ready():
+            raise VectorStoreNotReady("The Pinecone index stats have not been loaded yet")
+        # evaluated by Pinecone, so each namespace returns top_k matches of the filter
+        metadata_filter = pinecone_filter(filter_conditions(metadata_filter, sources))
+        targets = self.route(namespaces)
+        await self.rate_limiter.acquire(len(targets), max_wait=settings.rate_limit_max_wait)
+
+        async with self.query_semaphore:
+            tasks = {
+                asyncio.ensure_future(self._query_namespace(ns, input_vector, top_k, metadata_filter)): ns
+                for ns in targets
+            }
+            # min-heap of the best top_k (score, tie breaker, match) seen so far
+            heap = []
+            tie_breaker = itertools.count()
+            read_units = 0
+            failed_namespaces = []
+            pending = set(tasks)
+            deadline = asyncio.get_running_loop().time() + settings.namespace_query_timeout
+            while pending:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    namespace = tasks[task]
+                    try:
+                        response = task.result()
+                    except PINECONE_ERRORS as err:
+                        logger.warning("Query of namespace %s failed: %s", namespace, err)
+                        failed_namespaces.append(namespace)
+                        continue
+                    read_units += _read_units(response)
+                    for match in response.matches:
+                        entry = (match.score, next(tie_breaker), match, namespace)
+                        if len(heap) < top_k:
+                            heapq.heappush(heap, entry)
+                        elif match.score > heap[0][0]:
+                            heapq.heapreplace(heap, entry)
+            for task in pending:
+                task.cancel()
+                logger.warning("Query of namespace %s timed out", tasks[task])
+                failed_namespaces.append(tasks[task])
+
+        self.read_units_used += read_units
+        PINECONE_READ_UNITS.inc(read_units, operation="query")
+        if tasks and len(failed_namespaces) == len(tasks):
+            raise VectorStoreNotReady(f"No namespace answered the query: {sorted(failed_namespaces)}")
+
+        return QueryResults(
+            matches=[
+                VectorMatch(id=match.id, score=score, metadata=match.metadata or {}, namespace=namespace)
+                for score, _, match, namespace in sorted(heap, reverse=True)
+            ],
+            read_units=read_units,
+            failed_namespaces=sorted(failed_namespaces),
+        )
+
+    async def _query_namespace(self, namespace: str, input_vector: list[float], top_k: int, metadata_filter):
+        return await self._get_async_index().query(
+            namespace=namespace,
             vector=input_vector,
             top_k=top_k,
+            filter=metadata_filter,
             include_values=False,
             include_metadata=True,
-            show_progress=True,
         )
 
-        return results
+    async def close(self) -> None:
+        """Close the HTTP session of the async index."""
+        if self.async_index is not None:
+            await self.async_index.close()
+            self.async_index = None
+
+    async def list_ids(self, namespace: str) -> list[str]:
+        """List every vector id of a namespace."""
+        index = self._get_async_index()
+        ids = []
+        pagination_token = None
+        while True:
+            resp = await index.list_paginated(
+                namespace=namespace, limit=self.max_batch_size, pagination_token=pagination_token
+            )
+            self.read_units_used += _read_units(resp)
+            PINECONE_READ_UNITS.inc(_read_units(resp), operation="list")
+            ids.extend(vector.id for vector in resp.vectors)
+            if not resp.pagination or not resp.pagination.next:
+                return ids
+            pagination_token = resp.pagination.next
+
+    async def fetch_vectors(self, ids: list[str], namespace: str) -> dict[str, dict]:
+        """Fetch vectors with their values and metadata.
 
-    def return_sources(self):
+        Returns:
+            dict: vector id -> {"values": list[float], "metadata": dict, "namespace": str}
         """
-        Returns the sources from metadata of the vector embeddings
+        resp = await self._get_async_index().fetch(ids=ids, namespace=namespace)
+        self.read_units_used += _read_units(resp)
+        PINECONE_READ_UNITS.inc(_read_units(resp), operation="fetch")
+        return {
+            vid: {"values": list(vdata.values), "metadata": vdata.metadata or {}, "namespace": namespace}
+            for vid, vdata in resp.vectors.items()
+        }
+
+    def facets(self) -> Facets | None:
+        """
+        Returns the aggregates of the vectors, counted on the local replica of the index
 
         Args:
             no args
         Returns:
-            list: each item is a tuple with the source string and the number of vectors generated and stored from the doc
+            Facets: vector counts per namespace, source and category, None until the replica is synced
         """
-        if self.cached_vectors_count == 0:
-            return None
-        source_list = Counter(vector_data.get("metadata", {}).get("source", "Unknown Source") for _, vector_data in self.cached_vectors.items())
-        return sorted(source_list.items())
-
-    # def refresh_cache(self):
-    #     """Refresh the local cache of vectors.
-
-    #     This version fetches vector metadata in parallel to drastically
-    #     reduce wall-clock time for large namespaces. It batches IDs
-    #     (up to self.max_batch_size) and uses a thread pool to issue
-    #     concurrent fetch requests. The number of worker threads is
-    #     capped to avoid overwhelming the Pinecone API.
-    #     """
-    #     BATCH = min(self.max_batch_size, 1000)  # Pinecone max limit per request is 1000
-    #     MAX_WORKERS = min(32, os.cpu_count() * 5)
-
-    #     ru = 0
-    #     self.cached_vectors = {}
-
-    #     # Helper to process a single FetchResponse and merge into cache
-    #     def _process_fetch(resp, ns):
-    #         nonlocal ru
-    #         # Read units accounting
-    #         try:
-    #             if hasattr(resp, "usage") and hasattr(resp.usage, "read_units"):
-    #                 ru += int(resp.usage.read_units)
-    #             else:
-    #                 ru += int(getattr(resp, "usage", {}).get("read_units", 0))
-    #         except Exception:
-    #             pass
-
-    #         vectors_attr = resp.vectors if hasattr(resp, "vectors") else resp["vectors"]
-    #         for vid, vdata in vectors_attr.items():
-    #             metadata = vdata.metadata if hasattr(vdata, "metadata") else vdata["metadata"]
-    #             self.cached_vectors[vid] = {"metadata": metadata, "namespace": ns}
-
-    #     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
-    #         futures = []
-    #         for namespace in self.namespaces:
-    #             print(f"Listing vector IDs for namespace '{namespace}' …")
-    #             for ids_chunk in self.index.list(namespace=namespace, limit=BATCH):
-    #                 futures.append(pool.submit(self.index.fetch, ids=ids_chunk, namespace=namespace))
-
-    #         # Gather results
-    #         for fut in as_completed(futures):
-    #             try:
-    #                 resp = fut.result()
-    #                 ns = resp.namespace if hasattr(resp, "namespace") else None
-    #                 _process_fetch(resp, ns)
-    #             except Exception as exc:
-    #                 print(f"Fetch task failed: {exc}")
-
-    #     self.read_units_used += ru
-    #     print(f"Total read units used: {ru}")
-
-    #     # Persist cache
-    #     print("Serializing vectors to cache file …")
-    #     os.makedirs(os.path.dirname(self.local_cache), exist_ok=True)
-    #     with open(self.local_cache, "wb") as file:
-    #         pickle.dump(self.cached_vectors, file)
-
-    #     self.cached_vectors_count = len(self.cached_vectors)
-    #     self.cache_refreshed_already = True
-    #     print(f"Cache written with {self.cached_vectors_count} vectors.")
-
-    # def _cache_synced(self):
-    #     """
-    #     The function checks if we have a local replica, and loads the self.all_vectors with it, otherwise does not do anything
-    #     """
-    #     print("checking cache...")
-
-    #     cache_fully_synced = False
-
-    #     if os.path.exists(self.local_cache):
-    #         try:
-    #             with open(self.local_cache, "rb") as file:
-    #                 self.cached_vectors = pickle.load(file)
-    #                 self.cached_vectors_count = len(self.cached_vectors)
-    #                 if len(self.cached_vectors) == 0:
-    #                     print("vector file read successfully, but there are no vectors in it :(")
-    #                     cache_fully_synced = False
-    #                 elif self.cached_vectors_count != self.ns_vectorcount:
-    #                     print("we have a different amount of vectors in the cache than actually in the namespace..")
-    #                     print(f"ns: {self.ns_vectorcount} vs cache: {self.cached_vectors_count}")
-    #                     cache_fully_synced = False
-    #                 else:
-    #                     self.cached_vectors_count = len(self.cached_vectors)
-    #                     print(f"vector dict file read successfully, we have all the {self.cached_vectors_count} vectors in the cache as well.")
-    #                     cache_fully_synced = True
-    #         except KeyError as ke:
-    #             print(f"The cache file is unreadable, continuing. Error: {ke}")
-    #             cache_fully_synced = False
-    #         except Exception as e:
-    #             print(f"An error occurred during reading the vector file: {e}")
-    #             cache_fully_synced = False
-    #     else:  # os.path. not exists(self.local_cache)
-    #         cache_fully_synced = False
-
-    #     return cache_fully_synced
-
-
-def process_pc_qr(pinecone_response, mss: float) -> str | None:
-    """
-    Processes relevant vectors from Pinecone and extracts useful metadata fields
-    to create a structured context string.
-    """
-    relevant_vectors = [match for match in pinecone_response.matches if match.score > mss]
-
-    if not relevant_vectors:
-        return None
-
-    context_str_list = []
-
-    for i, match in enumerate(relevant_vectors, start=1):
-        metadata = match.metadata
-        score = match.score
-
-        # Define important fields to extract
-        important_fields = ["title", "main_header", "description", "header_0", "header_1", "header_2", "content"]
-        extracted_fields = {key: metadata.get(key, "N/A") for key in important_fields}
-
-        source = metadata.get("source", "Unknown")
-
-        # Construct the context string
-        context_str = (f"#### Context {i} BEGIN ####\n"
-                       f"Title: {extracted_fields['title']}\n"
-                       f"Main Header: {extracted_fields['main_header']}\n"
-                       f"Description: {extracted_fields['description']}\n"
-                       f"Header 0: {extracted_fields['header_0']}\n"
-                       f"Header 1: {extracted_fields['header_1']}\n"
-                       f"Header 2: {extracted_fields['header_2']}\n"
-                       f"Content:\n{extracted_fields['content']}\n\n"
-                       f"Source: {source}\n"
-                       f"Score: {score:.5f}\n"
-                       f"#### Context {i} END ####\n")
-
-        context_str_list.append(context_str)
-
-    return "\n".join(context_str_list)
+        return get_vector_replica().facets()
+
+
+def _read_units(resp) -> int:
+    """Read units consumed by a Pinecone data plane response."""
+    usage = getattr(resp, "usage", None)
+    if usage is None:
+        return 0
+    if isinstance(usage, dict):
+        return int(usage.get("read_units", 0) or 0)
+    return int(getattr(usage, "read_units", 0) or 0)
 
 
 def get_pinecone_client():
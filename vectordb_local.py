@@ -0,0 +1,563 @@
+"""In-process vector database backend for small corpora, dev and air-gapped deployments."""
+import os
+import time
+import logging
+import asyncio
+from collections import Counter
+from collections.abc import Sequence
+
+import numpy as np
+
+from settings import settings
+from vector_store import FACET_FIELDS, Facets, VectorStore, VectorMatch, QueryResults
+from vector_snapshot import VectorSnapshot, SnapshotMetadata, SnapshotError, write_snapshot
+from vector_quantization import Quantizer, get_quantizer
+from vector_ann import IVFIndex
+from metadata_index import PostingIndex, filter_conditions, matches
+
+logger = logging.getLogger(__name__)
+
+_vector_replica = None
+
+
+class LocalVectorStore(VectorStore):
+    """Cosine similarity search over vectors held in RAM or mapped from a snapshot.
+
+    Vectors are stored L2 normalized in one contiguous float32 matrix, so an exact query is a single
+    matrix-vector product followed by a partial sort of the scores. With int8 or binary quantization
+    the query scans compact codes of the rows instead and rescores a shortlist with the float32 rows.
+    With the IVF index only the rows of the clusters nearest to the query are scanned. Routed and
+    filtered queries look their rows up in posting indexes of the fields and only score those.
+
+    The store is also the local replica of the Pinecone index kept up to date by VectorSync:
+    added vectors go to an in-memory delta segment after the base rows, removed ones are
+    tombstoned, and `compact()` folds both into a new snapshot generation.
+    """
+
+    def __init__(
+        self,
+        ids: Sequence[str],
+        vectors: np.ndarray,
+        metadata: Sequence[dict],
+        namespaces: Sequence[str],
+        corpus_version: str | None = None,
+        normalized: bool = False,
+        snapshot: VectorSnapshot | None = None,
+        quantization: str = "none",
+        index: str = "flat",
+    ) -> None:
+        if index not in ("flat", "ivf"):
+            raise ValueError(f"Unknown vector index: {index}")
+        self.quantization = quantization
+        self.index = index
+        self._set_base(ids, vectors, metadata, namespaces, corpus_version, normalized, snapshot)
+
+    def _set_base(self, ids, vectors, metadata, namespaces, corpus_version, normalized, snapshot) -> None:
+        if not len(ids) == len(vectors) == len(metadata) == len(namespaces):
+            raise ValueError("ids, vectors, metadata and namespaces must have the same length")
+
+        self.snapshot = snapshot
+        self.ids = ids
+        self.metadata = metadata
+        self.namespaces = namespaces
+        # normalized input (e.g. a memory-mapped snapshot) is used as is, without a private copy
+        self.vectors = vectors if normalized else _normalize_rows(np.ascontiguousarray(vectors, dtype=np.float32))
+        self.base_count = len(ids)
+        # id -> row of the base segment, built on the first lookup unless the snapshot can binary search
+        self._base_rows: dict[str, int] | None = None
+        # namespace / metadata field -> object array of the base row values, built when the facets are counted
+        self._base_columns: dict[str, np.ndarray] = {}
+        # namespace / metadata field -> posting index of the base rows, built on the first filtered query
+        self._postings: dict[str, PostingIndex] = {}
+
+        self.delta_ids: list[str] = []
+        self.delta_metadata: list[dict] = []
+        self.delta_namespaces: list[str] = []
+        # delta vectors and tombstones of every row, with spare capacity for the rows added later
+        self._delta_buffer = np.zeros((0, self.vectors.shape[1]), dtype=np.float32)
+        self._delta_rows: dict[str, int] = {}
+        self._deleted_buffer = np.zeros(self.base_count, dtype=bool)
+        self.deleted_count = 0
+
+        self.quantizer: Quantizer | None = get_quantizer(self.quantization)
+        # codes of the base and delta rows, encoded on the first query or by the warmup
+        self._base_codes: np.ndarray | None = None
+        self._delta_codes: np.ndarray | None = None
+        # approximate index of the rows, built or loaded by the warmup, exact search until then
+        self.ann: IVFIndex | None = None
+        # aggregates of the live rows, counted on the first use and then updated by add() and remove()
+        self._facets: Facets | None = None
+
+        self.namespace_counts = Counter(namespaces)
+        self.corpus_version = corpus_version or self._corpus_version()
+
+    @classmethod
+    def from_records(
+        cls, records: dict[str, dict], quantization: str = "none", index: str = "flat"
+    ) -> "LocalVectorStore":
+        """Build the store from vector id -> {"values", "metadata", "namespace"} records."""
+        ids = list(records)
+        vectors = np.array([records[vid]["values"] for vid in ids], dtype=np.float32)
+        metadata = [records[vid].get("metadata") or {} for vid in ids]
+        namespaces = [records[vid].get("namespace") or "" for vid in ids]
+        return cls(ids, vectors.reshape(len(ids), -1), metadata, namespaces, quantization=quantization, index=index)
+
+    @classmethod
+    def from_snapshot(
+        cls, snapshot: VectorSnapshot, quantization: str = "none", index: str = "flat"
+    ) -> "LocalVectorStore":
+        """Serve the vectors of a memory-mapped snapshot."""
+        return cls(
+            snapshot.ids,
+            snapshot.vectors,
+            snapshot.metadata,
+            snapshot.namespaces,
+            corpus_version=snapshot.corpus_version,
+            normalized=snapshot.normalized,
+            snapshot=snapshot,
+            quantization=quantization,
+            index=index,
+        )
+
+    @classmethod
+    def load(cls, root: str, quantization: str = "none", index: str = "flat") -> "LocalVectorStore":
+        """Load the active snapshot written by `python vector_sync.py`."""
+        snapshot = VectorSnapshot.open_current(root)
+        logger.info("Mapped %d vectors of snapshot %s into the local vector store", snapshot.count, snapshot.path)
+        return cls.from_snapshot(snapshot, quantization, index)
+
+    @classmethod
+    def empty(cls, quantization: str = "none", index: str = "flat") -> "LocalVectorStore":
+        """Store without vectors."""
+        return cls([], np.zeros((0, 0), dtype=np.float32), [], [], quantization=quantization, index=index)
+
+    def __len__(self) -> int:
+        return self.base_count + len(self.delta_ids) - self.deleted_count
+
+    async def warmup(self) -> None:
+        """Encode the quantized codes, index the facet fields and build or load the IVF index before the first query."""
+        if self.quantizer is not None and len(self):
+            await asyncio.to_thread(self._encode_codes)
+        if self.base_count:
+            for name in ("namespace",) + FACET_FIELDS:
+                await asyncio.to_thread(self._posting_index, name)
+        if self.index == "ivf" and self.base_count and self.ann is None:
+            self.ann = await asyncio.to_thread(self._build_ann)
+
+    def _build_ann(self, centroids: np.ndarray | None = None) -> IVFIndex:
+        """Load the IVF index saved with the snapshot, or build it and save it there for the other workers.
+
+        With the centroids of a previous generation the rows are only assigned, k-means is not retrained.
+        """
+        dim = self.vectors.shape[1]
+        ann = IVFIndex.load(self.snapshot.path, self.base_count, dim) if self.snapshot is not None else None
+        if ann is None:
+            started = time.perf_counter()
+            if centroids is not None:
+                ann = IVFIndex.assign(centroids, self.vectors)
+            else:
+                ann = IVFIndex.train(self.vectors, settings.ivf_lists or int(np.sqrt(self.base_count)))
+            logger.info(
+                "Built an IVF index of %d lists over %d vectors in %.1fs",
+                ann.lists, self.base_count, time.perf_counter() - started,
+            )
+            if self.snapshot is not None:
+                try:
+                    ann.save(self.snapshot.path)
+                except OSError as err:
+                    logger.warning("Could not save the IVF index to %s: %s", self.snapshot.path, err)
+        if len(self.delta_ids):
+            ann.add(np.arange(self.base_count, self.base_count + len(self.delta_ids)), self.delta_vectors)
+        return ann
+
+    def _encode_codes(self) -> tuple[np.ndarray, np.ndarray]:
+        """Codes of the base and the delta rows, encoding the rows added since the last call."""
+        if self._base_codes is None:
+            sample = self.vectors if self.base_count else self.delta_vectors
+            if len(sample):
+                self.quantizer.fit(sample)
+            self._base_codes = self.quantizer.encode_blocks(self.vectors if self.base_count else self.delta_vectors[:0])
+            self._delta_codes = self.quantizer.encode_blocks(self.delta_vectors[:0])
+            logger.info(
+                "Encoded %d vectors into %s codes of %d bytes",
+                self.base_count, self.quantizer.name, self._base_codes.nbytes,
+            )
+        encoded = len(self._delta_codes)
+        if encoded < len(self.delta_ids):
+            self._delta_codes = np.concatenate([
+                self._delta_codes, self.quantizer.encode_blocks(self.delta_vectors[encoded:])
+            ])
+        return self._base_codes, self._delta_codes
+
+    def codes_nbytes(self) -> int:
+        """Memory of the quantized codes in bytes, 0 without quantization."""
+        if self.quantizer is None or self._base_codes is None:
+            return 0
+        return self._base_codes.nbytes + self._delta_codes.nbytes
+
+    def is_ready(self) -> bool:
+        """The replica holds vectors, either from a snapshot or from the first sync."""
+        return len(self) > 0
+
+    def _corpus_version(self) -> str:
+        return ",".join(f"{ns}:{count}" for ns, count in sorted(self.namespace_counts.items()) if count)
+
+    def row_of(self, vector_id: str) -> int | None:
+        """Row of a live vector id or None."""
+        row = self._delta_rows.get(vector_id)
+        if row is None:
+            if self.snapshot is not None:
+                row = self.snapshot.row_of(vector_id)
+            else:
+                if self._base_rows is None:
+                    self._base_rows = {vid: base_row for base_row, vid in enumerate(self.ids)}
+                row = self._base_rows.get(vector_id)
+        if row is None or self.deleted[row]:
+            return None
+        return row
+
+    def id_at(self, row: int) -> str:
+        """Vector id of a row."""
+        return self.ids[row] if row < self.base_count else self.delta_ids[row - self.base_count]
+
+    def vector_at(self, row: int) -> np.ndarray:
+        """Normalized vector of a row."""
+        return self.vectors[row] if row < self.base_count else self.delta_vectors[row - self.base_count]
+
+    def metadata_at(self, row: int) -> dict:
+        """Metadata of a row."""
+        return self.metadata[row] if row < self.base_count else self.delta_metadata[row - self.base_count]
+
+    def namespace_at(self, row: int) -> str:
+        """Namespace of a row."""
+        return self.namespaces[row] if row < self.base_count else self.delta_namespaces[row - self.base_count]
+
+    @property
+    def delta_vectors(self) -> np.ndarray:
+        """Normalized vectors of the delta rows."""
+        return self._delta_buffer[:len(self.delta_ids)]
+
+    @property
+    def deleted(self) -> np.ndarray:
+        """Tombstones of the base and delta rows."""
+        return self._deleted_buffer[:self.base_count + len(self.delta_ids)]
+
+    def live_rows(self) -> np.ndarray:
+        """Rows that are not tombstoned."""
+        return np.flatnonzero(~self.deleted)
+
+    def namespace_ids(self) -> dict[str, set[str]]:
+        """Ids of the live vectors per namespace."""
+        ids = {}
+        for row in self.live_rows():
+            ids.setdefault(self.namespace_at(row), set()).add(self.id_at(row))
+        return ids
+
+    def add(self, records: dict[str, dict]) -> None:
+        """Append vector id -> {"values", "metadata", "namespace"} records to the delta segment.
+
+        A live vector with the same id is tombstoned, so the new values replace it.
+        """
+        if records:
+            self._append(records, self._stage(records))
+
+    async def add_in_thread(self, records: dict[str, dict]) -> None:
+        """Like add(), with the vectors normalized, copied and assigned to their IVF lists in a thread."""
+        if records:
+            self._append(records, await asyncio.to_thread(self._stage, records))
+
+    def _stage(self, records: dict[str, dict]) -> tuple:
+        """Write the normalized vectors of the records after the delta rows, into a grown buffer when full.
+
+        Queries do not read past the delta rows, so this may run in a thread while they are served;
+        the staged rows become visible in `_append()`. Appends must not be staged concurrently.
+        """
+        vectors = _normalize_rows(np.array([record["values"] for record in records.values()], dtype=np.float32))
+        count = len(self.delta_ids)
+        buffer = self._delta_buffer
+        if not self.base_count and not count:
+            buffer = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+        buffer = _grow(buffer, count + len(vectors))
+        buffer[count:count + len(vectors)] = vectors
+        ann = self.ann
+        return buffer, vectors, ann, ann.nearest(vectors) if ann is not None else None
+
+    def _append(self, records: dict[str, dict], staged: tuple) -> None:
+        buffer, vectors, ann, lists = staged
+        for vector_id in records:
+            self.remove(vector_id)
+        first_row = self.base_count + len(self.delta_ids)
+        self._delta_buffer = buffer
+        self._deleted_buffer = _grow(self._deleted_buffer, first_row + len(records))
+        if self.ann is not None:
+            rows = np.arange(first_row, first_row + len(vectors))
+            self.ann.add(rows, vectors, lists if self.ann is ann else None)
+
+        for vector_id, record in records.items():
+            self._delta_rows[vector_id] = self.base_count + len(self.delta_ids)
+            self.delta_ids.append(vector_id)
+            self.delta_metadata.append(record.get("metadata") or {})
+            self.delta_namespaces.append(record.get("namespace") or "")
+            self.namespace_counts[record.get("namespace") or ""] += 1
+            if self._facets is not None:
+                self._facets.update(record.get("namespace") or "", record.get("metadata") or {})
+        self.corpus_version = self._corpus_version()
+
+    def remove(self, vector_id: str) -> bool:
+        """Tombstone the live vector with the id."""
+        row = self.row_of(vector_id)
+        if row is None:
+            return False
+        self.deleted[row] = True
+        self.deleted_count += 1
+        self.namespace_counts[self.namespace_at(row)] -= 1
+        if self._facets is not None:
+            self._facets.update(self.namespace_at(row), self.metadata_at(row), -1)
+        self._delta_rows.pop(vector_id, None)
+        self.corpus_version = self._corpus_version()
+        return True
+
+    @property
+    def pending_changes(self) -> int:
+        """Number of delta rows and tombstones not compacted into a snapshot yet."""
+        return len(self.delta_ids) + self.deleted_count
+
+    async def compact(self, root: str) -> None:
+        """Write the live vectors into a new snapshot generation and serve it from now on."""
+        rows = self.live_rows()
+        vectors = self.delta_vectors[rows[rows >= self.base_count] - self.base_count]
+        if self.base_count:
+            vectors = np.concatenate([np.asarray(self.vectors[rows[rows < self.base_count]]), vectors])
+        # written in a thread so queries are served from the current segments meanwhile
+        snapshot = await asyncio.to_thread(
+            write_snapshot,
+            root,
+            [self.id_at(row) for row in rows],
+            vectors,
+            [self.metadata_at(row) for row in rows],
+            [self.namespace_at(row) for row in rows],
+            self.corpus_version,
+        )
+        await self._serve(snapshot)
+
+    async def reload(self, root: str) -> bool:
+        """Serve the active generation of the snapshot root if another process wrote a new one.
+
+        Pending changes of this process are dropped, only the process syncing the root has any.
+        """
+        try:
+            path = VectorSnapshot.current_path(root)
+        except SnapshotError:
+            return False
+        if self.snapshot is not None and os.path.samefile(path, self.snapshot.path):
+            return False
+        snapshot = await asyncio.to_thread(VectorSnapshot, path)
+        await self._serve(snapshot)
+        logger.info("Reloaded %d vectors of snapshot %s into the local vector store", snapshot.count, snapshot.path)
+        return True
+
+    async def _serve(self, snapshot: VectorSnapshot) -> None:
+        ann = self.ann
+        self._set_base(
+            snapshot.ids, snapshot.vectors, snapshot.metadata, snapshot.namespaces,
+            snapshot.corpus_version, snapshot.normalized, snapshot,
+        )
+        if ann is not None:
+            # the new generation keeps the clusters of the previous one
+            self.ann = await asyncio.to_thread(self._build_ann, np.asarray(ann.centroids))
+        elif self.index == "ivf" and self.base_count:
+            self.ann = await asyncio.to_thread(self._build_ann)
+
+    def _column(self, name: str) -> np.ndarray:
+        """Values of the namespace or of a metadata field of every row, None where missing."""
+        base = self._base_columns.get(name)
+        if base is None:
+            if name == "namespace":
+                values = list(self.namespaces)
+            elif isinstance(self.metadata, SnapshotMetadata):
+                column = self.metadata.column(name)
+                values = list(column) if column is not None else [None] * self.base_count
+            else:
+                values = [metadata.get(name) for metadata in self.metadata]
+            base = self._base_columns[name] = np.array(values + [None], dtype=object)[:-1]
+        if name == "namespace":
+            delta = self.delta_namespaces
+        else:
+            delta = [metadata.get(name) for metadata in self.delta_metadata]
+        return np.concatenate([base, np.array(delta + [None], dtype=object)[:-1]])
+
+    def _posting_index(self, name: str) -> PostingIndex:
+        """Posting index of the namespace or of a metadata field over the base rows."""
+        postings = self._postings.get(name)
+        if postings is None:
+            if name == "namespace":
+                column = self.namespaces
+            elif isinstance(self.metadata, SnapshotMetadata):
+                column = self.metadata.column(name)
+                if column is None:
+                    column = [None] * self.base_count
+            else:
+                column = [metadata.get(name) for metadata in self.metadata]
+            if hasattr(column, "dictionary"):
+                # dictionary encoded snapshot column, indexed without decoding its rows
+                postings = PostingIndex.from_codes(column.codes, column.dictionary)
+            else:
+                postings = PostingIndex.from_values(column)
+            self._postings[name] = postings
+        return postings
+
+    def route(
+        self,
+        namespaces: list[str] | None = None,
+        sources: list[str] | None = None,
+        metadata_filter: dict | None = None,
+    ) -> np.ndarray | None:
+        """Sorted rows a routed or filtered query has to search, None to search every row.
+
+        The base rows of each condition come from the posting index of its field, the delta rows
+        are matched one by one.
+        """
+        conditions = filter_conditions(metadata_filter, sources)
+        if namespaces is not None:
+            conditions.insert(0, ("namespace", list(namespaces)))
+        if not conditions:
+            return None
+        rows = None
+        for field, values in conditions:
+            found = self._posting_index(field).lookup(values)
+            rows = found if rows is None else np.intersect1d(rows, found, assume_unique=True)
+            if not len(rows):
+                break
+        delta_rows = [
+            self.base_count + number
+            for number, (metadata, namespace) in enumerate(zip(self.delta_metadata, self.delta_namespaces))
+            if matches({**metadata, "namespace": namespace}, conditions)
+        ]
+        return np.concatenate([rows, np.array(delta_rows, dtype=np.int64)])
+
+    async def query(
+        self,
+        input_vector: list[float],
+        top_k=10,
+        namespaces: list[str] | None = None,
+        sources: list[str] | None = None,
+        nprobe: int | None = None,
+        metadata_filter: dict | None = None,
+    ) -> QueryResults:
+        """Return the top_k most similar vectors by cosine similarity.
+
+        Exact over every row without the IVF index, over the rows of the `nprobe` nearest clusters
+        (BARREL_IVF_NPROBE by default) with it. With quantization the top_k * BARREL_QUANTIZATION_RESCORE
+        best rows by their codes are rescored exactly, the returned scores are always exact. Routed and
+        filtered queries only score the rows matching the routing and the filter.
+        """
+        top_k = min(top_k, len(self))
+        if top_k <= 0:
+            return QueryResults(matches=[])
+
+        query_vector = _normalize_rows(np.asarray(input_vector, dtype=np.float32)[np.newaxis, :])[0]
+        shortlist = top_k if self.quantizer is None else top_k * settings.quantization_rescore
+        candidates = self.route(namespaces, sources, metadata_filter)
+        if self.ann is not None:
+            probed = self.ann.probe(query_vector, nprobe or settings.ivf_nprobe, min_rows=top_k)
+            if candidates is None:
+                # the probed lists may still hold fewer than top_k live rows, then every row is scanned
+                if len(probed) - np.count_nonzero(self.deleted[probed]) >= top_k:
+                    candidates = probed
+            elif len(candidates) > len(probed):
+                # scanning all routed rows when they are fewer than the probed ones is cheaper, and exact;
+                # so is it when a selective filter leaves too few of them in the probed clusters
+                probed = np.intersect1d(probed, candidates, assume_unique=True)
+                if len(probed) >= shortlist:
+                    candidates = probed
+
+        scores = self._scores(query_vector, candidates)
+        if self.deleted_count:
+            scores[self.deleted if candidates is None else self.deleted[candidates]] = -np.inf
+
+        shortlist = min(shortlist, len(scores))
+        if shortlist <= 0:
+            return QueryResults(matches=[])
+        positions = np.argpartition(scores, -shortlist)[-shortlist:]
+        # tombstoned rows
+        positions = positions[np.isfinite(scores[positions])]
+        rows = positions if candidates is None else candidates[positions]
+        if self.quantizer is None:
+            row_scores = scores[positions]
+        else:
+            rows, row_scores = self._rescore(rows, query_vector)
+        order = np.argsort(-row_scores)[:top_k]
+
+        return QueryResults(matches=[
+            VectorMatch(
+                id=self.id_at(row),
+                score=float(score),
+                metadata=self.metadata_at(row),
+                namespace=self.namespace_at(row),
+            )
+            for row, score in zip(rows[order], row_scores[order])
+        ])
+
+    def _scores(self, query_vector: np.ndarray, rows: np.ndarray | None = None, exact: bool = False) -> np.ndarray:
+        """Scores of the sorted rows, of every row by default, approximated by the codes with quantization."""
+        if self.quantizer is None or exact:
+            base, delta = self.vectors, self.delta_vectors
+            score = np.dot
+        else:
+            base, delta = self._encode_codes()
+            score = self.quantizer.scores
+        if rows is None:
+            base_part = base if self.base_count else None
+            delta_part = delta if len(self.delta_ids) else None
+        else:
+            split = np.searchsorted(rows, self.base_count)
+            base_part = np.asarray(base[rows[:split]]) if split else None
+            delta_part = delta[rows[split:] - self.base_count] if split < len(rows) else None
+        scores = [score(part, query_vector) for part in (base_part, delta_part) if part is not None]
+        return np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32)
+
+    def _rescore(self, rows: np.ndarray, query_vector: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Exact scores of the shortlisted rows, read from the float32 rows in storage order."""
+        rows = np.sort(rows)
+        return rows, self._scores(query_vector, rows, exact=True)
+
+    def facets(self) -> Facets | None:
+        """Aggregates of the live vectors, None when the store is empty."""
+        if not len(self):
+            return None
+        if self._facets is None:
+            facets = Facets()
+            live = ~self.deleted
+            for name in ("namespace",) + FACET_FIELDS:
+                facets.count(name, self._column(name)[live])
+            self._facets = facets
+        return self._facets
+
+
+def _grow(buffer: np.ndarray, rows: int) -> np.ndarray:
+    """The buffer if it has room for `rows` rows, else a copy with at least twice its capacity."""
+    if rows <= len(buffer):
+        return buffer
+    grown = np.zeros((max(rows, 2 * len(buffer), 64),) + buffer.shape[1:], dtype=buffer.dtype)
+    grown[:len(buffer)] = buffer
+    return grown
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def get_vector_replica() -> LocalVectorStore:
+    """Get or load the singleton local replica of the vector index from the active snapshot."""
+    global _vector_replica
+    if _vector_replica is None:
+        try:
+            _vector_replica = LocalVectorStore.load(
+                settings.vector_snapshot_dir, settings.vector_quantization, settings.vector_index
+            )
+        except SnapshotError as err:
+            logger.warning("Starting with an empty local vector replica: %s", err)
+            _vector_replica = LocalVectorStore.empty(settings.vector_quantization, settings.vector_index)
+    return _vector_replica